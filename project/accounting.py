@@ -0,0 +1,231 @@
+"""
+Token and cost accounting for the chat agent, per model call, turn and session.
+
+Every Responses API result carries usage (input tokens, the cached part of the
+input, output tokens). UsageLedger adds it up per browser session and prices it
+with MODEL_PRICES, so /usage shows which sessions drive spend and the chat
+shows what each turn cost.
+
+Budgets (per session, off unless set):
+    SESSION_TOKEN_BUDGET   total input + output tokens
+    SESSION_COST_BUDGET    estimated USD
+    SESSION_BUDGET_ACTION  what happens once a session is over budget, comma separated:
+                           "downgrade" routes every call to the fast model,
+                           "cap" limits turns to BUDGET_MAX_ITERATIONS iterations
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# USD per million tokens: input, cached input, output
+DEFAULT_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+}
+# Override or extend with a JSON object: {"model": [input, cached, output], ...}
+MODEL_PRICES = dict(DEFAULT_PRICES, **{
+    model: tuple(price) for model, price in json.loads(os.getenv("MODEL_PRICES", "{}")).items()
+})
+
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "0"))
+SESSION_COST_BUDGET = float(os.getenv("SESSION_COST_BUDGET", "0"))
+SESSION_BUDGET_ACTION = {a.strip() for a in os.getenv("SESSION_BUDGET_ACTION", "downgrade").split(",") if a.strip()}
+BUDGET_MAX_ITERATIONS = int(os.getenv("BUDGET_MAX_ITERATIONS", "3"))
+# Show the usage of each turn at the end of its chat reply
+SHOW_USAGE = os.getenv("CHAT_SHOW_USAGE", "1") == "1"
+
+MAX_SESSIONS = 1000
+
+_FOOTER_RE = re.compile(r"\s*\*\(Usage: [^\n]*\)\*\s*$")
+
+
+def price(model, input_tokens, cached_tokens, output_tokens):
+    """Estimated USD cost of one call; 0 for models without a price."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # Dated snapshots ("gpt-4o-2024-08-06") cost the same as their alias
+        prices = next((p for name, p in MODEL_PRICES.items() if model.startswith(name + "-")), None)
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + output_tokens * output_price) / 1_000_000
+
+
+def usage_counts(usage):
+    """(input, cached input, output) tokens from a Responses API usage object."""
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "input_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+    return getattr(usage, "input_tokens", 0) or 0, cached or 0, getattr(usage, "output_tokens", 0) or 0
+
+
+class Usage:
+    __slots__ = ("calls", "input_tokens", "cached_tokens", "output_tokens", "cost")
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    def add(self, input_tokens, cached_tokens, output_tokens, cost):
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.cached_tokens += cached_tokens
+        self.output_tokens += output_tokens
+        self.cost += cost
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+    def describe(self):
+        cached = f" ({_short(self.cached_tokens)} cached)" if self.cached_tokens else ""
+        return f"{_short(self.input_tokens)} in{cached}, {_short(self.output_tokens)} out, ${self.cost:.4f}"
+
+
+class SessionUsage:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.total = Usage()
+        self.by_model = {}  # model -> Usage
+        self.turns = 0
+        self.started_at = time.time()
+        self.last_used = self.started_at
+
+    def over_budget(self):
+        return bool((SESSION_TOKEN_BUDGET and self.total.total_tokens >= SESSION_TOKEN_BUDGET)
+                    or (SESSION_COST_BUDGET and self.total.cost >= SESSION_COST_BUDGET))
+
+    def to_dict(self):
+        return {
+            "session": self.session_id,
+            "turns": self.turns,
+            "over_budget": self.over_budget(),
+            "started_at": self.started_at,
+            "last_used": self.last_used,
+            **self.total.to_dict(),
+            "by_model": {model: usage.to_dict() for model, usage in self.by_model.items()},
+        }
+
+
+class TurnUsage(Usage):
+    """Usage of one turn, plus the budget decisions made for it at the start."""
+
+    __slots__ = ("session", "downgrade", "max_iterations")
+
+    def __init__(self, session, downgrade=False, max_iterations=None):
+        super().__init__()
+        self.session = session
+        self.downgrade = downgrade
+        self.max_iterations = max_iterations
+
+
+class UsageLedger:
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session id -> SessionUsage, least recently used first
+        self._lock = threading.Lock()
+
+    def start_turn(self, session_id):
+        """Begin accounting a turn of session_id. Returns its TurnUsage with the budget applied."""
+        session_id = session_id or "default"
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = SessionUsage(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            session.turns += 1
+            session.last_used = time.time()
+            over = session.over_budget()
+        turn = TurnUsage(session)
+        if over:
+            turn.downgrade = "downgrade" in SESSION_BUDGET_ACTION
+            turn.max_iterations = BUDGET_MAX_ITERATIONS if "cap" in SESSION_BUDGET_ACTION else None
+            for action in SESSION_BUDGET_ACTION:
+                metrics.BUDGET_ENFORCED.inc(action=action)
+            print(f"[USAGE] Session {session_id} is over budget ({session.total.describe()}): "
+                  f"{', '.join(sorted(SESSION_BUDGET_ACTION)) or 'no action'}")
+        return turn
+
+    def record(self, turn, model, usage):
+        """Add one model call's usage to its turn and session. Returns (input, cached, output, cost)."""
+        input_tokens, cached_tokens, output_tokens = usage_counts(usage)
+        cost = price(model, input_tokens, cached_tokens, output_tokens)
+        turn.add(input_tokens, cached_tokens, output_tokens, cost)
+        with self._lock:
+            session = turn.session
+            session.total.add(input_tokens, cached_tokens, output_tokens, cost)
+            session.by_model.setdefault(model, Usage()).add(input_tokens, cached_tokens, output_tokens, cost)
+        metrics.MODEL_TOKENS.inc(input_tokens - cached_tokens, model=model, kind="input")
+        metrics.MODEL_TOKENS.inc(cached_tokens, model=model, kind="cached")
+        metrics.MODEL_TOKENS.inc(output_tokens, model=model, kind="output")
+        metrics.MODEL_COST.inc(cost, model=model)
+        return input_tokens, cached_tokens, output_tokens, cost
+
+    def finish_turn(self, turn):
+        metrics.TURN_TOKENS.observe(turn.total_tokens)
+        metrics.TURN_COST.observe(turn.cost)
+
+    def session(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.to_dict() if session else None
+
+    def snapshot(self, limit=50):
+        """Totals and the sessions with the highest cost."""
+        with self._lock:
+            sessions = [session.to_dict() for session in self._sessions.values()]
+        total = Usage()
+        for session in sessions:
+            total.calls += session["calls"]
+            total.input_tokens += session["input_tokens"]
+            total.cached_tokens += session["cached_tokens"]
+            total.output_tokens += session["output_tokens"]
+            total.cost += session["cost_usd"]
+        sessions.sort(key=lambda session: session["cost_usd"], reverse=True)
+        return {
+            "sessions": len(sessions),
+            "total": total.to_dict(),
+            "budgets": {"tokens": SESSION_TOKEN_BUDGET, "cost_usd": SESSION_COST_BUDGET,
+                        "action": sorted(SESSION_BUDGET_ACTION)},
+            "top_sessions": sessions[:limit],
+        }
+
+
+def usage_footer(turn):
+    """Line appended to a chat reply with the turn's and the session's usage."""
+    return f"*(Usage: this turn {turn.describe()} · session ${turn.session.total.cost:.4f})*"
+
+
+def strip_usage_footer(text):
+    return _FOOTER_RE.sub("", text) if text else text
+
+
+def _short(count):
+    return f"{count / 1000:.1f}k" if count >= 1000 else str(count)
+
+
+usage_ledger = UsageLedger()
@@ -0,0 +1,141 @@
+"""
+Short aliases for Blockly ids in the text the model sees.
+
+Blockly ids are 20-character random strings, and the chat DSL repeats one per
+block (`↿ id ↾ ...`), per variable, and per variable reference (`VAR: "id"`).
+On large workspaces they are a big share of the prompt. IdAliases maps each id
+to a short alias (b1, b2, ... for blocks, v1, v2, ... for variables) in
+everything sent to the model, and maps the aliases in tool arguments back to
+the real ids before the tools run.
+
+Aliases are assigned in workspace order the first time an id is seen and never
+change or get reused, so the same workspace encodes to the same text on every
+iteration and turn and prompt cache prefixes keep matching. The table follows
+the server's workspace mirror (one workspace per server), which also tells it
+about blocks the agent created between two browser snapshots.
+"""
+
+import os
+import re
+import threading
+
+from workspace import parse_blocks
+
+ALIASES_ENABLED = os.getenv("CHAT_ID_ALIASES", "1") == "1"
+# Ids shorter than this are left alone outside `↿ ↾` markers, since they could be ordinary words
+MIN_FREE_TEXT_ID = 6
+MAX_ALIASES = 100000
+
+BLOCK, VARIABLE = "b", "v"
+_ALIAS_RE = re.compile(r"[bv]\d+$")
+_MARKER_RE = re.compile(r"(↿\s*)(\S+?)(\s*↾)")
+# Variable references in block commands: VAR: "v3"
+_VAR_REF_RE = re.compile(r'(\bVAR\s*:\s*")([bv]\d+)(")')
+
+# Tool arguments holding a block or variable id, and the ones holding a block command
+ID_ARGUMENTS = ("id", "block_id", "blockID", "parent_id", "variable")
+COMMAND_ARGUMENTS = ("command",)
+# Arguments that also take a variable name; a name that looks like an alias (a variable called "v2") is kept
+NAME_OR_ID_ARGUMENTS = ("variable",)
+
+
+class IdAliases:
+    def __init__(self, mirror, enabled=ALIASES_ENABLED):
+        self.mirror = mirror
+        self.enabled = enabled
+        self._to_alias = {}  # real id -> alias
+        self._to_id = {}  # alias -> real id
+        self._counters = {BLOCK: 0, VARIABLE: 0}
+        self._mirror_version = None
+        self._pattern = None  # Compiled matcher of the aliased ids, rebuilt when the table grows
+        self._lock = threading.RLock()
+
+    def alias(self, real_id, kind=BLOCK):
+        """Alias of real_id, assigning the next free one the first time it is seen."""
+        with self._lock:
+            alias = self._to_alias.get(real_id)
+            if alias is not None:
+                return alias
+            if _ALIAS_RE.match(real_id):
+                # An id that already looks like an alias stands for itself, so it is never ambiguous
+                alias = real_id
+            elif len(self._to_alias) >= MAX_ALIASES:
+                return real_id
+            else:
+                while True:
+                    self._counters[kind] += 1
+                    alias = f"{kind}{self._counters[kind]}"
+                    if alias not in self._to_id:
+                        break
+            self._to_alias[real_id] = alias
+            self._to_id[alias] = real_id
+            self._pattern = None
+            return alias
+
+    def learn(self):
+        """Alias the blocks and variables the mirror knows about, in workspace order."""
+        version = self.mirror.version
+        if version == self._mirror_version:
+            return
+        variable_ids, block_ids = self.mirror.ids()
+        with self._lock:
+            for variable_id in variable_ids:
+                self.alias(variable_id, VARIABLE)
+            for block_id in block_ids:
+                self.alias(block_id, BLOCK)
+            self._mirror_version = version
+
+    def encode(self, text):
+        """Replace the known ids in text with their aliases."""
+        if not self.enabled or not text:
+            return text
+        self.learn()
+        with self._lock:
+            for block_id, _, _ in parse_blocks(text):
+                self.alias(block_id, BLOCK)
+            text = _MARKER_RE.sub(lambda m: m.group(1) + self._to_alias.get(m.group(2), m.group(2)) + m.group(3), text)
+            pattern = self._compiled()
+            if pattern is None:
+                return text
+            return pattern.sub(lambda m: self._to_alias[m.group(0)], text)
+
+    def decode_id(self, value):
+        """Real id for an alias; anything else (like a full id from older history) passes through."""
+        if not self.enabled or not isinstance(value, str):
+            return value
+        with self._lock:
+            return self._to_id.get(value.strip(), value)
+
+    def decode_command(self, command):
+        """Replace variable aliases in a block command (VAR: "v3") with the real ids."""
+        if not self.enabled or not command:
+            return command
+        with self._lock:
+            return _VAR_REF_RE.sub(lambda m: m.group(1) + self._to_id.get(m.group(2), m.group(2)) + m.group(3), command)
+
+    def decode_args(self, args):
+        """Copy of a workspace tool's arguments with aliases turned back into real ids."""
+        if not self.enabled:
+            return args
+        decoded = dict(args)
+        for key in ID_ARGUMENTS:
+            if key not in decoded:
+                continue
+            if key in NAME_OR_ID_ARGUMENTS and self.mirror.has_variable_name(decoded[key]):
+                continue
+            decoded[key] = self.decode_id(decoded[key])
+        for key in COMMAND_ARGUMENTS:
+            if key in decoded:
+                decoded[key] = self.decode_command(decoded[key])
+        return decoded
+
+    def _compiled(self):
+        if self._pattern is None:
+            ids = sorted((i for i, a in self._to_alias.items() if len(i) >= MIN_FREE_TEXT_ID and i != a),
+                         key=len, reverse=True)
+            if not ids:
+                return None
+            # Ids contain punctuation, so delimit them by what can surround an id in the DSL and tool results
+            self._pattern = re.compile(
+                r"(?<![^\s\"'`(:↿])(?:" + "|".join(map(re.escape, ids)) + r")(?![^\s\"'`),.:↾])")
+        return self._pattern
@@ -0,0 +1,162 @@
+"""
+Cooperative cancellation for chat turns and test runs.
+
+A CancelToken is created per chat turn (or test run) and cancelled when the user
+presses stop, closes the tab or starts a new turn. Long waits check the token
+(or wait on it instead of sleeping) and raise Cancelled, and callbacks registered
+with on_cancel() abort work in flight, like closing a model response stream.
+
+chat.py makes a turn's token current with set_current() only while a tool call
+runs, so enqueue_operation and wait_for_result can find it; the handler passes
+the token explicitly everywhere else. Awaits are wrapped in cancellable() to be
+abandoned as soon as the token is cancelled; run_cancellable() does the same
+for blocking work on a worker thread, like test runs.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import threading
+
+_current_token = contextvars.ContextVar("current_cancel_token", default=None)
+_ids = itertools.count(1)
+
+
+class Cancelled(Exception):
+    """Raised where cancelled work notices it was cancelled."""
+
+    def __init__(self, reason="cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelToken:
+    def __init__(self, name=""):
+        self.id = f"{name or 'token'}-{next(_ids)}"
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """Cancel once; callbacks run on the cancelling thread. Returns False if already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(reason)
+            except Exception as e:
+                print(f"[CANCEL WARN] Cancel callback failed: {e}")
+        return True
+
+    def on_cancel(self, callback):
+        """Call callback(reason) when cancelled (now, if already). Returns a function that unregisters it."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+
+                return unregister
+        callback(self.reason)
+        return lambda: None
+
+    def wait(self, timeout=None):
+        """Sleep up to timeout, waking early on cancel. Returns True if cancelled."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+
+def current_token():
+    return _current_token.get()
+
+
+def set_current(token):
+    """Make token current until reset_current(handle)."""
+    return _current_token.set(token)
+
+
+def reset_current(handle):
+    _current_token.reset(handle)
+
+
+def run_cancellable(function, token, poll_interval=0.1):
+    """
+    Run blocking function on a worker thread until it finishes or token is cancelled.
+    For test runs; coroutines on the event loop use cancellable() instead.
+
+    On cancel, Cancelled is raised in the caller right away and the worker is
+    abandoned: nothing is injected into it, since an exception landing inside
+    library code could leave locks or pools of this shared process broken. The
+    abandoned work stops when it next checks the token itself (test.py makes the
+    generated llm_call/call_api helpers do that) or when it finishes; its result
+    is discarded.
+    """
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = function()
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    while True:
+        worker.join(poll_interval)
+        if not worker.is_alive():
+            break
+        if token.cancelled:
+            raise Cancelled(token.reason)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
+
+
+async def cancellable(awaitable, token):
+    """
+    Await awaitable until it finishes or token is cancelled.
+
+    On cancel the awaitable's task is cancelled (closing whatever it has open in
+    its finally blocks) and Cancelled is raised. The token may be cancelled from
+    any thread.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+    cancelled = loop.create_future()
+
+    def wake(reason):
+        loop.call_soon_threadsafe(_set_done, cancelled)
+
+    unregister = token.on_cancel(wake)
+    try:
+        await asyncio.wait({task, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        unregister()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if not cancelled.done():
+            cancelled.cancel()
+    if token.cancelled:
+        raise Cancelled(token.reason)
+    return task.result()
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(True)
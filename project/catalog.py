@@ -0,0 +1,191 @@
+"""
+Indexed catalog of the blocks described in blocks.txt.
+
+blocks.txt lines look like:
+    VALUE: math_arithmetic(inputs(OP: "ADD/MINUS/...", A: value, B: value)) // comment
+
+The catalog turns them into block name -> kind (VALUE/STATEMENT) -> inputs -> allowed
+enum values, so parsed create_block/replace_block commands can be checked locally
+before they are queued for the browser.
+"""
+
+import difflib
+import re
+from collections import namedtuple
+
+from dsl import Block, DSLSyntaxError, Literal, parse_command
+
+BlockSpec = namedtuple("BlockSpec", ["name", "kind", "category", "inputs", "repeatable", "note", "line"])
+InputSpec = namedtuple("InputSpec", ["name", "enum", "flag"])
+
+# Toolbox blocks that blocks.txt does not document. They are accepted by name,
+# but their inputs are not checked.
+UNDOCUMENTED_BLOCKS = {
+    "text_append": "STATEMENT",
+    "lists_setIndex": "STATEMENT",
+    "lists_getIndex": "VALUE",
+    "lists_getSublist": "VALUE",
+    "math_trig": "VALUE",
+    "cast_as": "VALUE",
+    "func_call": "VALUE",
+}
+
+# Blocks the agent is never allowed to create directly
+RESERVED_BLOCKS = ("create_mcp", "func_def")
+
+# Prefix for the per-input reference blocks of the MCP block (input_reference_NAME)
+INPUT_REFERENCE_PREFIX = "input_reference_"
+
+_LINE_RE = re.compile(r"^(VALUE|STATEMENT):\s*(.+?)\s*(?://\s*(.*))?$")
+_NUMBERED_RE = re.compile(r"^([A-Z_]*[A-Z])(\d+|N)$")
+
+
+class BlockValidationError(DSLSyntaxError):
+    """A command that parsed fine but does not match the block catalog."""
+
+
+class BlockCatalog:
+    def __init__(self, specs):
+        self.blocks = {spec.name: spec for spec in specs}
+        self.categories = {}
+        for spec in specs:
+            self.categories.setdefault(spec.category, []).append(spec)
+
+    def __contains__(self, name):
+        return self.kind(name) is not None
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def kind(self, name):
+        """Return "VALUE", "STATEMENT", or None if the block type is unknown."""
+        spec = self.blocks.get(name)
+        if spec:
+            return spec.kind
+        if name.startswith(INPUT_REFERENCE_PREFIX):
+            return "VALUE"
+        return UNDOCUMENTED_BLOCKS.get(name)
+
+    def input_spec(self, spec, key):
+        if key in spec.inputs:
+            return spec.inputs[key]
+        match = _NUMBERED_RE.match(key)
+        if match and match.group(2) != "N" and match.group(1) in spec.repeatable:
+            return spec.repeatable[match.group(1)]
+        return None
+
+    def validate(self, ast, placement_type=None):
+        """
+        Check a parsed command against the catalog.
+
+        Args:
+            ast: Root Block from dsl.parse_command
+            placement_type: The create_block placement type ("under", "input" or None)
+
+        Returns:
+            List of BlockValidationError, empty if the command is valid
+        """
+        errors = []
+
+        root_kind = self.kind(ast.name)
+        if ast.name in RESERVED_BLOCKS:
+            errors.append(BlockValidationError(f"You cannot create a `{ast.name}` block", ast.pos))
+            return errors
+        if root_kind == "VALUE" and placement_type == "under":
+            errors.append(BlockValidationError(
+                f"Cannot place value block '{ast.name}' under a statement block. Value blocks must be nested "
+                f"inside inputs of other blocks or placed in MCP outputs using type: \"input\"", ast.pos))
+        elif root_kind == "STATEMENT" and placement_type == "input":
+            errors.append(BlockValidationError(
+                f"Cannot place statement block '{ast.name}' in an MCP output slot; only value blocks can go there",
+                ast.pos))
+
+        self._validate_block(ast, errors, nested=False)
+        return errors
+
+    def _validate_block(self, block, errors, nested):
+        kind = self.kind(block.name)
+        if kind is None:
+            message = f"Unknown block type '{block.name}'"
+            suggestions = difflib.get_close_matches(block.name, list(self.blocks) + list(UNDOCUMENTED_BLOCKS), n=3)
+            if suggestions:
+                message += f". Did you mean: {', '.join(suggestions)}?"
+            errors.append(BlockValidationError(message, block.pos))
+            return
+
+        if nested and kind == "STATEMENT":
+            errors.append(BlockValidationError(
+                f"'{block.name}' is a statement block and cannot be nested as a value. Create it on its own "
+                f"and place statements inside it with type: \"under\"", block.pos))
+
+        spec = self.blocks.get(block.name)
+        for item in block.inputs:
+            if spec is not None:
+                input_spec = self.input_spec(spec, item.key)
+                if input_spec is None:
+                    allowed = [
+                        name for name in spec.inputs
+                    ] + [f"{prefix}0, {prefix}1, ..." for prefix in spec.repeatable]
+                    errors.append(BlockValidationError(
+                        f"'{block.name}' has no input '{item.key}'. Valid inputs: {', '.join(allowed) or '(none)'}",
+                        item.pos))
+                elif input_spec.enum and isinstance(item.value, Literal):
+                    value = _literal_text(item.value)
+                    if value not in input_spec.enum:
+                        errors.append(BlockValidationError(
+                            f"Invalid value {value!r} for '{block.name}' input '{item.key}'. "
+                            f"Allowed values: {', '.join(input_spec.enum)}",
+                            item.value.pos))
+            if isinstance(item.value, Block):
+                self._validate_block(item.value, errors, nested=True)
+
+
+def _literal_text(literal):
+    if literal.kind == "number" and literal.value == int(literal.value):
+        return str(int(literal.value))
+    return str(literal.value)
+
+
+def parse_catalog(text):
+    """Build a BlockCatalog from the contents of blocks.txt."""
+    specs = []
+    category = ""
+    for line_number, raw_line in enumerate(text.splitlines(), 1):
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            category = line.lstrip("#").strip()
+            continue
+
+        match = _LINE_RE.match(line)
+        if not match:
+            print(f"[CATALOG WARN] Could not parse blocks.txt line {line_number}: {line}")
+            continue
+        kind, signature, note = match.groups()
+
+        parsed = parse_command(signature)
+        if parsed.error:
+            print(f"[CATALOG WARN] Could not parse blocks.txt line {line_number}: {parsed.error.message}")
+            continue
+        ast = parsed.ast
+
+        inputs = {}
+        repeatable = {}
+        for item in ast.inputs:
+            enum = None
+            if isinstance(item.value, Literal) and item.value.kind == "string":
+                enum = tuple(item.value.value.split("/"))
+            numbered = _NUMBERED_RE.match(item.key)
+            # ADDN-style keys (documented with "as many N"), and 0-indexed series like IF0, IF1, IF2 are repeatable
+            growable = numbered and numbered.group(2) == "N" and "as many N" in (note or "")
+            if growable or (numbered and numbered.group(2) == "0"):
+                repeatable[numbered.group(1)] = InputSpec(numbered.group(1), enum, False)
+                continue
+            if numbered and numbered.group(2) != "N" and numbered.group(1) in repeatable:
+                continue
+            inputs[item.key] = InputSpec(item.key, enum, item.value is None)
+
+        specs.append(BlockSpec(ast.name, kind, category, inputs, repeatable, note or "", line))
+
+    return BlockCatalog(specs)
@@ -0,0 +1,378 @@
+"""
+Bounded, TTL-tagged channels for the browser request/result traffic.
+
+Every entry carries an expiry time. Expired entries (an operation no tab picked
+up in time, a result that arrived after its waiter gave up) and entries pushed
+out when a channel is full are dropped into a small dead-letter buffer and
+counted, so memory stays flat on a long-running server. A background reaper
+expires entries even when nothing reads the channel.
+
+Channel is a queue: each entry is consumed once. It keeps the part of the
+queue.Queue API the server uses (put, get_nowait, empty, qsize) and adds take(),
+which waits for and removes the first entry that matches a predicate, and
+take_async(), which does the same on an event loop without holding a thread.
+
+EventLog is an append-only log: every subscriber reads every event with its own
+cursor, so several tabs and observers can follow the same stream without taking
+events from each other.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import deque, namedtuple
+
+import metrics
+from cancellation import cancellable
+
+REAP_INTERVAL = float(os.getenv("CHANNEL_REAP_INTERVAL", "5"))
+DEAD_LETTER_SIZE = 100
+
+Entry = namedtuple("Entry", ["item", "enqueued_at", "expires_at"])
+DeadLetter = namedtuple("DeadLetter", ["item", "reason", "enqueued_at", "dropped_at"])
+
+_channels = weakref.WeakSet()
+_reaper_lock = threading.Lock()
+_reaper = None
+
+
+class _DeadLettering:
+    """Dead-letter buffer and drop counting shared by Channel and EventLog."""
+
+    def __init__(self, name, log_drops):
+        self.name = name
+        self.log_drops = log_drops
+        self.dead_letters = deque(maxlen=DEAD_LETTER_SIZE)
+        _channels.add(self)
+        _start_reaper()
+
+    def _dead_letter(self, item, reason, enqueued_at, now):
+        self.dead_letters.append(DeadLetter(item, reason, enqueued_at, now))
+        metrics.CHANNEL_DROPPED.inc(channel=self.name, reason=reason)
+        if self.log_drops and reason in ("expired", "overflow"):
+            print(f"[CHANNEL] Dropped {reason} entry from {self.name}: {str(item)[:200]}")
+
+    def dead_letter_dicts(self):
+        now = time.monotonic()
+        letters = list(self.dead_letters)
+        return [
+            {"item": letter.item, "reason": letter.reason,
+             "age_s": round(now - letter.enqueued_at, 3), "dropped_s_ago": round(now - letter.dropped_at, 3)}
+            for letter in letters
+        ]
+
+
+class Channel(_DeadLettering):
+    def __init__(self, name, maxsize=1000, ttl=30.0, log_drops=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = deque()
+        self._next_expiry = float("inf")  # Earliest expires_at in the channel, so reaping is usually free
+        self._cond = threading.Condition()
+        self._async_waiters = set()  # (loop, future) of take_async calls waiting for a put
+        super().__init__(name, log_drops)
+
+    def put(self, item, ttl=None):
+        now = time.monotonic()
+        with self._cond:
+            self._reap_locked(now)
+            if self.maxsize and len(self._items) >= self.maxsize:
+                # Full: the oldest entry is the least likely to still be wanted
+                self._drop_locked(self._items.popleft(), "overflow", now)
+            entry = Entry(item, now, now + (self.ttl if ttl is None else ttl))
+            self._items.append(entry)
+            self._next_expiry = min(self._next_expiry, entry.expires_at)
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, set()
+        _wake_async(waiters)
+
+    def get_nowait(self):
+        with self._cond:
+            self._reap_locked(time.monotonic())
+            if not self._items:
+                raise queue.Empty
+            return self._items.popleft().item
+
+    def take(self, predicate, timeout, cancel=None):
+        """
+        Wait for the first entry matching predicate and remove it.
+
+        Args:
+            predicate: Function of an item, True for the wanted entry
+            timeout: Seconds to wait
+            cancel: Optional CancelToken; cancelling it wakes the wait and raises Cancelled
+
+        Returns:
+            The item, or None if nothing matched within timeout
+        """
+        deadline = time.monotonic() + timeout
+        unregister = cancel.on_cancel(lambda reason: self._wake()) if cancel is not None else None
+        try:
+            with self._cond:
+                while True:
+                    if cancel is not None:
+                        cancel.raise_if_cancelled()
+                    now = time.monotonic()
+                    self._reap_locked(now)
+                    for index, entry in enumerate(self._items):
+                        if predicate(entry.item):
+                            del self._items[index]
+                            return entry.item
+                    if now >= deadline:
+                        return None
+                    self._cond.wait(deadline - now)
+        finally:
+            if unregister is not None:
+                unregister()
+
+    async def take_async(self, predicate, timeout, cancel=None):
+        """
+        take() for coroutines: waits on the running event loop instead of blocking a thread.
+
+        Returns the item, or None if nothing matched within timeout. Raises Cancelled
+        as soon as cancel (an optional CancelToken) is cancelled.
+        """
+        if cancel is not None:
+            return await cancellable(self._take_async(predicate, timeout), cancel)
+        return await self._take_async(predicate, timeout)
+
+    async def _take_async(self, predicate, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while True:
+            future = loop.create_future()
+            waiter = (loop, future)
+            with self._cond:
+                now = time.monotonic()
+                self._reap_locked(now)
+                for index, entry in enumerate(self._items):
+                    if predicate(entry.item):
+                        del self._items[index]
+                        return entry.item
+                if now >= deadline:
+                    return None
+                self._async_waiters.add(waiter)
+            try:
+                await asyncio.wait_for(future, deadline - now)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    self._async_waiters.discard(waiter)
+
+    def remove(self, predicate, reason="removed"):
+        """Drop every entry matching predicate. Returns how many were dropped."""
+        now = time.monotonic()
+        with self._cond:
+            kept = deque()
+            removed = 0
+            for entry in self._items:
+                if predicate(entry.item):
+                    self._drop_locked(entry, reason, now)
+                    removed += 1
+                else:
+                    kept.append(entry)
+            self._items = kept
+        return removed
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def qsize(self):
+        with self._cond:
+            self._reap_locked(time.monotonic())
+            return len(self._items)
+
+    def reap(self):
+        with self._cond:
+            return self._reap_locked(time.monotonic())
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _reap_locked(self, now):
+        if now < self._next_expiry:
+            return 0
+        expired = [entry for entry in self._items if entry.expires_at <= now]
+        self._items = deque(entry for entry in self._items if entry.expires_at > now)
+        self._next_expiry = min((entry.expires_at for entry in self._items), default=float("inf"))
+        for entry in expired:
+            self._drop_locked(entry, "expired", now)
+        return len(expired)
+
+    def _drop_locked(self, entry, reason, now):
+        self._dead_letter(entry.item, reason, entry.enqueued_at, now)
+
+
+class LogEvent:
+    __slots__ = ("id", "item", "appended_at", "expires_at", "delivered")
+
+    def __init__(self, event_id, item, appended_at, expires_at):
+        self.id = event_id
+        self.item = item
+        self.appended_at = appended_at
+        self.expires_at = expires_at
+        self.delivered = False
+
+
+class EventLog(_DeadLettering):
+    """
+    Bounded append-only log with increasing event ids.
+
+    Events stay readable until they age out (ttl) or are pushed out (maxsize).
+    Only events that no subscriber ever received are dead-lettered when that happens.
+    """
+
+    def __init__(self, name, maxsize=1000, ttl=30.0, log_drops=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._events = deque()
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._waiters = set()  # (loop, future) of subscribers waiting for the next event
+        super().__init__(name, log_drops)
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def append(self, item):
+        """Add an event and wake the subscribers. Returns its id."""
+        now = time.monotonic()
+        with self._lock:
+            self._reap_locked(now)
+            if self.maxsize and len(self._events) >= self.maxsize:
+                self._drop_locked(self._events.popleft(), "overflow", now)
+            self._last_id += 1
+            self._events.append(LogEvent(self._last_id, item, now, now + self.ttl))
+            waiters, self._waiters = self._waiters, set()
+        _wake_async(waiters)
+        return self._last_id
+
+    def read_after(self, cursor):
+        """Events with an id greater than cursor, oldest first, as (id, item) pairs."""
+        with self._lock:
+            self._reap_locked(time.monotonic())
+            newer = []
+            # Subscribers are usually caught up, so walk back from the newest event
+            for event in reversed(self._events):
+                if event.id <= cursor:
+                    break
+                newer.append((event.id, event.item))
+        newer.reverse()
+        return newer
+
+    def oldest_id(self):
+        """Id of the oldest event still in the log, or None if it is empty."""
+        with self._lock:
+            self._reap_locked(time.monotonic())
+            return self._events[0].id if self._events else None
+
+    def mark_delivered(self, event_id):
+        with self._lock:
+            for event in reversed(self._events):
+                if event.id == event_id:
+                    event.delivered = True
+                    break
+                if event.id < event_id:
+                    break
+
+    def start_cursor(self):
+        """Cursor for a new subscriber: just before the oldest event nobody received yet."""
+        with self._lock:
+            self._reap_locked(time.monotonic())
+            for event in self._events:
+                if not event.delivered:
+                    return event.id - 1
+            return self._last_id
+
+    async def wait(self, cursor, timeout):
+        """Wait until there are events after cursor. Returns False on timeout."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            if self._last_id > cursor:
+                return True
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def remove(self, predicate, reason="removed"):
+        """Drop every event matching predicate. Returns how many were dropped."""
+        now = time.monotonic()
+        with self._lock:
+            kept = deque()
+            removed = 0
+            for event in self._events:
+                if predicate(event.item):
+                    self._dead_letter(event.item, reason, event.appended_at, now)
+                    removed += 1
+                else:
+                    kept.append(event)
+            self._events = kept
+        return removed
+
+    def pending(self):
+        """Events no subscriber has received yet."""
+        with self._lock:
+            self._reap_locked(time.monotonic())
+            return sum(1 for event in self._events if not event.delivered)
+
+    def reap(self):
+        with self._lock:
+            return self._reap_locked(time.monotonic())
+
+    def _reap_locked(self, now):
+        # Events are appended in time order with one TTL, so expired ones are at the front
+        reaped = 0
+        while self._events and self._events[0].expires_at <= now:
+            self._drop_locked(self._events.popleft(), "expired", now)
+            reaped += 1
+        return reaped
+
+    def _drop_locked(self, event, reason, now):
+        if not event.delivered:
+            self._dead_letter(event.item, reason, event.appended_at, now)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def _wake_async(waiters):
+    """Resolve (loop, future) waiters from any thread."""
+    for loop, future in waiters:
+        try:
+            loop.call_soon_threadsafe(_resolve, future)
+        except RuntimeError:
+            pass  # The waiter's loop has closed
+
+
+def _reap_forever():
+    while True:
+        time.sleep(REAP_INTERVAL)
+        for channel in list(_channels):
+            try:
+                channel.reap()
+            except Exception as e:
+                print(f"[CHANNEL WARN] Reaper failed for {channel.name}: {e}")
+
+
+def _start_reaper():
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reap_forever, name="channel-reaper", daemon=True)
+            _reaper.start()
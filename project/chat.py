@@ -1,18 +1,36 @@
 import os
 import re
 import requests
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from openai import OpenAI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from openai import AsyncOpenAI
 import gradio as gr
 import asyncio
-import queue
+import threading
 import json
 import uuid
 import time
+from collections import OrderedDict
 from colorama import Fore, Style
 from huggingface_hub import HfApi
+from dsl import parse_command
+from catalog import parse_catalog
+from retrieval import BlockDocsIndex
+from history import HistoryManager, normalize_history
+import metrics
+import tracing
+import cancellation
+from channels import Channel, EventLog
+from cancellation import CancelToken, Cancelled
+from replay import Recorder
+from workspace import WorkspaceMirror, ROOT
+from aliases import IdAliases
+from mcp_pool import mcp_pool, function_tool_name, result_text
+from routing import model_router
+from resilience import openai_service, hub_service, call_sync, status_of, StreamError
+from accounting import usage_ledger, usage_footer, SHOW_USAGE
+from response_cache import response_cache, cache_key, PlanRecorder, PlanReplay
 
 # Initialize OpenAI client (will be updated when API key is set)
 client = None
@@ -27,14 +45,123 @@ latest_blockly_chat_code = ""
 # Global variable to store the workspace's variables
 latest_blockly_vars = ""
 
-# Unified queue for all block operation requests (Py -> JS)
-requests_queue = queue.Queue()
+# Indexed copy of the workspace, rebuilt from each snapshot and updated as operations succeed
+workspace_mirror = WorkspaceMirror()
+# Short aliases for the block and variable ids in everything the model sees (see aliases.py)
+id_aliases = IdAliases(workspace_mirror)
+
+# Workspaces longer than this go to the model as a summary; it looks blocks up with find_blocks
+WORKSPACE_CONTEXT_CHARS = int(os.getenv("WORKSPACE_CONTEXT_CHARS", "6000"))
+
+# Unified log of all block operation requests (Py -> JS).
+# Every /unified_stream subscriber (each open tab) reads it with its own cursor.
+# Operations no tab received within the TTL are dead-lettered; a waiter has given up on them by then.
+operations_log = EventLog(
+    "requests",
+    maxsize=int(os.getenv("REQUESTS_QUEUE_MAXSIZE", "1000")),
+    ttl=float(os.getenv("REQUESTS_QUEUE_TTL", "10")),
+)
+
+# Unified queue for all request results from frontend (JS -> Py), consumed by the tool waiters.
+# Results that arrive after their waiter timed out expire instead of piling up. With several tabs
+# open every tab answers, so the extra copies expiring is normal and not logged.
+results_queue = Channel(
+    "results",
+    maxsize=int(os.getenv("RESULTS_QUEUE_MAXSIZE", "1000")),
+    ttl=float(os.getenv("RESULTS_QUEUE_TTL", "30")),
+    log_drops=False,
+)
+
+# The same results as a log for /results_stream observers, which must not take them from the waiters
+results_log = EventLog(
+    "results_log",
+    maxsize=int(os.getenv("RESULTS_QUEUE_MAXSIZE", "1000")),
+    ttl=float(os.getenv("RESULTS_QUEUE_TTL", "30")),
+    log_drops=False,
+)
 
-# Unified queue for all request results from frontend (JS -> Py)
-results_queue = queue.Queue()
+# Seconds an idle stream waits for new events before sending a heartbeat
+SSE_HEARTBEAT_INTERVAL = 30
+
+# SSE event ids are "<epoch>-<log id>". The epoch changes on every server start, so a tab
+# reconnecting with an id from an earlier process starts fresh instead of skipping new events.
+SSE_EPOCH = uuid.uuid4().hex[:8]
+
+def stream_event_id(event_id):
+    return f"{SSE_EPOCH}-{event_id}"
+
+def sse_event(event_id, data):
+    return f"id: {stream_event_id(event_id)}\ndata: {json.dumps(data)}\n\n"
+
+def resume_cursor(log, last_event_id):
+    """Cursor to resume a stream after the Last-Event-ID a client sent, or None to start fresh."""
+    if not last_event_id:
+        return None
+    epoch, _, event_id = last_event_id.rpartition("-")
+    if epoch != SSE_EPOCH or not event_id.isdigit():
+        return None
+    cursor = int(event_id)
+    if cursor > log.last_id:
+        return None
+    oldest = log.oldest_id()
+    if oldest is not None and cursor < oldest - 1:
+        print(f"[SSE RESUME] {log.name}: events before {oldest} expired, resuming from there (client had {cursor})")
+    return cursor
+
+metrics.SSE_QUEUE_DEPTH.set_function(operations_log.pending)
+metrics.RESULTS_QUEUE_DEPTH.set_function(results_queue.qsize)
+
+# Cancelled chat turns whose operations must not reach the browser anymore
+cancelled_turns = OrderedDict()
+CANCELLED_TURNS_LIMIT = 100
+
+# When each operation was queued and when it was actually sent to the browser, keyed by operation_key()
+operation_enqueued_at = OrderedDict()
+operation_sent_at = OrderedDict()
+OPERATION_SENT_AT_LIMIT = 1000
+
+def operation_key(request):
+    """Key of an operation for timing spans: the request type and the id its result is matched by."""
+    if request.get("type") == "delete":
+        return f"delete_{request.get('block_id')}"
+    return f"{request.get('type')}_{request.get('request_id')}"
+
+def enqueue_operation(data):
+    """Queue a workspace operation for the browser, tagged with the chat turn that asked for it."""
+    token = cancellation.current_token()
+    if token is not None:
+        data["turn_id"] = token.id
+    operation_enqueued_at[operation_key(data)] = time.time()
+    if len(operation_enqueued_at) > OPERATION_SENT_AT_LIMIT:
+        operation_enqueued_at.popitem(last=False)
+    operations_log.append(data)
+
+def purge_operations(turn_id):
+    """Remove a turn's operations from the log so no tab (including ones that reconnect) gets them. Returns how many."""
+    return operations_log.remove(lambda request: request.get("turn_id") == turn_id, reason="cancelled")
+
+def record_operation_timing(request_key, start_time, result=None, error=None):
+    """Attach queue wait and browser round trip spans to the active tool call span."""
+    span = tracing.current_span()
+    sent_at = operation_sent_at.pop(request_key, None)
+    # The queue wait starts when the operation was queued, which is before its tool started waiting
+    queued_at = operation_enqueued_at.pop(request_key, start_time)
+    if span is None:
+        return
+    now = time.time()
+    if sent_at is None:
+        span.record("queue_wait", queued_at, now, request_key=request_key, sent=False)
+    else:
+        span.record("queue_wait", queued_at, sent_at, request_key=request_key)
+        browser = span.record("browser_result", sent_at, now, request_key=request_key)
+        if result is not None:
+            browser.set(success=result.get("success"), block_id=result.get("block_id"),
+                        variable_id=result.get("variable_id"), error=result.get("error"))
+    if error is not None:
+        span.error(error)
 
 # Helper function to wait for a result from the unified queue
-def wait_for_result(request_id, request_type, timeout=8, id_field='request_id'):
+async def wait_for_result(request_id, request_type, timeout=8, id_field='request_id'):
     """
     Wait for a result from the unified results_queue.
     Matches results by request_id and request_type.
@@ -46,48 +173,57 @@ def wait_for_result(request_id, request_type, timeout=8, id_field='request_id'):
         id_field: Field name to match against (default 'request_id', use 'block_id' for delete)
         
     Returns:
-        Result dict if found and successful, raises exception otherwise
+        Result dict if found and successful, raises exception otherwise (Cancelled if the turn is cancelled)
     """
     start_time = time.time()
-    check_interval = 0.05
-    results_buffer = []  # Buffer for results we read but don't match
+    token = cancellation.current_token()
     
-    while time.time() - start_time < timeout:
-        # Check if we have buffered results that match
-        for i, result in enumerate(results_buffer):
-            if (result.get(id_field) == request_id and 
-                result.get('request_type') == request_type):
-                results_buffer.pop(i)
-                return result
-        
-        # Try to get a new result from queue
-        try:
-            result = results_queue.get_nowait()
-            # Check if this is our result
-            if (result.get(id_field) == request_id and 
-                result.get('request_type') == request_type):
-                # Put back any buffered results we collected
-                for buffered in results_buffer:
-                    results_queue.put(buffered)
-                results_buffer = []
-                return result
-            else:
-                # Not our result, buffer it for other functions to find
-                results_buffer.append(result)
-        except queue.Empty:
-            pass
-        
-        time.sleep(check_interval)
+    def matches(result):
+        return result.get(id_field) == request_id and result.get('request_type') == request_type
+    
+    # Take only our result; other waiters' results stay in the queue for them. Waiting holds no thread.
+    try:
+        result = await results_queue.take_async(matches, timeout, cancel=token)
+    except Cancelled as error:
+        record_operation_timing(f"{request_type}_{request_id}", start_time, error=error)
+        raise
     
-    # Timeout - put back any buffered results
-    for buffered in results_buffer:
-        results_queue.put(buffered)
+    if result is not None:
+        metrics.TOOL_ROUNDTRIP_SECONDS.observe(time.time() - start_time, request_type=request_type)
+        record_operation_timing(f"{request_type}_{request_id}", start_time, result)
+        return result
     
-    raise TimeoutError(f"No response received for {request_type} request {request_id} after {timeout} seconds")
+    metrics.TOOL_TIMEOUTS.inc(request_type=request_type)
+    error = TimeoutError(f"No response received for {request_type} request {request_id} after {timeout} seconds")
+    record_operation_timing(f"{request_type}_{request_id}", start_time, error=error)
+    raise error
+
+def format_command_error(parsed):
+    """Build the tool result for a command that failed to parse, pointing at the exact position."""
+    return (
+        f"[ERROR] Malformatted command: {parsed.error.describe(parsed.command)}\n\n"
+        f"The attempted command was:\n\n`{parsed.command}`\n\n"
+        f"Please fix the command at the marked position and retry."
+    )
+
+def format_validation_errors(command, errors):
+    """Build the tool result for a command that parsed but uses blocks, inputs or values that don't exist."""
+    details = "\n\n".join(f"- {error.describe(command)}" for error in errors)
+    return (
+        f"[ERROR] Invalid command. Block operation was **not** executed:\n\n{details}\n\n"
+        f"Please fix these problems and retry."
+    )
 
 # Global variable to store the deployed HF MCP server URL
 current_mcp_server_url = None
 
+# MCP endpoint of the local preview server (see preview.py), if one is running
+preview_mcp_url = None
+
+# Prefixes of the function tools proxying the user's MCP tools through mcp_pool
+SPACE_TOOL_PREFIX = "user_tool_"
+PREVIEW_TOOL_PREFIX = "preview_tool_"
+
 # Global variable to track if a deployment just happened
 deployment_just_happened = False
 deployment_message = ""
@@ -104,6 +240,100 @@ except Exception as e:
     print(f"[WARN] Could not read blocks.txt: {e}")
     blocks_context = "(No external block data available.)"
 
+# Index of legal block types, inputs and enum values, used to reject bad commands locally
+block_catalog = parse_catalog(blocks_context)
+print(f"[CATALOG] Indexed {len(block_catalog)} block types from blocks.txt")
+
+# Example projects, used to rank which block families are relevant to a request
+examples_context = ""
+try:
+    file_path = os.path.join(os.path.dirname(__file__), "examples.txt")
+    with open(file_path, "r", encoding="utf-8") as f:
+        examples_context = f.read().strip()
+except Exception as e:
+    print(f"[WARN] Could not read examples.txt: {e}")
+
+block_docs_index = BlockDocsIndex(block_catalog, examples_context)
+
+# Keeps the history sent to the model within CHAT_HISTORY_TOKEN_BUDGET
+history_manager = HistoryManager()
+
+# Records sessions for offline replay when CHAT_RECORD_FILE is set (see replay.py)
+recorder = Recorder.from_env()
+
+# Cancel token of the chat turn running in each browser session (Gradio session hash -> token).
+# A new message supersedes the previous turn of the same session only.
+active_turns = {}
+active_turn_lock = threading.Lock()
+
+def start_turn(session_id=None):
+    token = CancelToken("turn")
+    token.on_cancel(lambda reason: turn_cancelled(token, reason))
+    with active_turn_lock:
+        previous = active_turns.get(session_id)
+        active_turns[session_id] = token
+    if previous is not None:
+        previous.cancel("superseded by a new message")
+    return token
+
+def finish_turn(session_id, token):
+    with active_turn_lock:
+        if active_turns.get(session_id) is token:
+            del active_turns[session_id]
+
+def cancel_active_turn(reason="stopped by user", session_id=None):
+    with active_turn_lock:
+        token = active_turns.get(session_id)
+    if token is not None:
+        token.cancel(reason)
+
+def turn_cancelled(token, reason):
+    cancelled_turns[token.id] = True
+    if len(cancelled_turns) > CANCELLED_TURNS_LIMIT:
+        cancelled_turns.popitem(last=False)
+    purged = purge_operations(token.id)
+    metrics.CHAT_TURNS_CANCELLED.inc()
+    metrics.OPERATIONS_PURGED.inc(purged)
+    print(Fore.YELLOW + f"[CANCEL] Chat turn cancelled ({reason}), purged {purged} unsent operations" + Style.RESET_ALL)
+
+async def create_model_response(token, **kwargs):
+    """
+    Run a Responses API call as a stream, so cancelling the turn closes the connection
+    instead of waiting for the whole response. Transient failures are retried (see resilience.py).
+    """
+    return await cancellation.cancellable(openai_service.call(lambda: read_model_stream(**kwargs)), token)
+
+async def read_model_stream(**kwargs):
+    stream = await client.responses.create(stream=True, **kwargs)
+    response = None
+    try:
+        async for event in stream:
+            if event.type in ("response.completed", "response.incomplete"):
+                response = event.response
+            elif event.type == "response.failed":
+                error = getattr(event.response, "error", None)
+                raise StreamError(getattr(error, "message", None) or "Model response failed", getattr(error, "code", None))
+            elif event.type == "error":
+                raise StreamError(getattr(event, "message", None) or "Model stream error", getattr(event, "code", None))
+    finally:
+        await stream.close()
+    if response is None:
+        raise RuntimeError("Model stream ended without a response")
+    return response
+
+def select_block_docs(message, workspace, history):
+    """Block documentation to put in the system prompt for this turn."""
+    if not block_catalog.categories:
+        return blocks_context
+    # Include the previous exchange so short follow-ups ("now do it") keep their context
+    query = message
+    turns = normalize_history(history)
+    if turns:
+        query = f"{turns[-1][0]}\n{turns[-1][1]}\n{message}"
+    selection = block_docs_index.select(query, workspace)
+    print(f"[BLOCK DOCS] Included {', '.join(selection.categories)} (~{selection.tokens} tokens)")
+    return selection.text
+
 # FastAPI App
 app = FastAPI()
 
@@ -117,10 +347,14 @@ app.add_middleware(
 
 @app.post("/update_chat")
 async def update_chat(request: Request):
-    global latest_blockly_chat_code, latest_blockly_vars
     data = await request.json()
+    return apply_chat_update(data)
+
+def apply_chat_update(data):
+    global latest_blockly_chat_code, latest_blockly_vars
     latest_blockly_chat_code = data.get("code", "")
     latest_blockly_vars = data.get("varString", "")
+    workspace_mirror.load(latest_blockly_chat_code, latest_blockly_vars)
     return {"code": latest_blockly_chat_code}
 
 @app.post("/set_api_key_chat")
@@ -143,35 +377,72 @@ async def set_api_key_chat(request: Request):
     
     return {"success": True}
 
-def delete_block(block_id):
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Recent chat turn traces, as span trees or in the OTLP/JSON format
+@app.get("/traces")
+async def traces_endpoint(limit: int = 20, format: str = "json"):
+    if format == "otlp":
+        return tracing.to_otlp(tracing.recent_traces(limit))
+    return {"traces": tracing.export_json(limit)}
+
+# Token usage and estimated cost, in total and for the most expensive sessions (or one session)
+@app.get("/usage")
+async def usage_endpoint(session: str = None, limit: int = 50):
+    if session:
+        return usage_ledger.session(session) or {"error": f"Unknown session {session}"}
+    return usage_ledger.snapshot(limit)
+
+# Recently dropped (expired or overflowed) operations and results
+@app.get("/dead_letters")
+async def dead_letters_endpoint():
+    return {
+        "requests": operations_log.dead_letter_dicts(),
+        "results": results_queue.dead_letter_dicts(),
+    }
+
+async def delete_block(block_id):
     try:
         print(f"[DELETE REQUEST] Attempting to delete block: {block_id}")
         
+        # Unknown ids fail here instead of after a browser round trip
+        if workspace_mirror.synced and not workspace_mirror.exists(block_id):
+            print(f"[DELETE REJECTED] Block not in workspace: {block_id}")
+            return f"[TOOL] Failed to delete block {block_id}: Block not found"
+        
         # Add to unified requests queue
         delete_data = {"type": "delete", "block_id": block_id}
-        requests_queue.put(delete_data)
+        enqueue_operation(delete_data)
         print(f"[DELETE REQUEST] Added to queue: {block_id}")
         
         # Wait for result from unified queue (delete uses 'block_id' as the identifier field)
         try:
-            result = wait_for_result(block_id, "delete", timeout=8, id_field='block_id')
+            result = await wait_for_result(block_id, "delete", timeout=8, id_field='block_id')
             print(f"[DELETE RESULT] Received result for {block_id}: success={result.get('success')}, error={result.get('error')}")
             if result["success"]:
+                workspace_mirror.remove_block(block_id)
                 return f"[TOOL] Successfully deleted block {block_id}"
             else:
                 return f"[TOOL] Failed to delete block {block_id}: {result.get('error', 'Unknown error')}"
         except TimeoutError as e:
-            print(f"[DELETE TIMEOUT] {e}")
             return f"Timeout waiting for deletion confirmation for block {block_id}"
             
+    except Cancelled:
+        raise
     except Exception as e:
         print(f"[DELETE ERROR] {e}")
         import traceback
         traceback.print_exc()
         return f"Error deleting block: {str(e)}"
 
-def create_block(block_spec, blockID=None, placement_type=None, input_name=None):
+async def create_block(block_spec, blockID=None, placement_type=None, input_name=None):
     try:
+        if blockID and workspace_mirror.synced and not workspace_mirror.exists(blockID):
+            print(f"[CREATE REJECTED] Parent block not in workspace: {blockID}")
+            return f"[TOOL] Failed to create block: Parent block not found: {blockID}"
+        
         # Generate a unique request ID
         request_id = str(uuid.uuid4())
         
@@ -183,27 +454,30 @@ def create_block(block_spec, blockID=None, placement_type=None, input_name=None)
             queue_data["placement_type"] = placement_type
         if input_name:
             queue_data["input_name"] = input_name
-        requests_queue.put(queue_data)
+        enqueue_operation(queue_data)
         
         # Wait for result from unified queue
         try:
-            result = wait_for_result(request_id, "create", timeout=8)
+            result = await wait_for_result(request_id, "create", timeout=8)
             if result["success"]:
+                if result.get("block_id"):
+                    workspace_mirror.add_block(result["block_id"], block_spec, blockID)
                 return f"[TOOL] Successfully created block: {result.get('block_id', 'unknown')}"
             else:
                 error_msg = result.get('error') or 'Unknown error'
                 return f"[TOOL] Failed to create block: {error_msg}"
         except TimeoutError as e:
-            print(f"[CREATE TIMEOUT] {e}")
             return f"Timeout waiting for block creation confirmation"
             
+    except Cancelled:
+        raise
     except Exception as e:
         print(f"[CREATE ERROR] {e}")
         import traceback
         traceback.print_exc()
         return f"Error creating block: {str(e)}"
 
-def create_variable(var_name):
+async def create_variable(var_name):
     try:
         print(f"[VARIABLE REQUEST] Attempting to create variable: {var_name}")
         
@@ -212,28 +486,31 @@ def create_variable(var_name):
         
         # Add to variable creation queue
         queue_data = {"type": "variable", "request_id": request_id, "variable_name": var_name}
-        requests_queue.put(queue_data)
+        enqueue_operation(queue_data)
         print(f"[VARIABLE REQUEST] Added to queue with ID: {request_id}")
         
         # Wait for result from unified queue
         try:
-            result = wait_for_result(request_id, "variable", timeout=8)
+            result = await wait_for_result(request_id, "variable", timeout=8)
             print(f"[VARIABLE RESULT] Received result for {request_id}: success={result.get('success')}, error={result.get('error')}")
             if result["success"]:
+                if result.get("variable_id"):
+                    workspace_mirror.add_variable(result["variable_id"], var_name)
                 return f"[TOOL] Successfully created variable: {result.get('variable_id', var_name)}"
             else:
                 return f"[TOOL] Failed to create variable: {result.get('error', 'Unknown error')}"
         except TimeoutError as e:
-            print(f"[VARIABLE TIMEOUT] {e}")
             return f"Timeout waiting for variable creation confirmation"
             
+    except Cancelled:
+        raise
     except Exception as e:
         print(f"[VARIABLE ERROR] {e}")
         import traceback
         traceback.print_exc()
         return f"Error creating variable: {str(e)}"
 
-def edit_mcp(inputs=None, outputs=None):
+async def edit_mcp(inputs=None, outputs=None):
     try:
         print(f"[EDIT MCP REQUEST] Attempting to edit MCP block: inputs={inputs}, outputs={outputs}")
         
@@ -248,31 +525,36 @@ def edit_mcp(inputs=None, outputs=None):
             edit_data["outputs"] = outputs
         
         # Add to edit MCP queue
-        requests_queue.put(edit_data)
+        enqueue_operation(edit_data)
         print(f"[EDIT MCP REQUEST] Added to queue with ID: {request_id}")
         
         # Wait for result from unified queue
         try:
-            result = wait_for_result(request_id, "edit_mcp", timeout=8)
+            result = await wait_for_result(request_id, "edit_mcp", timeout=8)
             print(f"[EDIT MCP RESULT] Received result for {request_id}: success={result.get('success')}, error={result.get('error')}")
             if result["success"]:
                 return f"[TOOL] Successfully edited MCP block inputs/outputs"
             else:
                 return f"[TOOL] Failed to edit MCP block: {result.get('error', 'Unknown error')}"
         except TimeoutError as e:
-            print(f"[EDIT MCP TIMEOUT] {e}")
             return f"Timeout waiting for MCP edit confirmation"
             
+    except Cancelled:
+        raise
     except Exception as e:
         print(f"[EDIT MCP ERROR] {e}")
         import traceback
         traceback.print_exc()
         return f"Error editing MCP block: {str(e)}"
 
-def replace_block(block_id, command):
+async def replace_block(block_id, command):
     try:
         print(f"[REPLACE REQUEST] Attempting to replace block {block_id} with: {command}")
         
+        if workspace_mirror.synced and not workspace_mirror.exists(block_id):
+            print(f"[REPLACE REJECTED] Block not in workspace: {block_id}")
+            return f"[TOOL] Failed to replace block: Block {block_id} not found"
+        
         # Generate a unique request ID
         request_id = str(uuid.uuid4())
         
@@ -280,76 +562,112 @@ def replace_block(block_id, command):
         replace_data = {"type": "replace", "request_id": request_id, "block_id": block_id, "block_spec": command}
         
         # Add to replace block queue
-        requests_queue.put(replace_data)
+        enqueue_operation(replace_data)
         print(f"[REPLACE REQUEST] Added to queue with ID: {request_id}")
         
         # Wait for result from unified queue
         try:
-            result = wait_for_result(request_id, "replace", timeout=8)
+            result = await wait_for_result(request_id, "replace", timeout=8)
             print(f"[REPLACE RESULT] Received result for {request_id}: success={result.get('success')}, error={result.get('error')}")
             if result["success"]:
+                workspace_mirror.replace_block(block_id, result.get("block_id") or block_id, command)
                 return f"[TOOL] Successfully replaced block {block_id}"
             else:
                 return f"[TOOL] Failed to replace block: {result.get('error', 'Unknown error')}"
         except TimeoutError as e:
-            print(f"[REPLACE TIMEOUT] {e}")
             return f"Timeout waiting for block replacement confirmation"
             
+    except Cancelled:
+        raise
     except Exception as e:
         print(f"[REPLACE ERROR] {e}")
         import traceback
         traceback.print_exc()
         return f"Error replacing block: {str(e)}"
 
+def find_blocks(block_type=None, parent_id=None, text=None, variable=None, block_id=None, limit=20):
+    if not workspace_mirror.synced:
+        return "[TOOL] The workspace has not been received from the browser yet."
+    
+    if block_id:
+        block = workspace_mirror.get(block_id)
+        if block is None:
+            return f"[TOOL] Block {block_id} not found"
+        lines = [block.describe()]
+        children = workspace_mirror.children_of(block_id)
+        if children:
+            lines.append("Children:")
+            lines.extend("  " + child.describe() for child in children)
+        return "[TOOL] " + "\n".join(lines)
+    
+    blocks, total = workspace_mirror.find(block_type, parent_id, text, variable, limit=limit)
+    if not blocks:
+        return "[TOOL] No blocks match"
+    lines = [block.describe() for block in blocks]
+    if total > len(blocks):
+        lines.append(f"... {total - len(blocks)} more match; narrow the search")
+    return f"[TOOL] {total} matching blocks:\n" + "\n".join(lines)
+
+async def operation_events(last_event_id=None):
+    """
+    Workspace operations for one subscriber (a tab on /unified_stream or /ws).
+    Yields (event id, operation) pairs, or None when a heartbeat is due.
+    """
+    # Resume right after the last event this tab received. A new tab starts at the oldest operation
+    # no tab has received, so work queued while no tab was open still arrives.
+    cursor = resume_cursor(operations_log, last_event_id)
+    if cursor is None:
+        cursor = operations_log.start_cursor()
+    else:
+        print(f"[SSE RESUME] Resuming unified stream after event {cursor}")
+    while True:
+        try:
+            events = operations_log.read_after(cursor)
+            if not events:
+                # Send a heartbeat every 30 seconds to keep connection alive
+                if not await operations_log.wait(cursor, SSE_HEARTBEAT_INTERVAL):
+                    yield None
+                continue
+            
+            for event_id, request in events:
+                cursor = event_id
+                request_key = operation_key(request)
+                
+                # The cursor already guarantees each event is sent once per stream; never send a cancelled turn's operations
+                if request.get("turn_id") in cancelled_turns:
+                    print(f"[SSE SKIP] Skipping operation from cancelled turn: {request_key}")
+                    continue
+                operations_log.mark_delivered(event_id)
+                # With several tabs open, keep the first send time for the round trip span
+                operation_sent_at.setdefault(request_key, time.time())
+                if len(operation_sent_at) > OPERATION_SENT_AT_LIMIT:
+                    operation_sent_at.popitem(last=False)
+                if recorder:
+                    recorder.operation(request)
+                yield event_id, request
+                
+        except Exception as e:
+            print(f"[SSE ERROR] {e}")
+            await asyncio.sleep(1)
+
 # Unified Server-Sent Events endpoint for all workspace operations
 @app.get("/unified_stream")
-async def unified_stream():
-    async def clear_sent_request(sent_requests, request_key, delay):
-        """Clear request_key from sent_requests after delay seconds"""
-        await asyncio.sleep(delay)
-        if request_key in sent_requests:
-            sent_requests.discard(request_key)
+async def unified_stream(request: Request = None, last_event_id: str = None):
+    # EventSource sends Last-Event-ID when it reconnects by itself; index.js passes it as a query parameter
+    # when it has to open a new EventSource
+    if request is not None:
+        last_event_id = request.headers.get("last-event-id") or last_event_id
     
     async def event_generator():
-        sent_requests = set()  # Track sent requests to avoid duplicates
-        heartbeat_counter = 0
-        
-        while True:
-            try:
-                # Check unified requests queue (no elif - checks every iteration)
-                if not requests_queue.empty():
-                    request = requests_queue.get_nowait()
-                    request_type = request.get("type")
-                    
-                    # Build request key for duplicate detection
-                    if request_type == "delete":
-                        request_key = f"delete_{request.get('block_id')}"
-                    else:
-                        request_key = f"{request_type}_{request.get('request_id')}"
-                    
-                    # Avoid sending duplicate requests too quickly
-                    if request_key not in sent_requests:
-                        sent_requests.add(request_key)
-                        yield f"data: {json.dumps(request)}\n\n"
-                        
-                        # Clear from sent_requests after 10 seconds
-                        asyncio.create_task(clear_sent_request(sent_requests, request_key, 10))
-                    else:
-                        print(f"[SSE SKIP] Skipping duplicate request: {request_key}")
-                
+        metrics.SSE_SUBSCRIBERS.inc()
+        try:
+            async for event in operation_events(last_event_id):
+                if event is None:
+                    yield f"data: {json.dumps({'heartbeat': True})}\n\n"
                 else:
-                    # Send a heartbeat every 30 seconds to keep connection alive
-                    heartbeat_counter += 1
-                    if heartbeat_counter >= 300:  # 300 * 0.1 = 30 seconds
-                        yield f"data: {json.dumps({'heartbeat': True})}\n\n"
-                        heartbeat_counter = 0
-                    await asyncio.sleep(0.1)
-                    
-            except queue.Empty:
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                print(f"[SSE ERROR] {e}")
-                await asyncio.sleep(1)
+                    yield sse_event(*event)
+        finally:
+            metrics.SSE_SUBSCRIBERS.dec()
     
     return StreamingResponse(
         event_generator(),
@@ -363,19 +681,27 @@ async def unified_stream():
 
 # Unified Server-Sent Events endpoint for all results from frontend
 @app.get("/results_stream")
-async def results_stream():
+async def results_stream(request: Request = None, last_event_id: str = None):
+    if request is not None:
+        last_event_id = request.headers.get("last-event-id") or last_event_id
+    
     async def event_generator():
+        # Observers see results from when they connect (or resume where they left off);
+        # reading the log leaves them for the tool waiters
+        cursor = resume_cursor(results_log, last_event_id)
+        if cursor is None:
+            cursor = results_log.last_id
         while True:
             try:
-                # Check if there are any results to send
-                if not results_queue.empty():
-                    result_data = results_queue.get_nowait()
-                    yield f"data: {json.dumps(result_data)}\n\n"
-                else:
+                events = results_log.read_after(cursor)
+                if not events:
                     # Send a heartbeat every 30 seconds to keep connection alive
-                    await asyncio.sleep(0.1)
-            except queue.Empty:
-                await asyncio.sleep(0.1)
+                    if not await results_log.wait(cursor, SSE_HEARTBEAT_INTERVAL):
+                        yield f"data: {json.dumps({'heartbeat': True})}\n\n"
+                    continue
+                for event_id, result_data in events:
+                    cursor = event_id
+                    yield sse_event(event_id, result_data)
             except Exception as e:
                 print(f"[RESULTS SSE ERROR] {e}")
                 await asyncio.sleep(1)
@@ -394,6 +720,10 @@ async def results_stream():
 @app.post("/request_result")
 async def request_result(request: Request):
     data = await request.json()
+    return accept_result(data)
+
+def accept_result(data):
+    """Hand an operation result from the browser to its waiter (and the /results_stream observers)."""
     request_type = data.get("request_type")
     
     # Log based on type
@@ -414,12 +744,145 @@ async def request_result(request: Request):
         error = data.get("error")
         print(f"[RESULT RECEIVED] type={request_type}, request_id={request_id}, success={success}, error={error}")
     
-    # Put directly in unified results queue
+    if recorder:
+        recorder.result(data)
+    
+    # Put directly in unified results queue for the waiters, and in the log for observers
     results_queue.put(data)
+    results_log.append(data)
     
     return {"received": True}
 
-def deploy_to_huggingface(space_name):
+# One WebSocket per tab carrying operations, results and workspace updates, so each operation
+# costs two frames instead of an SSE event plus a POST. /unified_stream and the POST endpoints
+# remain for browsers or proxies without WebSocket support.
+@app.websocket("/ws")
+async def workspace_socket(websocket: WebSocket, last_event_id: str = None):
+    await serve_workspace_socket(websocket, last_event_id)
+
+async def serve_workspace_socket(websocket, last_event_id=None, handlers=None):
+    """
+    Serve one workspace WebSocket.
+    
+    Server -> browser: {"kind": "operation", "id": ..., "data": operation} and {"kind": "heartbeat"}
+    Browser -> server: {"kind": "result" | "update_chat" | any kind in handlers, "data": payload}
+    
+    Args:
+        websocket: The starlette WebSocket
+        last_event_id: Stream event id to resume after, like Last-Event-ID on /unified_stream
+        handlers: Extra message kinds, mapping kind -> function(data); unified_server adds update_code
+    """
+    handlers = {"result": accept_result, "update_chat": apply_chat_update, **(handlers or {})}
+    await websocket.accept()
+    metrics.WS_CONNECTIONS.inc()
+    
+    async def send_operations():
+        async for event in operation_events(last_event_id):
+            if event is None:
+                await websocket.send_text(json.dumps({"kind": "heartbeat"}))
+            else:
+                event_id, operation = event
+                await websocket.send_text(json.dumps({"kind": "operation", "id": stream_event_id(event_id), "data": operation}))
+    
+    sender = asyncio.create_task(send_operations())
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+                kind = message.get("kind")
+                handler = handlers.get(kind)
+                if handler is None:
+                    print(f"[WS WARN] Ignoring message of unknown kind: {kind}")
+                    continue
+                handler(message.get("data") or {})
+            except Exception as e:
+                print(f"[WS ERROR] {e}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        metrics.WS_CONNECTIONS.dec()
+
+async def preview_mcp_server():
+    """Start (or restart) the local preview of the generated tool and register its MCP endpoint."""
+    global preview_mcp_url
+    try:
+        resp = await asyncio.to_thread(requests.post, f"http://127.0.0.1:{os.getenv('PORT', 8080)}/start_preview")
+        info = resp.json()
+    except Exception as e:
+        print(f"[PREVIEW ERROR] {e}")
+        return f"[PREVIEW ERROR] Could not start the local preview: {e}"
+    
+    if info.get("status") != "running":
+        preview_mcp_url = None
+        return f"[PREVIEW ERROR] {info.get('error') or 'The preview did not start.'}"
+    
+    # Pooled sessions connect from this server; hosted MCP tools are called from the model provider
+    # and need a public URL
+    preview_mcp_url = info.get("mcp_url") if mcp_pool.available else info.get("public_mcp_url")
+    print(f"[MCP] Local preview running: {info.get('mcp_url')} (registered: {preview_mcp_url})")
+    result = f"[TOOL] Local MCP preview running at {info.get('mcp_url')}. It reloads automatically when the blocks change."
+    if not preview_mcp_url:
+        result += " It is only reachable from this machine; set MCP_PREVIEW_PUBLIC_URL to a public URL forwarding to it to call it from chat."
+    return result
+
+async def preview_code_version():
+    """Code version the local preview is running, so a reload refreshes its pooled tool list."""
+    try:
+        resp = await asyncio.to_thread(requests.get, f"http://127.0.0.1:{os.getenv('PORT', 8080)}/preview_status", timeout=2)
+        return resp.json().get("code_version")
+    except Exception as e:
+        print(f"[PREVIEW WARN] Could not read preview status: {e}")
+        return None
+
+def live_mcp_url(space_url):
+    # input:  https://huggingface.co/spaces/user/space
+    # output: https://user-space.hf.space/gradio_api/mcp/
+    parts = space_url.split("/spaces/")
+    user, space = parts[1].split("/")
+    return f"https://{user}-{space}.hf.space/gradio_api/mcp/"
+
+async def user_mcp_tools(servers):
+    """
+    Function tools for the tools of the user's MCP servers, listed through mcp_pool.
+
+    Args:
+        servers: (tool name prefix, MCP URL, code version) for each registered server
+
+    Returns:
+        (function tool definitions, function tool name -> (MCP URL, MCP tool name))
+    """
+    function_tools = []
+    routes = {}
+    for prefix, url, version in servers:
+        try:
+            mcp_tools = await mcp_pool.list_tools(url, version)
+        except Exception as e:
+            print(f"[MCP] Could not list tools of {url}: {e}")
+            continue
+        for mcp_tool in mcp_tools:
+            name = function_tool_name(prefix, mcp_tool.name)
+            routes[name] = (url, mcp_tool.name)
+            function_tools.append({
+                "type": "function",
+                "name": name,
+                "description": mcp_tool.description or f"MCP tool {mcp_tool.name}",
+                "parameters": mcp_tool.inputSchema or {"type": "object", "properties": {}},
+            })
+    return function_tools, routes
+
+async def call_user_mcp_tool(url, name, arguments):
+    try:
+        result = await mcp_pool.call_tool(url, name, arguments)
+    except Exception as e:
+        print(f"[MCP ERROR] {name}: {e}")
+        return f"[MCP ERROR] Calling {name} failed: {e}"
+    text = result_text(result)
+    return f"[MCP ERROR] {text}" if result.isError else text
+
+async def deploy_to_huggingface(space_name):
     global stored_hf_key
     
     if not stored_hf_key:
@@ -430,45 +893,64 @@ def deploy_to_huggingface(space_name):
     except ImportError:
         return "[DEPLOY ERROR] huggingface_hub not installed. Run: pip install huggingface_hub"
     
+    phase = "whoami"
     try:
         api = HfApi(token=stored_hf_key)
         
         # Get username from token
-        user_info = api.whoami()
+        with metrics.DEPLOY_PHASE_SECONDS.time(phase=phase):
+            user_info = await call_sync(hub_service, api.whoami)
         username = user_info["name"]
         repo_id = f"{username}/{space_name}"
         
         print(f"[DEPLOY] Creating HF Space: {repo_id}")
         
-        # Create the Space
-        api.create_repo(
-            repo_id=repo_id,
-            repo_type="space",
-            space_sdk="gradio",
-            private=False,
-        )
+        # Create the Space. A retry after a lost response finds the Space the earlier attempt
+        # created (409), which counts as created; a 409 on the first attempt is a real name clash.
+        create_attempts = []
+
+        def create_space():
+            create_attempts.append(True)
+            try:
+                api.create_repo(repo_id=repo_id, repo_type="space", space_sdk="gradio", private=False)
+            except Exception as e:
+                if len(create_attempts) > 1 and status_of(e) == 409:
+                    print(f"[DEPLOY] Space {repo_id} exists after a retried create; continuing")
+                    return
+                raise
+
+        phase = "create_repo"
+        with metrics.DEPLOY_PHASE_SECONDS.time(phase=phase):
+            await call_sync(hub_service, create_space)
         
         print(f"[DEPLOY] Space created. Uploading files...")
         
         # Get the actual generated Python code from test.py (not the Blockly DSL)
         python_code = ""
+        phase = "fetch_code"
         try:
-            resp = requests.get(f"http://127.0.0.1:{os.getenv('PORT', 8080)}/get_latest_code")
+            with metrics.DEPLOY_PHASE_SECONDS.time(phase=phase):
+                resp = await asyncio.to_thread(requests.get, f"http://127.0.0.1:{os.getenv('PORT', 8080)}/get_latest_code")
             if resp.ok:
                 python_code = resp.json().get("code", "")
         except Exception as e:
             print(f"[DEPLOY WARN] Could not fetch Python code from test.py: {e}")
         
         if not python_code.strip():
+            metrics.DEPLOY_FAILURES.inc(phase=phase)
             return "[DEPLOY ERROR] No generated Python code available. Create and test your tool first."
         
         # Upload app.py with actual Python code
-        api.upload_file(
-            path_or_fileobj=python_code.encode(),
-            path_in_repo="app.py",
-            repo_id=repo_id,
-            repo_type="space",
-        )
+        phase = "upload_app"
+        with metrics.DEPLOY_PHASE_SECONDS.time(phase=phase):
+            await call_sync(
+                hub_service,
+                api.upload_file,
+                path_or_fileobj=python_code.encode(),
+                path_in_repo="app.py",
+                repo_id=repo_id,
+                repo_type="space",
+            )
         
         # Create requirements.txt
         requirements_content = """gradio[mcp,oauth]==6.0.0
@@ -478,12 +960,16 @@ huggingface_hub
 sympy
 """
         
-        api.upload_file(
-            path_or_fileobj=requirements_content.encode(),
-            path_in_repo="requirements.txt",
-            repo_id=repo_id,
-            repo_type="space",
-        )
+        phase = "upload_requirements"
+        with metrics.DEPLOY_PHASE_SECONDS.time(phase=phase):
+            await call_sync(
+                hub_service,
+                api.upload_file,
+                path_or_fileobj=requirements_content.encode(),
+                path_in_repo="requirements.txt",
+                repo_id=repo_id,
+                repo_type="space",
+            )
         
         # Create README.md with proper YAML front matter
         readme_content = f"""---
@@ -503,12 +989,16 @@ This is a MCP server created with [MCP Blockly](https://github.com/owenkaplinsky
 The tool has been automatically deployed to Hugging Face Spaces and is ready to use!
 """
         
-        api.upload_file(
-            path_or_fileobj=readme_content.encode("utf-8"),
-            path_in_repo="README.md",
-            repo_id=repo_id,
-            repo_type="space",
-        )
+        phase = "upload_readme"
+        with metrics.DEPLOY_PHASE_SECONDS.time(phase=phase):
+            await call_sync(
+                hub_service,
+                api.upload_file,
+                path_or_fileobj=readme_content.encode("utf-8"),
+                path_in_repo="README.md",
+                repo_id=repo_id,
+                repo_type="space",
+            )
         
         space_url = f"https://huggingface.co/spaces/{repo_id}"
         print(f"[DEPLOY SUCCESS] Space deployed: {space_url}")
@@ -516,6 +1006,8 @@ The tool has been automatically deployed to Hugging Face Spaces and is ready to
         # Store the MCP server URL globally for native MCP support
         global current_mcp_server_url, deployment_just_happened, deployment_message
         current_mcp_server_url = space_url
+        # The Space restarts with the new code, so its pooled session and tool list are stale
+        mcp_pool.invalidate(live_mcp_url(space_url))
         deployment_just_happened = True
         deployment_message = f"Your MCP tool is being built on Hugging Face Spaces. This usually takes 1-2 minutes. Once it's ready, you'll be able to use the MCP tools defined in your blocks."
         print(f"[MCP] Registered MCP server: {current_mcp_server_url}")
@@ -523,6 +1015,7 @@ The tool has been automatically deployed to Hugging Face Spaces and is ready to
         return f"[TOOL] Successfully deployed to Hugging Face Space!\n\n**Space URL:** {space_url}"
         
     except Exception as e:
+        metrics.DEPLOY_FAILURES.inc(phase=phase)
         print(f"[DEPLOY ERROR] {e}")
         import traceback
         traceback.print_exc()
@@ -530,14 +1023,20 @@ The tool has been automatically deployed to Hugging Face Spaces and is ready to
 
 def create_gradio_interface():
     # Hardcoded system prompt
+    if id_aliases.enabled:
+        id_format = ("Block IDs are everything between `↿` and `↾`. IDs are short aliases: `b` and a number for blocks, "
+                     "`v` and a number for variables.\n"
+                     "    Example: `↿ b12 ↾ text(inputs(TEXT: \"hello\"))`, ID is `b12`")
+    else:
+        id_format = ("Block IDs are everything between `↿` and `↾`. IDs are always complex/long strings.\n"
+                     "    Example: `↿ ?fHZRh^|us|9bECO![$= ↾ text(inputs(TEXT: \"hello\"))`, ID is `?fHZRh^|us|9bECO![$=`")
 
     SYSTEM_PROMPT = f"""You are an AI assistant that helps users build **MCP servers** using Blockly blocks.
 
     You'll receive the workspace state in this format:
     `↿ blockId ↾ block_name(inputs(input_name: value))`
 
-    Block ID parsing: Block IDs are everything between `↿` and `↾`. IDs are always complex/long strings.
-    Example: `↿ ?fHZRh^|us|9bECO![$= ↾ text(inputs(TEXT: "hello"))`, ID is `?fHZRh^|us|9bECO![$=`
+    Block ID parsing: {id_format}
     
     Special cases:
     - `create_mcp` and `func_def` use `↿ blockId ↾ block_name(inputs(input_name: type), outputs(output_name: value))`
@@ -576,9 +1075,7 @@ def create_gradio_interface():
     ---
 
     ### Creating Blocks
-    List of blocks:
-
-    {blocks_context}
+    The blocks you can create are listed under "Available blocks" at the end of these instructions.
 
     You cannot create a `create_mcp` block, but you may edit its inputs using the `edit_mcp` tool.
 
@@ -892,6 +1389,45 @@ def create_gradio_interface():
                 "required": ["block_id", "command"],
             }
         },
+        {
+            "type": "function",
+            "name": "find_blocks",
+            "description": "Search the current workspace for blocks and their IDs. Filters combine. Use this to look up blocks instead of guessing IDs, especially when the workspace is only given as a summary.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "block_id": {
+                        "type": "string",
+                        "description": "Look up one block by ID, with its direct children. Other filters are ignored.",
+                    },
+                    "type": {
+                        "type": "string",
+                        "description": "Exact block type, e.g. controls_if or text_join.",
+                    },
+                    "parent_id": {
+                        "type": "string",
+                        "description": f"Only blocks directly inside this block. Use '{ROOT}' for top-level blocks.",
+                    },
+                    "text": {
+                        "type": "string",
+                        "description": "Text the block's command must contain (case-insensitive), e.g. an input name or a string value.",
+                    },
+                    "variable": {
+                        "type": "string",
+                        "description": "Name or ID of a variable the block uses.",
+                    },
+                },
+            }
+        },
+        {
+            "type": "function",
+            "name": "preview_mcp_server",
+            "description": "Run the current tool as a local MCP server in seconds, without deploying to Hugging Face. It reloads automatically when the blocks change. Use this to try the tool while iterating; deploy only when asked.",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+            }
+        },
         {
             "type": "function",
             "name": "deploy_to_huggingface",
@@ -909,19 +1445,50 @@ def create_gradio_interface():
         },
     ]
     
-    def chat_with_context(message, history):
+    # Async, so a turn waiting on the model, the browser or Hugging Face holds no worker thread
+    async def chat_with_context(message, history, request: gr.Request = None):
+        # Gradio's session hash identifies the browser tab, for cancellation and usage accounting
+        session_hash = getattr(request, "session_hash", None)
+        token = start_turn(session_hash)
+        turn_usage = usage_ledger.start_turn(session_hash)
+        trace = tracing.start_trace("chat_turn", message_chars=len(message), turn_id=token.id,
+                                    session=turn_usage.session.session_id)
+        try:
+            async for chunk in run_chat_turn(message, history, trace, token, turn_usage):
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            # Gradio closed the generator or cancelled its task (stop button or disconnect)
+            token.cancel("chat closed")
+            raise
+        except Exception as e:
+            trace.error(e)
+            raise
+        finally:
+            finish_turn(session_hash, token)
+            usage_ledger.finish_turn(turn_usage)
+            trace.set(**turn_usage.to_dict())
+            if token.cancelled:
+                trace.set(cancelled=token.reason)
+            tracing.finish_trace(trace)
+            print(Fore.CYAN + f"[TRACE] {tracing.summarize(trace)}" + Style.RESET_ALL)
+    
+    async def run_chat_turn(message, history, trace, token, turn_usage):
         # Check if API key is set and create/update client
         global client, stored_api_key, first_output_block_attempted
         
         # Reset output block tracking for this conversation turn
         first_output_block_attempted = False
         
+        if recorder:
+            recorder.turn(message, history)
+        
         # Use stored key or environment key
         api_key = stored_api_key or os.environ.get("OPENAI_API_KEY")
         
         if api_key and (not client or (hasattr(client, 'api_key') and client.api_key != api_key)):
             try:
-                client = OpenAI(api_key=api_key)
+                # Retries are handled by openai_service, which also backs off and breaks the circuit
+                client = AsyncOpenAI(api_key=api_key, max_retries=0)
             except Exception as e:
                 yield f"Error initializing OpenAI client: {str(e)}"
                 return
@@ -936,107 +1503,159 @@ def create_gradio_interface():
         global latest_blockly_vars
         vars = latest_blockly_vars
         
-        # Convert history to OpenAI format
-        input_items = []
-        for human, ai in history:
-            input_items.append({"role": "user", "content": human})
-            input_items.append({"role": "assistant", "content": ai})
+        # Convert history to OpenAI format, keeping recent turns verbatim and summarizing older ones
+        input_items = history_manager.build_input_items(history)
         
-        # Build instructions
-        instructions = SYSTEM_PROMPT
-        if context:
-            instructions += f"\n\nCurrent Blockly workspace state:\n{context}"
+        # Build instructions. The static prompt stays one fixed prefix (so provider prompt caching holds);
+        # the block families relevant to this turn follow it, next to the workspace state.
+        instructions = SYSTEM_PROMPT + f"\n\nAvailable blocks:\n{select_block_docs(message, context, history)}"
+        if context and len(context) > WORKSPACE_CONTEXT_CHARS and workspace_mirror.synced:
+            # Large workspaces are summarized; the model asks find_blocks for the parts it needs
+            instructions += ("\n\nCurrent Blockly workspace summary (the full workspace is too large to include, "
+                             f"use find_blocks to look up blocks and their IDs):\n{id_aliases.encode(workspace_mirror.summary())}")
+        elif context:
+            instructions += f"\n\nCurrent Blockly workspace state:\n{id_aliases.encode(context)}"
         else:
             instructions += "\n\nNote: No Blockly workspace context is currently available."
         
         if vars != "":
-            instructions += f"\n\nCurrent Blockly variables:\n{vars}"
+            instructions += f"\n\nCurrent Blockly variables:\n{id_aliases.encode(vars)}"
         else:
             instructions += "\n\nNote: No Blockly variables are currently available."
         
         # Iteration control
         accumulated_response = ""
+        answered = False  # The model gave its final answer (rather than running out of iterations)
         max_iterations = 15
+        if turn_usage.max_iterations is not None:
+            # The session is over its budget
+            max_iterations = min(max_iterations, turn_usage.max_iterations)
         current_iteration = 0
         
         # Start with original user message
         current_prompt = message
         temp_input_items = input_items.copy()
+        routing = model_router.start_turn(message)
+        routing.downgraded = turn_usage.downgrade
+        
+        # Optional exact-match response cache: replay the stored plan of an identical request, or record this one
+        plan_replay = plan_recorder = None
+        if response_cache.enabled:
+            key, workspace_ids = cache_key(
+                message, id_aliases.encode(context or ""), id_aliases.encode(vars or ""),
+                json.dumps(input_items, default=str, sort_keys=True),
+                f"{model_router.policy}:{model_router.strong}:{model_router.fast}",
+            )
+            plan = response_cache.get(key)
+            if plan is not None:
+                print(f"[RESPONSE CACHE] Replaying a cached plan of {len(plan.steps)} iterations")
+                plan_replay = PlanReplay(plan, workspace_ids, key)
+            else:
+                plan_recorder = PlanRecorder(key, workspace_ids)
         
         # MAIN LOOP
         while current_iteration < max_iterations:
             current_iteration += 1
+            iteration_span = trace.child("iteration", number=current_iteration)
             
             try:
+                token.raise_if_cancelled()
+                
                 # Build dynamic tools list with MCP support
                 dynamic_tools = tools.copy() if tools else []
                 
-                # Inject MCP tool if a server is registered
+                # Expose the user's MCP tools if a server is registered: as function tools over pooled
+                # sessions, or as hosted MCP tools when the mcp package is missing
                 global current_mcp_server_url, deployment_just_happened, deployment_message
                 space_building_status = None  # Track if space is building
+                mcp_servers = []
                 if current_mcp_server_url:
-                    mcp_injection_successful = False
                     try:
-                        # Try to verify the MCP server is available before injecting
-                        space_is_running = False
-                        try:
-                            # Extract username and space name from URL
-                            # URL format: https://huggingface.co/spaces/username/space_name
-                            url_parts = current_mcp_server_url.split("/spaces/")
-                            if len(url_parts) == 2:
-                                space_id = url_parts[1]
+                        space_mcp_url = live_mcp_url(current_mcp_server_url)
+                        # Verify the MCP server is available, unless a session to it is already open
+                        space_is_running = mcp_pool.cached(space_mcp_url)
+                        if not space_is_running:
+                            try:
+                                # URL format: https://huggingface.co/spaces/username/space_name
+                                space_id = current_mcp_server_url.split("/spaces/")[1]
                                 api = HfApi()
-                                runtime_info = api.get_space_runtime(space_id)
+                                with iteration_span.span("space_runtime_check", space_id=space_id):
+                                    runtime_info = await call_sync(hub_service, api.get_space_runtime, space_id)
                                 print(f"[MCP] Space runtime status: {runtime_info}")
                                 # Check if space is running
                                 if runtime_info and runtime_info.stage == "RUNNING":
                                     space_is_running = True
-                                    # Space is running - deployment is complete
-                                    deployment_just_happened = False
                                     print(f"[MCP] Space is RUNNING")
                                 else:
                                     # Space is not running - it's likely building
                                     space_building_status = runtime_info.stage if runtime_info else "unknown"
                                     print(f"[MCP] Space is not running yet (stage: {space_building_status})")
-                        except Exception as check_error:
-                            print(f"[MCP] Could not verify space runtime: {check_error}")
+                            except Exception as check_error:
+                                print(f"[MCP] Could not verify space runtime: {check_error}")
                         
-                        # Only inject the MCP tool if the space is verified running
+                        # Only expose the MCP tools if the space is verified running
                         if space_is_running:
-                            def convert_repo_to_live_mcp(url):
-                                # input:  https://huggingface.co/spaces/user/space
-                                # output: https://user-space.hf.space/gradio_api/mcp
-
-                                parts = url.split("/spaces/")
-                                user, space = parts[1].split("/")
-                                return f"https://{user}-{space}.hf.space/gradio_api/mcp/"
-
-                            live_mcp_url = convert_repo_to_live_mcp(current_mcp_server_url)
-
-                            mcp_tool = {
-                                "type": "mcp",
-                                "server_url": live_mcp_url,
-                                "server_label": "user_mcp_server",
-                                "require_approval": "never"
-                            }
-                            dynamic_tools.append(mcp_tool)
+                            # Space is running - deployment is complete
+                            deployment_just_happened = False
+                            mcp_servers.append((SPACE_TOOL_PREFIX, space_mcp_url, current_mcp_server_url, "user_mcp_server"))
                     except Exception as mcp_error:
                         print(f"[MCP ERROR] Failed during MCP injection: {mcp_error}")
                 
+                # The local preview reloads itself, so no runtime check is needed
+                if preview_mcp_url:
+                    mcp_servers.append((PREVIEW_TOOL_PREFIX, preview_mcp_url, await preview_code_version(), "user_mcp_preview"))
+                
+                mcp_routes = {}
+                if mcp_servers and mcp_pool.available:
+                    with iteration_span.span("mcp_list_tools", servers=len(mcp_servers)):
+                        mcp_function_tools, mcp_routes = await user_mcp_tools(
+                            [(prefix, url, version) for prefix, url, version, _ in mcp_servers])
+                    dynamic_tools.extend(mcp_function_tools)
+                else:
+                    for _, url, _, label in mcp_servers:
+                        dynamic_tools.append({
+                            "type": "mcp",
+                            "server_url": url,
+                            "server_label": label,
+                            "require_approval": "never"
+                        })
+                
                 # Add deployment status message to instructions if deployment just happened and space is not running
                 deployment_instructions = instructions
                 if deployment_just_happened and space_building_status and space_building_status != "RUNNING":
                     deployment_instructions = instructions + f"\n\n**MCP DEPLOYMENT STATUS:** {deployment_message}"
                 
-                # Create Responses API call
-                response = client.responses.create(
-                    model="gpt-4o",
-                    instructions=deployment_instructions,
-                    input=temp_input_items + [{"role": "user", "content": current_prompt}],
-                    tools=dynamic_tools,
-                    tool_choice="auto",
-                    parallel_tool_calls=False
-                )
+                model_input = temp_input_items + [{"role": "user", "content": current_prompt}]
+                if plan_replay is not None and plan_replay.active:
+                    # The cached plan stands in for the model until a tool result differs from it
+                    with iteration_span.span("model_call", model="cache", route="cache",
+                                             input_items=len(model_input)):
+                        response = plan_replay.next_response()
+                    routing.advance()
+                else:
+                    # Create Responses API call, on the model the router picks for this iteration
+                    model, route_reason = model_router.choose(routing)
+                    with metrics.CHAT_MODEL_CALL_SECONDS.time(iteration=current_iteration), \
+                            iteration_span.span("model_call", model=model, route=route_reason,
+                                                input_items=len(model_input)) as model_span:
+                        response = await create_model_response(
+                            token,
+                            model=model,
+                            instructions=deployment_instructions,
+                            input=model_input,
+                            tools=dynamic_tools,
+                            tool_choice="auto",
+                            parallel_tool_calls=False
+                        )
+                    model_router.observe(model, model_span.duration, route_reason)
+                    if recorder:
+                        recorder.model_call({"model": model, "input": model_input}, response, model_span.duration)
+                    input_tokens, cached_tokens, output_tokens, cost = usage_ledger.record(
+                        turn_usage, model, getattr(response, "usage", None))
+                    model_span.set(input_tokens=input_tokens, cached_tokens=cached_tokens,
+                                   output_tokens=output_tokens, cost_usd=round(cost, 6))
+                    if plan_recorder is not None:
+                        plan_recorder.model_response(response)
                 
                 # print(response)
                 
@@ -1066,9 +1685,13 @@ def create_gradio_interface():
                         yield accumulated_response
 
                     # Now process each tool call, one by one
-                    for tool_call in tool_calls:
+                    for tool_index, tool_call in enumerate(tool_calls):
+                        token.raise_if_cancelled()
                         function_name = tool_call.name
                         function_args = json.loads(tool_call.arguments)
+                        if function_name not in mcp_routes:
+                            # The model refers to blocks and variables by alias; the tools need the real ids
+                            function_args = id_aliases.decode_args(function_args)
                         call_id = tool_call.call_id
                         
                         temp_input_items.append({"role": "user", "content": current_prompt})
@@ -1081,131 +1704,161 @@ def create_gradio_interface():
                             "arguments": tool_call.arguments
                         })
                         
-                        # Execute the tool
+                        # Execute the tool, with its span current so queue/browser timings attach to it
                         tool_result = None
                         result_label = ""
+                        tool_span = iteration_span.child("tool_call", tool=function_name, call_id=call_id,
+                                                         block_id=function_args.get("id") or function_args.get("block_id"),
+                                                         target_block_id=function_args.get("blockID"))
+                        span_token = tracing.set_current(tool_span)
+                        cancel_handle = cancellation.set_current(token)
+                        try:
+                            if function_name == "delete_block":
+                                block_id = function_args.get("id", "")
+                                print(Fore.YELLOW + f"Agent deleted block with ID `{block_id}`." + Style.RESET_ALL)
+                                tool_result = await delete_block(block_id)
+                                result_label = "Delete Operation"
                         
-                        if function_name == "delete_block":
-                            block_id = function_args.get("id", "")
-                            print(Fore.YELLOW + f"Agent deleted block with ID `{block_id}`." + Style.RESET_ALL)
-                            tool_result = delete_block(block_id)
-                            result_label = "Delete Operation"
-                        
-                        elif function_name == "create_block":
-                            command = function_args.get("command", "")
-                            blockID = function_args.get("blockID", None)
-                            placement_type = function_args.get("type", None)
-                            input_name = function_args.get("input_name", None)
-                            
-                            # Validate that parentheses are balanced, ignoring ones in strings
-                            # Allow leniency: auto-add up to 1 missing closing parenthesis
-                            command_stripped = command.strip()
-                            open_parens = 0
-                            close_parens = 0
-                            in_string = False
-                            string_char = ''
-                            i = 0
-                            while i < len(command_stripped):
-                                char = command_stripped[i]
-                                # Handle string escaping
-                                if char in ('"', "'") and (i == 0 or command_stripped[i-1] != '\\'):
-                                    if not in_string:
-                                        in_string = True
-                                        string_char = char
-                                    elif char == string_char:
-                                        in_string = False
-                                # Count parentheses only outside of strings
-                                elif not in_string:
-                                    if char == '(':
-                                        open_parens += 1
-                                    elif char == ')':
-                                        close_parens += 1
-                                i += 1
+                            elif function_name == "create_block":
+                                command = function_args.get("command", "")
+                                blockID = function_args.get("blockID", None)
+                                placement_type = function_args.get("type", None)
+                                input_name = function_args.get("input_name", None)
                             
-                            paren_diff = open_parens - close_parens
-                            if paren_diff == 1:
-                                # Auto-fix: add one closing parenthesis
-                                command = command_stripped + ')'
-                                print(Fore.YELLOW + f"[LENIENCY] Auto-fixed 1 missing closing parenthesis." + Style.RESET_ALL)
-                                # Continue with block creation below
-                                tool_result = None
-                                result_label = ""
-                            elif paren_diff > 1:
-                                tool_result = f"[ERROR] Malformatted command: Too many unbalanced parentheses ({paren_diff} missing). The attempted command was:\n\n`{command_stripped}`\n\nPlease retry with properly balanced parentheses."
-                                result_label = "Command Format Error"
-                                print(Fore.RED + f"[VALIDATION ERROR] Unbalanced parentheses: {open_parens} open, {close_parens} close." + Style.RESET_ALL)
-                            elif paren_diff < 0:
-                                tool_result = f"[ERROR] Malformatted command: Too many closing parentheses ({-paren_diff} extra). The attempted command was:\n\n`{command_stripped}`\n\nPlease retry with properly balanced parentheses."
-                                result_label = "Command Format Error"
-                                print(Fore.RED + f"[VALIDATION ERROR] Unbalanced parentheses: {open_parens} open, {close_parens} close." + Style.RESET_ALL)
+                                # Parse the command up front so malformed commands never reach the browser.
+                                # One missing closing parenthesis is auto-fixed by the parser.
+                                parsed = parse_command(command)
+                                command_stripped = parsed.command
+                                if parsed.error:
+                                    tool_result = format_command_error(parsed)
+                                    result_label = "Command Format Error"
+                                    print(Fore.RED + f"[VALIDATION ERROR] {parsed.error.message} at character {parsed.error.pos}." + Style.RESET_ALL)
+                                else:
+                                    command = parsed.command
+                                    if parsed.autofixed:
+                                        print(Fore.YELLOW + f"[LENIENCY] Auto-fixed 1 missing closing parenthesis." + Style.RESET_ALL)
+                                
+                                    # Check block types, inputs and enum values against blocks.txt
+                                    validation_errors = block_catalog.validate(parsed.ast, placement_type)
+                                    if validation_errors:
+                                        tool_result = format_validation_errors(command, validation_errors)
+                                        result_label = "Invalid Block Error"
+                                        print(Fore.RED + f"[VALIDATION ERROR] {'; '.join(e.message for e in validation_errors)}" + Style.RESET_ALL)
                             
-                            # Only proceed if validation passed (no error was set)
-                            if tool_result is None:
-                                # Validate type: "input" usage with input_name
-                                if placement_type == "input" and input_name:
-                                    valid_mcp_outputs = all(input_name.startswith("R") and input_name[1:].isdigit() for _ in [input_name]) if input_name.startswith("R") else False
-                                    valid_conditional_branches = input_name in ("DO0", "DO1", "DO2", "DO3", "DO4", "DO5", "ELSE") or input_name.startswith("DO")
+                                # Only proceed if validation passed (no error was set)
+                                if tool_result is None:
+                                    # Validate type: "input" usage with input_name
+                                    if placement_type == "input" and input_name:
+                                        valid_mcp_outputs = all(input_name.startswith("R") and input_name[1:].isdigit() for _ in [input_name]) if input_name.startswith("R") else False
+                                        valid_conditional_branches = input_name in ("DO0", "DO1", "DO2", "DO3", "DO4", "DO5", "ELSE") or input_name.startswith("DO")
                                     
-                                    if not valid_mcp_outputs and not valid_conditional_branches:
-                                        tool_result = f"[ERROR] Invalid input_name '{input_name}' used with type: 'input'. Valid values are:\n- MCP output slots: 'R0', 'R1', 'R2', etc.\n- Conditional branches: 'DO0', 'DO1', 'DO2', etc., or 'ELSE'\n\nThe attempted command was:\n\n`{command_stripped}`"
-                                        result_label = "Invalid Placement Error"
-                                        print(Fore.RED + f"[VALIDATION ERROR] Invalid input_name for type 'input': {input_name}" + Style.RESET_ALL)
+                                        if not valid_mcp_outputs and not valid_conditional_branches:
+                                            tool_result = f"[ERROR] Invalid input_name '{input_name}' used with type: 'input'. Valid values are:\n- MCP output slots: 'R0', 'R1', 'R2', etc.\n- Conditional branches: 'DO0', 'DO1', 'DO2', etc., or 'ELSE'\n\nThe attempted command was:\n\n`{command_stripped}`"
+                                            result_label = "Invalid Placement Error"
+                                            print(Fore.RED + f"[VALIDATION ERROR] Invalid input_name for type 'input': {input_name}" + Style.RESET_ALL)
                                 
-                                # Only proceed if no validation errors
-                                if tool_result is None:
-                                    # Check if this is the first MCP output block creation attempt
-                                    if (not first_output_block_attempted and 
-                                        placement_type == "input" and 
-                                        input_name and 
-                                        input_name.startswith("R")):
-                                        is_first_output_attempt = True
-                                        # Mark that we've attempted an output block in this conversation
-                                        first_output_block_attempted = True
-                                        # Return warning instead of creating the block
-                                        tool_result = "[TOOL] Automated warning: Make sure your output block contains the full and entire value needed. Block placement was **not** executed. Retry with the full command needed in one go."
-                                        result_label = "Output Block Warning"
-                                        print(Fore.YELLOW + f"[FIRST OUTPUT BLOCK] Intercepted first output block attempt with command `{command}`." + Style.RESET_ALL)
-                                    else:
-                                        # Normal block creation
-                                        if blockID is None:
-                                            print(Fore.YELLOW + f"Agent created block with command `{command}`." + Style.RESET_ALL)
+                                    # Only proceed if no validation errors
+                                    if tool_result is None:
+                                        # Check if this is the first MCP output block creation attempt
+                                        if (not first_output_block_attempted and 
+                                            placement_type == "input" and 
+                                            input_name and 
+                                            input_name.startswith("R")):
+                                            is_first_output_attempt = True
+                                            # Mark that we've attempted an output block in this conversation
+                                            first_output_block_attempted = True
+                                            # Return warning instead of creating the block
+                                            tool_result = "[TOOL] Automated warning: Make sure your output block contains the full and entire value needed. Block placement was **not** executed. Retry with the full command needed in one go."
+                                            result_label = "Output Block Warning"
+                                            print(Fore.YELLOW + f"[FIRST OUTPUT BLOCK] Intercepted first output block attempt with command `{command}`." + Style.RESET_ALL)
                                         else:
-                                            print(Fore.YELLOW + f"Agent created block with command `{command}`, type: {placement_type}, blockID: `{blockID}`." + Style.RESET_ALL)
-                                        if input_name:
-                                            print(Fore.YELLOW + f"  Input name: {input_name}" + Style.RESET_ALL)
-                                        tool_result = create_block(command, blockID, placement_type, input_name)
-                                        result_label = "Create Operation"
+                                            # Normal block creation
+                                            if blockID is None:
+                                                print(Fore.YELLOW + f"Agent created block with command `{command}`." + Style.RESET_ALL)
+                                            else:
+                                                print(Fore.YELLOW + f"Agent created block with command `{command}`, type: {placement_type}, blockID: `{blockID}`." + Style.RESET_ALL)
+                                            if input_name:
+                                                print(Fore.YELLOW + f"  Input name: {input_name}" + Style.RESET_ALL)
+                                            tool_result = await create_block(command, blockID, placement_type, input_name)
+                                            result_label = "Create Operation"
+                        
+                            elif function_name == "create_variable":
+                                name = function_args.get("name", "")
+                                print(Fore.YELLOW + f"Agent created variable with name `{name}`." + Style.RESET_ALL)
+                                tool_result = await create_variable(name)
+                                result_label = "Create Var Operation"
                         
-                        elif function_name == "create_variable":
-                            name = function_args.get("name", "")
-                            print(Fore.YELLOW + f"Agent created variable with name `{name}`." + Style.RESET_ALL)
-                            tool_result = create_variable(name)
-                            result_label = "Create Var Operation"
+                            elif function_name == "edit_mcp":
+                                inputs = function_args.get("inputs", None)
+                                outputs = function_args.get("outputs", None)
+                                print(Fore.YELLOW + f"Agent editing MCP block: inputs={inputs}, outputs={outputs}." + Style.RESET_ALL)
+                                tool_result = await edit_mcp(inputs, outputs)
+                                result_label = "Edit MCP Operation"
                         
-                        elif function_name == "edit_mcp":
-                            inputs = function_args.get("inputs", None)
-                            outputs = function_args.get("outputs", None)
-                            print(Fore.YELLOW + f"Agent editing MCP block: inputs={inputs}, outputs={outputs}." + Style.RESET_ALL)
-                            tool_result = edit_mcp(inputs, outputs)
-                            result_label = "Edit MCP Operation"
+                            elif function_name == "replace_block":
+                                block_id = function_args.get("block_id", "")
+                                command = function_args.get("command", "")
+                                parsed = parse_command(command)
+                                if parsed.error:
+                                    tool_result = format_command_error(parsed)
+                                    result_label = "Command Format Error"
+                                    print(Fore.RED + f"[VALIDATION ERROR] {parsed.error.message} at character {parsed.error.pos}." + Style.RESET_ALL)
+                                else:
+                                    command = parsed.command
+                                    validation_errors = block_catalog.validate(parsed.ast)
+                                    if validation_errors:
+                                        tool_result = format_validation_errors(command, validation_errors)
+                                        result_label = "Invalid Block Error"
+                                        print(Fore.RED + f"[VALIDATION ERROR] {'; '.join(e.message for e in validation_errors)}" + Style.RESET_ALL)
+                                    else:
+                                        print(Fore.YELLOW + f"Agent replacing block with ID `{block_id}` with command `{command}`." + Style.RESET_ALL)
+                                        tool_result = await replace_block(block_id, command)
+                                        result_label = "Replace Block Operation"
                         
-                        elif function_name == "replace_block":
-                            block_id = function_args.get("block_id", "")
-                            command = function_args.get("command", "")
-                            print(Fore.YELLOW + f"Agent replacing block with ID `{block_id}` with command `{command}`." + Style.RESET_ALL)
-                            tool_result = replace_block(block_id, command)
-                            result_label = "Replace Block Operation"
+                            elif function_name == "find_blocks":
+                                print(Fore.YELLOW + f"Agent searched the workspace: {function_args}." + Style.RESET_ALL)
+                                tool_result = find_blocks(
+                                    block_type=function_args.get("type"),
+                                    parent_id=function_args.get("parent_id"),
+                                    text=function_args.get("text"),
+                                    variable=function_args.get("variable"),
+                                    block_id=function_args.get("block_id"),
+                                )
+                                result_label = "Workspace Search"
                         
-                        elif function_name == "deploy_to_huggingface":
-                            space_name = function_args.get("space_name", "")
-                            print(Fore.YELLOW + f"Agent deploying to Hugging Face Space `{space_name}`." + Style.RESET_ALL)
-                            tool_result = deploy_to_huggingface(space_name)
-                            result_label = "Deployment Result"
+                            elif function_name == "preview_mcp_server":
+                                print(Fore.YELLOW + "Agent starting the local MCP preview." + Style.RESET_ALL)
+                                tool_result = await preview_mcp_server()
+                                result_label = "Preview Server"
+                        
+                            elif function_name in mcp_routes:
+                                mcp_url, mcp_tool_name = mcp_routes[function_name]
+                                print(Fore.YELLOW + f"Agent called MCP tool `{mcp_tool_name}` with {function_args}." + Style.RESET_ALL)
+                                tool_result = await call_user_mcp_tool(mcp_url, mcp_tool_name, function_args)
+                                result_label = "MCP Tool"
+                        
+                            elif function_name == "deploy_to_huggingface":
+                                space_name = function_args.get("space_name", "")
+                                print(Fore.YELLOW + f"Agent deploying to Hugging Face Space `{space_name}`." + Style.RESET_ALL)
+                                tool_result = await deploy_to_huggingface(space_name)
+                                result_label = "Deployment Result"
+                        finally:
+                            cancellation.reset_current(cancel_handle)
+                            tracing.reset_current(span_token)
+                        if isinstance(tool_result, str):
+                            tool_result = id_aliases.encode(tool_result)
+                        routing.tool_called(function_name, result_label, tool_result)
+                        if plan_replay is not None and not plan_replay.diverged and \
+                                not plan_replay.tool_result(tool_index, tool_result):
+                            # The stale plan would diverge again for every identical request
+                            response_cache.evict(plan_replay.key, plan_replay.plan)
+                        if plan_recorder is not None:
+                            plan_recorder.tool_result(function_name, tool_result)
+                        tool_span.set(label=result_label, result=str(tool_result)[:300])
+                        tool_span.end()
                         
                         # SHOW TOOL RESULT IMMEDIATELY
                         if tool_result is not None:
-                            print(Fore.YELLOW + f"[TOOL RESULT] {tool_result}" + Style.RESET_ALL)
-                            
                             if accumulated_response:
                                 accumulated_response += "\n\n"
                             accumulated_response += f"**{result_label}:** {tool_result}"
@@ -1221,6 +1874,7 @@ def create_gradio_interface():
                     # Tell model to respond to tool result
                     current_prompt = "The tool has been executed with the result shown above. Please respond appropriately."
                     
+                    iteration_span.end()
                     continue  # Continue the main loop
                 
                 else:
@@ -1229,19 +1883,43 @@ def create_gradio_interface():
                             accumulated_response += "\n\n"
                         accumulated_response += ai_response
                     
+                    iteration_span.end()
+                    if SHOW_USAGE:
+                        accumulated_response += f"\n\n{usage_footer(turn_usage)}"
+                    answered = True
+                    if plan_recorder is not None:
+                        plan = plan_recorder.plan()
+                        if plan is not None:
+                            response_cache.put(plan_recorder.key, plan)
                     yield accumulated_response
                     break
                 
+            except Cancelled as e:
+                iteration_span.error(e)
+                iteration_span.end()
+                metrics.CHAT_ITERATIONS_PER_TURN.observe(current_iteration)
+                yield f"{accumulated_response}\n\n*(Stopped: {e.reason})*".strip()
+                return
+            
             except Exception as e:
+                iteration_span.error(e)
+                trace.error(e)
+                metrics.CHAT_TURN_ERRORS.inc()
+                metrics.CHAT_ITERATIONS_PER_TURN.observe(current_iteration)
                 if accumulated_response:
                     yield f"{accumulated_response}\n\nError in iteration {current_iteration}: {str(e)}"
                 else:
                     yield f"Error: {str(e)}"
                 return
         
+        metrics.CHAT_ITERATIONS_PER_TURN.observe(current_iteration)
+        trace.set(iterations=current_iteration)
+        
         # Max iterations reached
-        if current_iteration >= max_iterations:
+        if not answered and current_iteration >= max_iterations:
             accumulated_response += f"\n\n*(Reached maximum of {max_iterations} consecutive responses)*"
+            if SHOW_USAGE:
+                accumulated_response += f"\n\n{usage_footer(turn_usage)}"
             yield accumulated_response
 
 
@@ -1249,6 +1927,17 @@ def create_gradio_interface():
     demo = gr.ChatInterface(
         fn=chat_with_context,
     )
+    
+    # Gradio's stop only stops reading the generator; cancel the turn itself too
+    with demo:
+        def stop_turn(request: gr.Request):
+            cancel_active_turn("stopped by user", request.session_hash)
+
+        def close_turn(request: gr.Request):
+            cancel_active_turn("tab closed", request.session_hash)
+
+        demo.textbox.stop(stop_turn, None, None, queue=False)
+        demo.unload(close_turn)
 
     return demo
 
@@ -0,0 +1,107 @@
+"""
+Argument coercion for test runs of the workspace tool.
+
+The Testing tab sends every input as text (or a bool for checkboxes). Instead of
+inspecting the signature and branching on each annotation for every call, the
+converters are built once per code version as a tuple of functions, one per
+parameter of create_mcp.
+
+List inputs are parsed as a JSON array first (orjson when installed, otherwise
+the standard library) and fall back to Python literals, so both '["a", "b"]' and
+"['a', 'b']" work.
+"""
+
+import ast
+import inspect
+import json
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _JSONError = orjson.JSONDecodeError
+except ImportError:
+    _json_loads = json.loads
+    _JSONError = json.JSONDecodeError
+
+
+def to_int(arg):
+    try:
+        return int(arg)
+    except ValueError:
+        try:
+            return int(float(arg))  # Allow "3.5" to become 3
+        except Exception:
+            return arg
+    except Exception:
+        return arg
+
+
+def to_float(arg):
+    try:
+        return float(arg)
+    except Exception:
+        return arg
+
+
+def to_bool(arg):
+    # Checkboxes in Gradio send True/False, text inputs send strings
+    if isinstance(arg, bool):
+        return arg
+    return str(arg).lower() in ("true", "1")
+
+
+def to_list(arg):
+    # Already structured values (lists, uploaded tables) are passed through
+    if not isinstance(arg, str):
+        return arg
+    try:
+        parsed = _json_loads(arg)
+    except (_JSONError, TypeError, ValueError):
+        parsed = None
+    # Only a JSON array is taken as is; "true", "null" or "5" keep the old handling below
+    if isinstance(parsed, list):
+        return parsed
+    try:
+        # Convert string like "['a', 'b', 'c']" into an actual list
+        return ast.literal_eval(arg)
+    except Exception:
+        # If parsing fails, wrap it as a single-item list
+        return [arg]
+
+
+def to_str(arg):
+    return str(arg)
+
+
+def passthrough(arg):
+    return arg
+
+
+_CONVERTERS = {
+    int: to_int,
+    float: to_float,
+    bool: to_bool,
+    list: to_list,
+    str: to_str,
+    inspect.Parameter.empty: to_str,
+}
+
+
+def build_converters(function):
+    """Return a tuple with one converter per parameter of function."""
+    converters = []
+    for param in inspect.signature(function).parameters.values():
+        try:
+            converters.append(_CONVERTERS.get(param.annotation, passthrough))
+        except TypeError:
+            # Unhashable annotations are never one of the known types
+            converters.append(passthrough)
+    return tuple(converters)
+
+
+def coerce_args(converters, user_inputs):
+    """Convert raw inputs with the converters. Empty inputs become None; extra inputs are dropped."""
+    return [
+        None if arg is None or (isinstance(arg, str) and arg == "") else convert(arg)
+        for convert, arg in zip(converters, user_inputs)
+    ]
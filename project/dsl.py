@@ -0,0 +1,254 @@
+"""
+Parser for the block command DSL used by create_block and replace_block.
+
+Commands look like `block_name(inputs(KEY: value, KEY2: nested_block(inputs(...))))`.
+Values can be nested blocks, quoted strings, numbers (JSON and Python
+numeric literals: -2.5, .5, 1e5, 1_000), bare words, or a bare key with
+no value at all (like `ELSE` in controls_if).
+
+Parsed commands are cached by their exact string so retries of the same command
+(common when the model re-sends a replace_block) skip tokenizing entirely.
+"""
+
+import re
+from collections import OrderedDict, namedtuple
+
+# AST nodes. Tuples are immutable, so cached trees can be shared safely.
+Block = namedtuple("Block", ["name", "inputs", "outputs", "pos"])
+Input = namedtuple("Input", ["key", "value", "pos"])
+Literal = namedtuple("Literal", ["kind", "value", "pos"])  # kind: string, number, word
+ParseResult = namedtuple("ParseResult", ["ast", "command", "error", "autofixed"])
+
+Token = namedtuple("Token", ["kind", "value", "pos"])
+
+# Sections a block may wrap its inputs in
+SECTIONS = ("inputs", "outputs")
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<number>[+-]?(?:\d+(?:_\d+)*(?:\.(?:\d+(?:_\d+)*)?)?|\.\d+(?:_\d+)*)(?:[eE][+-]?\d+(?:_\d+)*)?(?![\w.]))
+  | (?P<ident>[A-Za-z_][\w]*)
+  | (?P<punct>[(),:])
+""", re.VERBOSE)
+
+
+class DSLSyntaxError(Exception):
+    """Raised when a command cannot be parsed. `pos` is the 0-based character offset."""
+
+    def __init__(self, message, pos):
+        super().__init__(message)
+        self.message = message
+        self.pos = pos
+
+    def describe(self, command):
+        """Human/model readable error with a caret pointing at the problem."""
+        line_start = command.rfind("\n", 0, self.pos) + 1
+        line_end = command.find("\n", self.pos)
+        if line_end == -1:
+            line_end = len(command)
+        line = command[line_start:line_end]
+        caret = " " * (self.pos - line_start) + "^"
+        return f"{self.message} (at character {self.pos})\n\n    {line}\n    {caret}"
+
+
+def tokenize(command):
+    tokens = []
+    i = 0
+    length = len(command)
+    while i < length:
+        char = command[i]
+
+        # Quoted strings, supporting both quote styles and backslash escapes
+        if char in ('"', "'"):
+            start = i
+            i += 1
+            chars = []
+            while i < length and command[i] != char:
+                if command[i] == "\\" and i + 1 < length:
+                    chars.append(command[i + 1])
+                    i += 2
+                    continue
+                chars.append(command[i])
+                i += 1
+            if i >= length:
+                raise DSLSyntaxError("Unterminated string", start)
+            i += 1
+            tokens.append(Token("string", "".join(chars), start))
+            continue
+
+        match = _TOKEN_RE.match(command, i)
+        if not match:
+            raise DSLSyntaxError(f"Unexpected character {char!r}", i)
+        kind = match.lastgroup
+        if kind != "ws":
+            tokens.append(Token(kind if kind != "punct" else match.group(), match.group(), i))
+        i = match.end()
+
+    tokens.append(Token("eof", "", length))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+
+    def advance(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, kind, context):
+        token = self.peek()
+        if token.kind != kind:
+            found = "end of command" if token.kind == "eof" else repr(token.value)
+            raise DSLSyntaxError(f"Expected '{kind}' {context}, found {found}", token.pos)
+        return self.advance()
+
+    def parse_command(self):
+        block = self.parse_block()
+        token = self.peek()
+        if token.kind != "eof":
+            raise DSLSyntaxError(f"Unexpected {token.value!r} after the end of the block", token.pos)
+        return block
+
+    def parse_block(self):
+        name_token = self.peek()
+        if name_token.kind != "ident":
+            found = "end of command" if name_token.kind == "eof" else repr(name_token.value)
+            raise DSLSyntaxError(f"Expected a block name, found {found}", name_token.pos)
+        self.advance()
+        self.expect("(", f"after block name '{name_token.value}'")
+
+        inputs = []
+        outputs = []
+        while self.peek().kind != ")":
+            token = self.peek()
+            # `inputs(...)` / `outputs(...)` sections
+            if token.kind == "ident" and token.value in SECTIONS and self.peek(1).kind == "(":
+                self.advance()
+                self.advance()
+                target = inputs if token.value == "inputs" else outputs
+                target.extend(self.parse_input_list(token.value))
+                self.expect(")", f"to close {token.value}(")
+            else:
+                # Tolerate bare key/value pairs without the inputs() wrapper
+                inputs.append(self.parse_input(name_token.value))
+            if self.peek().kind == ",":
+                self.advance()
+            elif self.peek().kind != ")":
+                break
+
+        self.expect(")", f"to close {name_token.value}(")
+        return Block(name_token.value, tuple(inputs), tuple(outputs), name_token.pos)
+
+    def parse_input_list(self, section):
+        items = []
+        while self.peek().kind != ")":
+            items.append(self.parse_input(section))
+            if self.peek().kind == ",":
+                self.advance()
+                continue
+            break
+        return items
+
+    def parse_input(self, context):
+        key_token = self.peek()
+        if key_token.kind != "ident":
+            found = "end of command" if key_token.kind == "eof" else repr(key_token.value)
+            raise DSLSyntaxError(f"Expected an input name in {context}, found {found}", key_token.pos)
+        self.advance()
+
+        # Bare flag like ELSE
+        if self.peek().kind in (",", ")"):
+            return Input(key_token.value, None, key_token.pos)
+        if self.peek().kind != ":":
+            raise DSLSyntaxError(f"Expected ':' after input name '{key_token.value}'", self.peek().pos)
+        self.advance()
+        return Input(key_token.value, self.parse_value(key_token.value), key_token.pos)
+
+    def parse_value(self, key):
+        token = self.peek()
+        if token.kind == "ident" and self.peek(1).kind == "(":
+            return self.parse_block()
+        if token.kind in ("string", "number", "ident"):
+            self.advance()
+            kind = "word" if token.kind == "ident" else token.kind
+            value = float(token.value) if token.kind == "number" else token.value
+            return Literal(kind, value, token.pos)
+        found = "end of command" if token.kind == "eof" else repr(token.value)
+        raise DSLSyntaxError(f"Expected a value for '{key}', found {found}", token.pos)
+
+
+def _missing_closing_parens(tokens):
+    depth = 0
+    for token in tokens:
+        if token.kind == "(":
+            depth += 1
+        elif token.kind == ")":
+            depth -= 1
+    return depth
+
+
+# Bounded cache of command string -> ParseResult
+_parse_cache = OrderedDict()
+PARSE_CACHE_SIZE = 512
+
+
+def parse_command(command):
+    """
+    Parse a block command into an AST.
+
+    Allows leniency of one missing closing parenthesis at the end, which is
+    appended automatically (and reported via `autofixed`).
+
+    Returns:
+        ParseResult(ast, command, error, autofixed). `command` is the possibly
+        auto-fixed command string; `error` is a DSLSyntaxError or None.
+    """
+    command = command.strip()
+    cached = _parse_cache.get(command)
+    if cached is not None:
+        _parse_cache.move_to_end(command)
+        return cached
+
+    result = _parse_uncached(command)
+
+    _parse_cache[command] = result
+    if len(_parse_cache) > PARSE_CACHE_SIZE:
+        _parse_cache.popitem(last=False)
+    return result
+
+
+def _parse_uncached(command):
+    try:
+        tokens = tokenize(command)
+    except DSLSyntaxError as e:
+        return ParseResult(None, command, e, False)
+
+    autofixed = False
+    missing = _missing_closing_parens(tokens)
+    if missing == 1:
+        command = command + ")"
+        tokens = tokens[:-1] + [Token(")", ")", len(command) - 1), Token("eof", "", len(command))]
+        autofixed = True
+    elif missing > 1:
+        return ParseResult(None, command, DSLSyntaxError(
+            f"Too many unbalanced parentheses ({missing} missing)", len(command)), False)
+
+    try:
+        ast = _Parser(tokens).parse_command()
+    except DSLSyntaxError as e:
+        return ParseResult(None, command, e, autofixed)
+    return ParseResult(ast, command, None, autofixed)
+
+
+def iter_blocks(block):
+    """Yield a block and every block nested in its inputs/outputs, depth first."""
+    yield block
+    for item in block.inputs + block.outputs:
+        if isinstance(item.value, Block):
+            yield from iter_blocks(item.value)
@@ -0,0 +1,198 @@
+"""
+Token-budgeted conversation history for the chat agent.
+
+The most recent turns are sent verbatim. Older turns that no longer fit in the
+budget are collapsed into one-line summaries, which are cached per turn so they
+are only computed once, when a turn first rolls off. The summary block only
+changes when another turn rolls off, so the start of the input stays stable
+across iterations and requests.
+"""
+
+import hashlib
+import os
+import re
+from collections import Counter, OrderedDict
+
+from accounting import strip_usage_footer
+from tokens import estimate_tokens
+
+# Total tokens allowed for history (verbatim turns + summary)
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "6000"))
+
+# Share of the budget the summary of older turns may use
+SUMMARY_SHARE = 0.25
+
+SUMMARY_CACHE_SIZE = 2048
+
+_TOOL_LABEL_RE = re.compile(r"\*\*([^*\n]+?):\*\*")
+_TOOL_LINE_RE = re.compile(r"\*\*[^*\n]+?:\*\*[^\n]*(?:\n(?!\n)[^\n]*)*")
+
+
+def normalize_history(history):
+    """
+    Convert Gradio chat history into a list of (user, assistant) turns.
+
+    Accepts both the tuple format ([user, assistant] pairs) and the messages
+    format ({"role": ..., "content": ...} dicts).
+    """
+    turns = []
+    pending_user = None
+    for entry in history or []:
+        if isinstance(entry, dict):
+            role = entry.get("role")
+            content = _content_text(entry.get("content"))
+            if role == "user":
+                if pending_user is not None:
+                    turns.append((pending_user, ""))
+                pending_user = content
+            elif role == "assistant":
+                content = strip_usage_footer(content)  # Usage lines are for the user, not the model
+                if pending_user is None:
+                    if turns:
+                        user, assistant = turns.pop()
+                        turns.append((user, f"{assistant}\n\n{content}".strip()))
+                    else:
+                        turns.append(("", content))
+                else:
+                    turns.append((pending_user, content))
+                    pending_user = None
+        else:
+            user, assistant = entry
+            turns.append((_content_text(user), strip_usage_footer(_content_text(assistant))))
+    if pending_user is not None:
+        turns.append((pending_user, ""))
+    return turns
+
+
+def _content_text(content):
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, (list, tuple)):
+        return "\n".join(_content_text(part) for part in content)
+    if isinstance(content, dict):
+        return str(content.get("text") or content.get("content") or "")
+    return str(content)
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[: limit - 3].rstrip() + "..."
+
+
+def _first_sentence(text):
+    match = re.search(r"(.+?[.!?])(\s|$)", text.strip(), re.DOTALL)
+    return match.group(1) if match else text.strip()
+
+
+def summarize_turn(user, assistant):
+    """Local, extractive one-line summary of a turn. No model calls."""
+    operations = Counter(_TOOL_LABEL_RE.findall(assistant))
+    reply = _TOOL_LINE_RE.sub("", assistant).strip()
+
+    summary = f"- User: {_clip(_first_sentence(user), 160) or '(empty)'}"
+    if reply:
+        summary += f" | Assistant: {_clip(_first_sentence(reply), 200)}"
+    if operations:
+        summary += " | Tools: " + ", ".join(f"{count}x {label}" for label, count in operations.items())
+    return summary
+
+
+class HistoryManager:
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, summary_share=SUMMARY_SHARE, summarizer=summarize_turn):
+        self.token_budget = token_budget
+        self.summary_budget = int(token_budget * summary_share)
+        self.summarizer = summarizer
+        self._summaries = OrderedDict()  # turn hash -> (summary, tokens)
+        self._turn_tokens = OrderedDict()  # turn hash -> verbatim tokens
+
+    def _key(self, user, assistant):
+        return hashlib.sha1(f"{user}\x00{assistant}".encode("utf-8")).hexdigest()
+
+    def _cached(self, cache, key, compute):
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache[key] = value
+            if len(cache) > SUMMARY_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return value
+
+    def turn_tokens(self, user, assistant):
+        key = self._key(user, assistant)
+        return self._cached(self._turn_tokens, key, lambda: estimate_tokens(user) + estimate_tokens(assistant))
+
+    def summary(self, user, assistant):
+        key = self._key(user, assistant)
+
+        def compute():
+            text = self.summarizer(user, assistant)
+            return text, estimate_tokens(text) + 1
+
+        return self._cached(self._summaries, key, compute)
+
+    def build_input_items(self, history):
+        """
+        Build Responses API input items for the history, within the token budget.
+
+        Returns:
+            List of input items: an optional developer message summarizing older turns,
+            followed by the most recent turns verbatim.
+        """
+        turns = normalize_history(history)
+        if not turns:
+            return []
+
+        # Keep the most recent turns verbatim while they fit
+        kept = 0
+        used = 0
+        verbatim_budget = self.token_budget - self.summary_budget
+        for user, assistant in reversed(turns):
+            cost = self.turn_tokens(user, assistant)
+            if kept and used + cost > verbatim_budget:
+                break
+            used += cost
+            kept += 1
+        rolled_off = turns[: len(turns) - kept]
+        recent = turns[len(turns) - kept:]
+
+        items = []
+        if rolled_off:
+            # Most recent summaries win when even the summaries don't fit
+            lines = []
+            summary_tokens = 0
+            for user, assistant in reversed(rolled_off):
+                line, cost = self.summary(user, assistant)
+                if summary_tokens + cost > self.summary_budget:
+                    break
+                lines.append(line)
+                summary_tokens += cost
+            lines.reverse()
+            dropped = len(rolled_off) - len(lines)
+            header = "Summary of the earlier conversation (older turns were condensed to save space):"
+            if dropped:
+                header += f"\n- ({dropped} earlier turns omitted)"
+            items.append({"role": "developer", "content": header + "\n" + "\n".join(lines)})
+
+        for index, (user, assistant) in enumerate(recent):
+            # Only the newest turn can be larger than the budget on its own; clip it
+            if index == 0 and used > verbatim_budget:
+                user, assistant = self._clip_turn(user, assistant, verbatim_budget)
+            items.append({"role": "user", "content": user})
+            items.append({"role": "assistant", "content": assistant})
+        return items
+
+    def _clip_turn(self, user, assistant, budget):
+        chars = max(budget, 0) * 4
+        user_chars = min(len(user), chars // 2)
+        assistant_chars = max(chars - user_chars, 0)
+        if len(user) > user_chars:
+            user = user[:user_chars] + "\n...(truncated)"
+        if len(assistant) > assistant_chars:
+            assistant = "(truncated)...\n" + assistant[len(assistant) - assistant_chars:]
+        return user, assistant
@@ -0,0 +1,351 @@
+"""
+Headless frontend simulator and load generator for the SSE tool protocol.
+
+SimulatedFrontend does what the browser code in src/index.js does over HTTP:
+it subscribes to /unified_stream, applies create/delete/variable/edit_mcp/replace
+operations to a minimal workspace model and posts the results to /request_result,
+with configurable latency and failure rate. Every tab receives every operation,
+so each simulated frontend keeps its own workspace, like a separate browser tab.
+
+Load test the tool path in-process (starts chat.app on a local port and drives
+the real tool functions from many concurrent sessions):
+
+    python loadgen.py --frontends 1 --sessions 200 --ops 10 --latency 0.02 --failure-rate 0.05
+
+Or only attach simulated frontends to a running server, e.g. while replaying
+a recorded session against it:
+
+    python loadgen.py --url http://127.0.0.1:7860 --frontends 1 --duration 60
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from dsl import parse_command
+
+
+class SimWorkspace:
+    """Just enough of a Blockly workspace to answer operations like the browser does."""
+
+    def __init__(self):
+        self.blocks = {}  # block id -> {"type", "parent"}
+        self.variables = {}  # variable name -> variable id
+        self.mcp_inputs = {}
+        self.mcp_outputs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(15)[:20]
+
+    def _block_type(self, block_spec):
+        parsed = parse_command(block_spec)
+        if parsed.error:
+            raise ValueError(str(parsed.error))
+        return parsed.ast.name
+
+    def apply(self, request):
+        """Apply an operation and return the result fields the browser would send (minus ids)."""
+        request_type = request.get("type")
+        with self._lock:
+            if request_type == "create":
+                block_type = self._block_type(request["block_spec"])
+                parent = request.get("blockID")
+                if request.get("placement_type") in ("input", "under") and parent not in self.blocks:
+                    raise ValueError(f"Parent block not found: {parent}")
+                block_id = self.new_id()
+                self.blocks[block_id] = {"type": block_type, "parent": parent}
+                return {"block_id": block_id}
+            if request_type == "delete":
+                block_id = request.get("block_id")
+                if block_id not in self.blocks:
+                    raise ValueError("Block not found")
+                self._dispose(block_id)
+                return {}
+            if request_type == "replace":
+                block_id = request.get("block_id")
+                if block_id not in self.blocks:
+                    raise ValueError("Block not found")
+                block_type = self._block_type(request["block_spec"])
+                new_id = self.new_id()
+                self.blocks[new_id] = {"type": block_type, "parent": self.blocks.pop(block_id)["parent"]}
+                for block in self.blocks.values():
+                    if block["parent"] == block_id:
+                        block["parent"] = new_id
+                return {"block_id": new_id}
+            if request_type == "variable":
+                name = request.get("variable_name")
+                variable_id = self.variables.setdefault(name, self.new_id())
+                return {"variable_id": variable_id}
+            if request_type == "edit_mcp":
+                if request.get("inputs") is not None:
+                    self.mcp_inputs = dict(request["inputs"])
+                if request.get("outputs") is not None:
+                    self.mcp_outputs = dict(request["outputs"])
+                return {}
+        raise ValueError(f"Unknown request type: {request_type}")
+
+    def _dispose(self, block_id):
+        self.blocks.pop(block_id, None)
+        for child_id in [i for i, block in self.blocks.items() if block["parent"] == block_id]:
+            self._dispose(child_id)
+
+
+class SimulatedFrontend:
+    """One headless browser tab connected to /unified_stream."""
+
+    def __init__(self, base_url, client, workspace=None, latency=0.0, jitter=0.0, failure_rate=0.0, rng=None):
+        self.base_url = base_url.rstrip("/")
+        self.client = client
+        self.workspace = workspace or SimWorkspace()
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.connected = asyncio.Event()
+        self.answered = Counter()
+        self.failed = Counter()
+
+    async def run(self):
+        async with self.client.stream("GET", f"{self.base_url}/unified_stream", timeout=None) as response:
+            self.connected.set()
+            pending = set()
+            try:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = json.loads(line[len("data: "):])
+                    if data.get("heartbeat"):
+                        continue
+                    # Answer concurrently, like the browser's fire-and-forget fetch()
+                    task = asyncio.create_task(self.answer(data))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    async def answer(self, request):
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        request_type = request.get("type")
+        result = {"request_type": request_type, "success": False, "error": None}
+        if self.rng.random() < self.failure_rate:
+            result["error"] = "Simulated failure"
+        else:
+            try:
+                result.update(self.workspace.apply(request))
+                result["success"] = True
+            except Exception as e:
+                result["error"] = str(e)
+
+        if request_type == "delete":
+            result["block_id"] = request.get("block_id")
+        else:
+            result["request_id"] = request.get("request_id")
+
+        self.answered[request_type] += 1
+        if not result["success"]:
+            self.failed[request_type] += 1
+        await self.client.post(f"{self.base_url}/request_result", json=result)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def run_frontends(base_url, count, stop, ready, **options):
+    """Run simulated frontends until stop (a threading.Event) is set. Returns them for stats."""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        frontends = [SimulatedFrontend(base_url, client, SimWorkspace(), rng=random.Random(i), **options)
+                     for i in range(count)]
+        tasks = [asyncio.create_task(frontend.run()) for frontend in frontends]
+        await asyncio.gather(*(frontend.connected.wait() for frontend in frontends))
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return frontends
+
+
+def start_frontends(base_url, count, **options):
+    """Run frontends on their own event loop thread. Returns (stop event, thread, result holder)."""
+    stop = threading.Event()
+    ready = threading.Event()
+    holder = {}
+
+    def target():
+        holder["frontends"] = asyncio.run(run_frontends(base_url, count, stop, ready, **options))
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    if not ready.wait(timeout=30):
+        raise RuntimeError(f"Simulated frontends could not connect to {base_url}")
+    return stop, thread, holder
+
+
+def start_local_server(app, port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("Local server did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+async def run_session(chat, session, ops, rng):
+    """One simulated agent: a mix of tool calls against its own blocks. Returns [(type, seconds, ok)]."""
+    samples = []
+    blocks = []
+
+    async def call(request_type, function, *args):
+        start = time.perf_counter()
+        message = await function(*args)
+        samples.append((request_type, time.perf_counter() - start, message.startswith("[TOOL] Successfully")))
+        return message
+
+    await call("edit_mcp", chat.edit_mcp, {f"input{session}": "string"}, None)
+    for i in range(ops):
+        choice = rng.random()
+        if not blocks or choice < 0.45:
+            message = await call("create", chat.create_block, f'text(inputs(TEXT: "session {session} op {i}"))')
+            if message.startswith("[TOOL] Successfully created block: "):
+                blocks.append(message.rsplit(": ", 1)[1])
+        elif choice < 0.65:
+            await call("variable", chat.create_variable, f"var_{session}_{i}")
+        elif choice < 0.85:
+            # A replaced block gets a new id in the browser, which the tool result does not report
+            block_id = blocks.pop(rng.randrange(len(blocks)))
+            await call("replace", chat.replace_block, block_id, f'text(inputs(TEXT: "replaced {i}"))')
+        else:
+            await call("delete", chat.delete_block, blocks.pop(rng.randrange(len(blocks))))
+    return samples
+
+
+async def run_sessions(chat, sessions, ops):
+    """All sessions share one event loop, like concurrent chat turns do in the server."""
+    results = await asyncio.gather(*(run_session(chat, s, ops, random.Random(s)) for s in range(sessions)))
+    return [sample for samples in results for sample in samples]
+
+
+def load_test(frontends=1, sessions=100, ops=10, port=8765, quiet=True, **options):
+    """Drive the real tool functions from many sessions against simulated frontends over HTTP."""
+    import chat
+
+    output = io.StringIO() if quiet else None
+    with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        server, server_thread = start_local_server(chat.app, port)
+        stop, frontend_thread, holder = start_frontends(f"http://127.0.0.1:{port}", frontends, **options)
+        started = time.perf_counter()
+        try:
+            samples = asyncio.run(run_sessions(chat, sessions, ops))
+        finally:
+            elapsed = time.perf_counter() - started
+            stop.set()
+            frontend_thread.join(timeout=10)
+            server.should_exit = True
+            server_thread.join(timeout=10)
+
+    by_type = defaultdict(list)
+    for request_type, seconds, ok in samples:
+        by_type[request_type].append((seconds, ok))
+    latencies = [seconds for _, seconds, _ in samples]
+    report = {
+        "frontends": frontends,
+        "sessions": sessions,
+        "operations": len(samples),
+        "failed": sum(1 for _, _, ok in samples if not ok),
+        "elapsed_s": elapsed,
+        "ops_per_s": len(samples) / elapsed if elapsed else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p99_s": percentile(latencies, 99),
+        "max_s": max(latencies, default=0.0),
+        "by_type": {
+            request_type: {
+                "count": len(values),
+                "failed": sum(1 for _, ok in values if not ok),
+                "p50_s": percentile([s for s, _ in values], 50),
+                "p99_s": percentile([s for s, _ in values], 99),
+            }
+            for request_type, values in sorted(by_type.items())
+        },
+    }
+    return report
+
+
+def attach(url, frontends=1, duration=60, **options):
+    """Attach simulated frontends to a running server for duration seconds."""
+    stop, thread, holder = start_frontends(url, frontends, **options)
+    print(f"[LOADGEN] {frontends} simulated frontends connected to {url}")
+    time.sleep(duration)
+    stop.set()
+    thread.join(timeout=10)
+    answered = Counter()
+    failed = Counter()
+    for frontend in holder.get("frontends", []):
+        answered.update(frontend.answered)
+        failed.update(frontend.failed)
+    return {"answered": dict(answered), "failed": dict(failed), "duration_s": duration}
+
+
+def print_report(report, indent="  "):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{indent}{key}:")
+            print_report(value, indent + "  ")
+        elif isinstance(value, float):
+            print(f"{indent}{key}: {value:.4f}")
+        else:
+            print(f"{indent}{key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate browser frontends and load test the SSE tool protocol.")
+    parser.add_argument("--url", help="Attach frontends to this running server instead of running a local load test")
+    parser.add_argument("--frontends", type=int, default=1,
+                        help="Concurrent /unified_stream subscribers (tabs); each receives every operation")
+    parser.add_argument("--sessions", type=int, default=100, help="Concurrent simulated agent sessions (local mode)")
+    parser.add_argument("--ops", type=int, default=10, help="Tool calls per session (local mode)")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to stay attached (--url mode)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each frontend takes to apply an operation")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to --latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of operations answered with an error")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the local server (local mode)")
+    parser.add_argument("--verbose", action="store_true", help="Show the server's console output (local mode)")
+    args = parser.parse_args()
+
+    options = {"latency": args.latency, "jitter": args.jitter, "failure_rate": args.failure_rate}
+    if args.url:
+        report = attach(args.url, args.frontends, args.duration, **options)
+    else:
+        report = load_test(args.frontends, args.sessions, args.ops, args.port, quiet=not args.verbose, **options)
+    print("\n[LOADGEN REPORT]")
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Persistent MCP client sessions to the user's generated tool servers.
+
+Injecting a hosted MCP tool into every Responses call makes the provider connect
+to the server and list its tools again on every iteration. MCPPool keeps one
+initialized ClientSession per server URL instead, caches its tool list, and
+exposes the tools as ordinary function tools; the chat loop proxies their calls
+through the open session.
+
+Sessions live on a dedicated event loop thread, since an MCP session is bound to
+the task that opened it and chat turns run on whatever loop Gradio uses. A
+cached entry is replaced when the server's version changes (a redeploy, a
+preview reload) or when a call finds the connection broken.
+"""
+
+import asyncio
+import os
+import re
+import threading
+from datetime import timedelta
+
+try:
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+    MCP_AVAILABLE = True
+except ImportError:
+    MCP_AVAILABLE = False
+
+CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "30"))
+CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "120"))
+
+# Function tool names allow letters, digits, _ and - up to 64 characters
+_NAME_RE = re.compile(r"[^A-Za-z0-9_-]")
+MAX_TOOL_NAME = 64
+
+
+def function_tool_name(prefix, tool_name):
+    return (prefix + _NAME_RE.sub("_", tool_name))[:MAX_TOOL_NAME]
+
+
+def result_text(result):
+    """Flatten a CallToolResult into the text handed back to the model."""
+    parts = []
+    for content in result.content:
+        if getattr(content, "type", None) == "text":
+            parts.append(content.text)
+        else:
+            parts.append(f"[{getattr(content, 'type', 'content')} output]")
+    if not parts and getattr(result, "structuredContent", None) is not None:
+        parts.append(str(result.structuredContent))
+    return "\n".join(parts)
+
+
+class _Connection:
+    """One open session; runs as a task on the pool's loop until closed."""
+
+    def __init__(self, url, version):
+        self.url = url
+        self.version = version
+        self.session = None
+        self.tools = None  # Cached list_tools() result
+        self.ready = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.error = None
+        self.task = None
+
+    async def run(self):
+        try:
+            async with streamablehttp_client(self.url, timeout=CONNECT_TIMEOUT) as (read, write, _):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.tools = (await session.list_tools()).tools
+                    self.session = session
+                    print(f"[MCP POOL] Connected to {self.url} ({len(self.tools)} tools)")
+                    self.ready.set()
+                    await self.closed.wait()
+        except Exception as e:
+            # The transport reports failures as an exception group; the first one says what happened
+            while isinstance(e, BaseExceptionGroup) and e.exceptions:
+                e = e.exceptions[0]
+            self.error = e
+            print(f"[MCP POOL] Session to {self.url} ended: {e}")
+        finally:
+            self.session = None
+            self.closed.set()
+            self.ready.set()
+
+
+class MCPPool:
+    def __init__(self):
+        self._connections = {}  # url -> _Connection
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return MCP_AVAILABLE
+
+    def cached(self, url):
+        """True if the tools of url are known without connecting."""
+        connection = self._connections.get(url)
+        return connection is not None and connection.session is not None
+
+    async def list_tools(self, url, version=None):
+        """
+        Tools of the server at url, from the open session when there is one.
+
+        Args:
+            url: Streamable HTTP MCP endpoint
+            version: Anything identifying the deployed code; a new value reconnects and relists
+        """
+        connection = await self._run(self._connect(url, version))
+        return connection.tools
+
+    async def call_tool(self, url, name, arguments):
+        """Call a tool over the pooled session, reconnecting once if the connection broke."""
+        return await self._run(self._call(url, name, arguments), CALL_TIMEOUT + CONNECT_TIMEOUT)
+
+    def invalidate(self, url):
+        """Drop the session and tool list of url, e.g. after a redeploy."""
+        with self._lock:
+            loop = self._loop
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._close(url), loop)
+
+    def close_all(self):
+        with self._lock:
+            loop = self._loop
+        if loop is not None:
+            for url in list(self._connections):
+                asyncio.run_coroutine_threadsafe(self._close(url), loop)
+
+    async def _run(self, coro, timeout=CONNECT_TIMEOUT):
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            future.cancel()
+            raise
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="mcp-pool", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _connect(self, url, version):
+        connection = self._connections.get(url)
+        if connection is not None and (connection.closed.is_set() or connection.version != version):
+            await self._close(url)
+            connection = None
+        if connection is None:
+            connection = _Connection(url, version)
+            self._connections[url] = connection
+            connection.task = asyncio.create_task(connection.run())
+        await connection.ready.wait()
+        if connection.session is None:
+            self._connections.pop(url, None)
+            raise ConnectionError(f"Could not connect to MCP server {url}: {connection.error}")
+        return connection
+
+    async def _call(self, url, name, arguments):
+        connection = self._connections.get(url)
+        version = connection.version if connection is not None else None
+        for attempt in range(2):
+            connection = await self._connect(url, version)
+            try:
+                return await _unless_closed(connection, connection.session.call_tool(
+                    name, arguments, read_timeout_seconds=timedelta(seconds=CALL_TIMEOUT)))
+            except Exception as e:
+                if attempt or (not connection.closed.is_set() and not _is_connection_error(e)):
+                    raise
+                print(f"[MCP POOL] Call to {name} lost the connection, reconnecting: {e}")
+                await self._close(url)
+
+    async def _close(self, url):
+        connection = self._connections.pop(url, None)
+        if connection is None:
+            return
+        connection.closed.set()
+        if connection.task is not None:
+            try:
+                await asyncio.wait_for(connection.task, 5)
+            except Exception:
+                connection.task.cancel()
+
+
+async def _unless_closed(connection, coro):
+    """Await coro, failing fast if the session dies first instead of waiting for the read timeout."""
+    call = asyncio.ensure_future(coro)
+    closed = asyncio.ensure_future(connection.closed.wait())
+    try:
+        await asyncio.wait({call, closed}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        closed.cancel()
+    if not call.done():
+        call.cancel()
+        raise ConnectionError(f"MCP session to {connection.url} closed: {connection.error}")
+    return call.result()
+
+
+def _is_connection_error(error):
+    return isinstance(error, (ConnectionError, OSError)) or type(error).__name__ in (
+        "ClosedResourceError", "BrokenResourceError", "EndOfStream", "ConnectError", "RemoteProtocolError")
+
+
+mcp_pool = MCPPool()
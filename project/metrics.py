@@ -0,0 +1,248 @@
+"""
+Minimal Prometheus-style metrics for the chat and test pipelines.
+
+Metrics are process-global and thread-safe. `render()` produces the Prometheus
+text exposition format served by the /metrics endpoint.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from fast local work up to slow model calls and deploys
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Compute the (unlabelled) value at scrape time instead of storing it."""
+        self._function = function
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:
+                print(f"[METRICS WARN] Could not collect {self.name}: {e}")
+                return []
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state["count"] if state else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, dict(state, buckets=list(state["buckets"]))) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+def render():
+    """Render every registered metric in the Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# Chat agent loop
+CHAT_MODEL_CALL_SECONDS = Histogram(
+    "chat_model_call_seconds", "Latency of model calls in the chat loop, by iteration number", ["iteration"])
+CHAT_TURN_ERRORS = Counter("chat_turn_errors_total", "Chat turns that ended with an error")
+CHAT_ITERATIONS_PER_TURN = Histogram(
+    "chat_iterations_per_turn", "Model iterations used per chat turn", buckets=tuple(range(1, 16)))
+CHAT_TURNS_CANCELLED = Counter("chat_turns_cancelled_total", "Chat turns cancelled by stop, tab close or a new turn")
+OPERATIONS_PURGED = Counter("chat_operations_purged_total", "Unsent workspace operations dropped from cancelled turns")
+MODEL_ROUTED = Counter(
+    "chat_model_routed_total", "Model calls in the chat loop, by routed model and reason", ["model", "reason"])
+MODEL_ESCALATIONS = Counter("chat_model_escalations_total", "Chat turns escalated to the strong model by a validation error")
+
+# Token usage and cost
+MODEL_TOKENS = Counter(
+    "chat_model_tokens_total", "Tokens used by model calls, by model and kind (input, cached, output)", ["model", "kind"])
+MODEL_COST = Counter("chat_model_cost_usd_total", "Estimated cost of model calls in USD", ["model"])
+TURN_TOKENS = Histogram(
+    "chat_turn_tokens", "Input + output tokens per chat turn",
+    buckets=(1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000))
+TURN_COST = Histogram(
+    "chat_turn_cost_usd", "Estimated cost per chat turn in USD", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+BUDGET_ENFORCED = Counter("chat_budget_enforced_total", "Turns started over a session budget, by action", ["action"])
+
+# Response cache
+RESPONSE_CACHE_HITS = Counter("chat_response_cache_hits_total", "Chat turns replayed from the response cache")
+RESPONSE_CACHE_MISSES = Counter("chat_response_cache_misses_total", "Chat turns not found in the response cache")
+RESPONSE_CACHE_STORES = Counter("chat_response_cache_stores_total", "Chat turns stored in the response cache")
+RESPONSE_CACHE_DIVERGED = Counter(
+    "chat_response_cache_diverged_total", "Cached replays that fell back to the model when a tool result differed")
+
+# Browser tool round trips
+TOOL_ROUNDTRIP_SECONDS = Histogram(
+    "chat_tool_roundtrip_seconds", "Time from queueing a workspace operation to receiving its result", ["request_type"])
+TOOL_TIMEOUTS = Counter(
+    "chat_tool_timeouts_total", "Workspace operations that timed out in wait_for_result", ["request_type"])
+
+# SSE transport
+SSE_QUEUE_DEPTH = Gauge("chat_sse_queue_depth", "Operations waiting to be sent to the browser")
+RESULTS_QUEUE_DEPTH = Gauge("chat_results_queue_depth", "Results from the browser waiting to be matched")
+SSE_SUBSCRIBERS = Gauge("chat_sse_subscribers", "Connected /unified_stream subscribers")
+WS_CONNECTIONS = Gauge("chat_ws_connections", "Connected /ws workspace sockets")
+CHANNEL_DROPPED = Counter(
+    "chat_channel_dropped_total", "Operations/results dropped from a channel, by reason", ["channel", "reason"])
+
+# Testing tab
+EXECUTION_SECONDS = Histogram("test_execution_seconds", "Duration of execute_blockly_logic")
+EXECUTION_ERRORS = Counter("test_execution_errors_total", "execute_blockly_logic runs that raised an error")
+EXECUTIONS_CANCELLED = Counter("test_executions_cancelled_total", "Test runs stopped before they finished")
+TEST_CACHE_HITS = Counter("test_cache_hits_total", "Pure tool runs answered from the result cache")
+TEST_CACHE_MISSES = Counter("test_cache_misses_total", "Pure tool runs that executed and were cached")
+
+# Retries, hedging and circuit breakers for external services
+RETRIES = Counter("external_retries_total", "Retried calls to an external service", ["service"])
+RETRIES_EXHAUSTED = Counter(
+    "external_retries_exhausted_total", "Calls that failed after every retry", ["service"])
+HEDGED_CALLS = Counter("external_hedged_calls_total", "Calls that got a hedged duplicate request", ["service"])
+HEDGE_WINS = Counter("external_hedge_wins_total", "Hedged calls answered first by the duplicate", ["service"])
+CIRCUIT_OPEN = Gauge("external_circuit_open", "1 while the circuit breaker of a service is open", ["service"])
+
+# Deploys
+DEPLOY_PHASE_SECONDS = Histogram(
+    "deploy_phase_seconds", "Duration of each Hugging Face deploy phase", ["phase"])
+DEPLOY_FAILURES = Counter("deploy_failures_total", "Deploys that failed, by phase", ["phase"])
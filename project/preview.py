@@ -0,0 +1,191 @@
+"""
+Local preview of the generated MCP server.
+
+Deploying to a Hugging Face Space takes a minute or two per change. The preview
+runs the current generated app (the code ending in demo.launch(mcp_server=True))
+in a subprocess on a free local port instead, and restarts it shortly after the
+code changes, so the assistant can call the tool as a real MCP server within
+seconds of editing it.
+
+The preview lives in the process that receives /update_code (test.py); chat.py
+starts it and reads its MCP endpoint over HTTP, like it fetches the code for
+deployment.
+"""
+
+import atexit
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+PREVIEW_HOST = "127.0.0.1"
+# Fixed port for the preview (0 picks a free one, then keeps it across reloads when possible)
+PREVIEW_PORT = int(os.getenv("MCP_PREVIEW_PORT", "0"))
+PREVIEW_STARTUP_TIMEOUT = float(os.getenv("MCP_PREVIEW_STARTUP_TIMEOUT", "60"))
+# Wait this long after the last code change before restarting, since every edit sends new code
+PREVIEW_RELOAD_DELAY = float(os.getenv("MCP_PREVIEW_RELOAD_DELAY", "1.5"))
+# Public base URL forwarding to the preview port (e.g. a tunnel), for hosted MCP tools that cannot reach localhost
+PREVIEW_PUBLIC_URL = os.getenv("MCP_PREVIEW_PUBLIC_URL", "").rstrip("/")
+
+MCP_PATH = "/gradio_api/mcp/"
+LOG_TAIL_CHARS = 2000
+
+
+def free_port(port=0):
+    """Bind-test port (0 for any) and return it, or None if it is taken."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        # Like the server will, so a port still in TIME_WAIT from open client connections counts as free
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((PREVIEW_HOST, port))
+        except OSError:
+            return None
+        return sock.getsockname()[1]
+
+
+class PreviewServer:
+    def __init__(self):
+        self.process = None
+        self.port = None
+        self._last_port = None
+        self.code = ""
+        self.code_version = None  # Version the running process was started with
+        self.status = "stopped"  # stopped, starting, running, failed
+        self.error = None
+        self.workdir = tempfile.mkdtemp(prefix="mcp-blockly-preview-")
+        self._lock = threading.RLock()  # Held for a whole (re)start
+        self._timer_lock = threading.Lock()  # Only guards the reload timer, so code updates never wait on a start
+        self._reload_timer = None
+
+    @property
+    def url(self):
+        return f"http://{PREVIEW_HOST}:{self.port}" if self.port else None
+
+    @property
+    def mcp_url(self):
+        return self.url + MCP_PATH if self.port else None
+
+    @property
+    def public_mcp_url(self):
+        return PREVIEW_PUBLIC_URL + MCP_PATH if PREVIEW_PUBLIC_URL and self.port else None
+
+    @property
+    def log_path(self):
+        return os.path.join(self.workdir, "preview.log")
+
+    def info(self):
+        return {
+            "status": self.status,
+            "url": self.url,
+            "mcp_url": self.mcp_url,
+            "public_mcp_url": self.public_mcp_url,
+            "code_version": self.code_version,
+            "error": self.error,
+        }
+
+    def start(self, code, version):
+        """(Re)start the preview with code and wait until it serves requests. Returns info()."""
+        with self._lock:
+            self._cancel_reload()
+            self._stop_locked()
+            if "demo.launch" not in code:
+                self.status, self.error = "failed", "No generated app to preview. Build the MCP block first."
+                return self.info()
+
+            self.code, self.code_version = code, version
+            # Reuse the previous port so the MCP endpoint (and any tunnel to it) survives reloads
+            self.port = (PREVIEW_PORT and free_port(PREVIEW_PORT)) or (self._last_port and free_port(self._last_port)) or free_port()
+            self._last_port = self.port
+            app_path = os.path.join(self.workdir, "app.py")
+            with open(app_path, "w", encoding="utf-8") as f:
+                f.write(code)
+
+            # Gradio's launch() picks these up, so the generated code runs unmodified
+            env = dict(os.environ, GRADIO_SERVER_NAME=PREVIEW_HOST, GRADIO_SERVER_PORT=str(self.port),
+                       GRADIO_ANALYTICS_ENABLED="False")
+            log = open(self.log_path, "w", encoding="utf-8")
+            self.process = subprocess.Popen(
+                [sys.executable, app_path], cwd=self.workdir, env=env,
+                stdout=log, stderr=subprocess.STDOUT,
+            )
+            log.close()
+            self.status, self.error = "starting", None
+            print(f"[PREVIEW] Starting preview server on port {self.port} (pid {self.process.pid})")
+
+            started = time.monotonic()
+            while time.monotonic() - started < PREVIEW_STARTUP_TIMEOUT:
+                if self.process.poll() is not None:
+                    self.status = "failed"
+                    self.error = f"Preview exited with code {self.process.returncode}:\n{self._log_tail()}"
+                    print(f"[PREVIEW ERROR] {self.error}")
+                    return self.info()
+                try:
+                    if requests.get(self.url, timeout=1).ok:
+                        self.status = "running"
+                        print(f"[PREVIEW] Preview running at {self.url} ({time.monotonic() - started:.1f}s)")
+                        return self.info()
+                except requests.RequestException:
+                    pass
+                time.sleep(0.2)
+
+            self._stop_locked()
+            self.status, self.error = "failed", f"Preview did not start within {PREVIEW_STARTUP_TIMEOUT:.0f}s:\n{self._log_tail()}"
+            print(f"[PREVIEW ERROR] {self.error}")
+            return self.info()
+
+    def code_changed(self, code, version):
+        """Hot reload: restart a started preview shortly after the code stops changing."""
+        if self.status == "stopped" or version == self.code_version:
+            return
+        with self._timer_lock:
+            if self._reload_timer is not None:
+                self._reload_timer.cancel()
+            self._reload_timer = threading.Timer(PREVIEW_RELOAD_DELAY, self._reload, args=(code, version))
+            self._reload_timer.daemon = True
+            self._reload_timer.start()
+
+    def _reload(self, code, version):
+        print("[PREVIEW] Code changed, reloading preview")
+        self.start(code, version)
+
+    def stop(self):
+        with self._lock:
+            self._cancel_reload()
+            self._stop_locked()
+            self.status, self.error = "stopped", None
+            return self.info()
+
+    def _cancel_reload(self):
+        with self._timer_lock:
+            if self._reload_timer is not None:
+                self._reload_timer.cancel()
+                self._reload_timer = None
+
+    def _stop_locked(self):
+        process, self.process = self.process, None
+        self.port = None
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        print(f"[PREVIEW] Stopped preview server (pid {process.pid})")
+
+    def _log_tail(self):
+        try:
+            with open(self.log_path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read()[-LOG_TAIL_CHARS:]
+        except OSError:
+            return ""
+
+
+preview_server = PreviewServer()
+atexit.register(preview_server.stop)
@@ -0,0 +1,102 @@
+"""
+Static purity analysis of the generated tool code.
+
+A tool is pure when its result depends only on its inputs: no model or API
+calls, no randomness, no clock, no file/network/process IO and no global state.
+Pure tools can have their test results memoized. The analysis is conservative:
+anything it does not recognize as safe makes the tool impure.
+"""
+
+import ast
+from collections import namedtuple
+
+Purity = namedtuple("Purity", ["pure", "reasons"])
+
+# Helpers from the generated code that leave the process
+IMPURE_CALLS = {
+    "llm_call": "calls a model (llm_call)",
+    "call_api": "calls an external API (call_api)",
+    "open": "reads or writes files",
+    "input": "reads from stdin",
+    "exec": "executes dynamic code",
+    "eval": "evaluates dynamic code",
+    "compile": "compiles dynamic code",
+    "__import__": "imports modules dynamically",
+    "globals": "reads global state",
+    "breakpoint": "starts the debugger",
+}
+
+# Modules whose functions are deterministic
+PURE_MODULES = frozenset({
+    "ast", "math", "cmath", "re", "json", "string", "itertools", "functools", "collections",
+    "statistics", "decimal", "fractions", "operator", "typing", "copy", "textwrap", "unicodedata",
+    "sympy", "pandas",
+})
+
+# Why a known module is impure; math_random_int and friends generate `import random`
+IMPURE_MODULES = {
+    "random": "uses randomness (math_random_int, random blocks)",
+    "secrets": "uses randomness",
+    "uuid": "uses randomness",
+    "time": "reads the clock",
+    "datetime": "reads the clock",
+    "os": "uses the operating system",
+    "sys": "uses interpreter state",
+    "subprocess": "runs processes",
+    "socket": "uses the network",
+    "requests": "uses the network",
+    "urllib": "uses the network",
+    "http": "uses the network",
+    "httpx": "uses the network",
+    "openai": "calls a model",
+    "pathlib": "reads or writes files",
+    "shutil": "reads or writes files",
+    "io": "reads or writes files",
+}
+
+# Lines test.py strips before executing the code
+_SKIPPED_IMPORTS = frozenset({"gradio"})
+
+
+def _module_reason(module):
+    root = module.split(".")[0]
+    if root in _SKIPPED_IMPORTS or root in PURE_MODULES:
+        return None
+    return IMPURE_MODULES.get(root, f"imports {root}")
+
+
+def analyze(code):
+    """
+    Decide whether generated tool code is pure.
+
+    Args:
+        code: The Python code from the workspace
+
+    Returns:
+        Purity(pure, reasons), where reasons lists why the code is impure
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return Purity(False, [f"could not be analyzed ({e.msg})"])
+
+    reasons = []
+
+    def add(reason):
+        if reason and reason not in reasons:
+            reasons.append(reason)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                add(_module_reason(alias.name))
+        elif isinstance(node, ast.ImportFrom):
+            add(_module_reason(node.module or "") if node.level == 0 else "uses relative imports")
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            add("modifies shared state (global/nonlocal)")
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            add(IMPURE_CALLS.get(node.func.id))
+        elif isinstance(node, ast.Name) and node.id in IMPURE_MODULES and isinstance(node.ctx, ast.Load):
+            # Modules reachable without an import, like the `os` test.py pre-imports
+            add(IMPURE_MODULES[node.id])
+    return Purity(not reasons, reasons)
@@ -0,0 +1,433 @@
+"""
+Record/replay harness for benchmarking the chat agent loop offline.
+
+Recording: set CHAT_RECORD_FILE=/path/session.jsonl before starting the server.
+Every chat turn, Responses API call (request and response) and workspace
+operation/result pair that goes through /unified_stream and /request_result is
+appended to that file as JSON lines.
+
+Replay: run
+
+    python replay.py session.jsonl --repeat 10
+
+The recorded turns are fed back through the real chat handler with a local fake
+model client (returning the recorded responses) and a fake frontend that
+subscribes to the real SSE stream and posts the recorded results back through
+the real /request_result handler. Validation, queues, SSE and result matching
+all run exactly as in production, with no network and no browser. A latency
+report is printed at the end.
+
+Routing check: run
+
+    python replay.py --check-routing
+
+to send scripted turns through the same handler and fake client and check which
+model tier the router picked for every model call (see ROUTING_CASES).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+
+RECORD_FILE = os.getenv("CHAT_RECORD_FILE", "")
+# Operations whose result has not arrived after this long are dropped, like results in chat's channels
+PENDING_TTL = float(os.getenv("RESULTS_QUEUE_TTL", "30"))
+
+
+class Recorder:
+    """Appends session events to a JSON lines file."""
+
+    def __init__(self, path, pending_ttl=PENDING_TTL):
+        self.path = path
+        self.pending_ttl = pending_ttl
+        self._lock = threading.Lock()
+        # request key -> (operation, expires at), oldest first, until its result arrives or it expires
+        self._pending = OrderedDict()
+        print(f"[REPLAY] Recording chat sessions to {path}")
+
+    @classmethod
+    def from_env(cls):
+        return cls(RECORD_FILE) if RECORD_FILE else None
+
+    def _write(self, event):
+        event["time"] = time.time()
+        line = json.dumps(event, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def turn(self, message, history):
+        self._write({"kind": "turn", "message": message, "history": history})
+
+    def model_call(self, request, response, elapsed):
+        try:
+            response_data = response.model_dump(mode="json")
+        except AttributeError:
+            response_data = response
+        # Tools and instructions are large and reproduced by the code itself; keep only what replay checks
+        request_data = {"model": request.get("model"), "input": request.get("input")}
+        self._write({"kind": "model_call", "request": request_data, "response": response_data, "elapsed": elapsed})
+
+    def operation(self, request):
+        # chat imports this module, so its operation_key is looked up when the first operation is recorded
+        from chat import operation_key
+
+        now = time.monotonic()
+        with self._lock:
+            # Timed out, expired and dead-lettered operations never get a result
+            while self._pending and next(iter(self._pending.values()))[1] <= now:
+                self._pending.popitem(last=False)
+            key = operation_key(request)
+            self._pending.pop(key, None)
+            self._pending[key] = (request, now + self.pending_ttl)
+
+    def result(self, data):
+        with self._lock:
+            request, _ = self._pending.pop(result_key(data), (None, None))
+        self._write({"kind": "operation", "request": request, "result": data})
+
+
+def result_key(data):
+    """Key a browser result the same way chat.operation_key keys its operation."""
+    if data.get("request_type") == "delete":
+        return f"delete_{data.get('block_id')}"
+    return f"{data.get('request_type')}_{data.get('request_id')}"
+
+
+def load_session(path):
+    """Group a recording into turns: [{"message", "history", "model_calls", "operations"}]."""
+    turns = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["kind"] == "turn":
+                turns.append({"message": event["message"], "history": event["history"],
+                              "model_calls": [], "operations": []})
+            elif turns and event["kind"] == "model_call":
+                turns[-1]["model_calls"].append(event)
+            elif turns and event["kind"] == "operation" and event.get("request"):
+                turns[-1]["operations"].append(event)
+    return turns
+
+
+def to_namespace(value):
+    """Recorded JSON -> attribute access objects, shaped like the OpenAI SDK models."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(v) for v in value]
+    return value
+
+
+class FakeModelClient:
+    """Stands in for the AsyncOpenAI client, returning the recorded responses in order."""
+
+    def __init__(self, model_calls, api_key="replay", latency="recorded"):
+        self.api_key = api_key
+        self.responses = self
+        self._calls = list(model_calls)
+        self._latency = latency
+        self.requested_models = []  # Model of each call, to see what the router picked
+
+    async def create(self, stream=False, **kwargs):
+        if not self._calls:
+            raise RuntimeError("Replay ran out of recorded model responses")
+        call = self._calls.pop(0)
+        self.requested_models.append(kwargs.get("model"))
+        delay = call.get("elapsed", 0) if self._latency == "recorded" else float(self._latency)
+        if delay:
+            await asyncio.sleep(delay)
+        response = to_namespace(call["response"])
+        if stream:
+            return _FakeStream([SimpleNamespace(type="response.completed", response=response)])
+        return response
+
+
+class _FakeStream:
+    """A finished response stream: async iterable events and a close() coroutine."""
+
+    def __init__(self, events):
+        self._events = events
+
+    async def __aiter__(self):
+        for event in self._events:
+            yield event
+
+    async def close(self):
+        pass
+
+
+class _JSONRequest:
+    """The part of starlette's Request that request_result uses."""
+
+    def __init__(self, data):
+        self._data = data
+
+    async def json(self):
+        return self._data
+
+
+class FakeFrontend:
+    """
+    Subscribes to the real /unified_stream generator and answers each operation with
+    the recorded result for the next unanswered operation of the same type.
+    """
+
+    def __init__(self, chat_module, latency=0.0):
+        self.chat = chat_module
+        self.latency = latency
+        self.recorded = []
+        self.answered = 0
+        self.unmatched = 0
+        self._loop = None
+        self._thread = None
+        self._stream = None
+        self._ready = threading.Event()
+
+    def load(self, operations):
+        self.recorded = list(operations)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._task = self._loop.create_task(self._consume())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Cancel the stream's delayed cleanup tasks so the loop closes quietly
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.close()
+
+    async def _consume(self):
+        response = await self.chat.unified_stream()
+        self._stream = response.body_iterator
+        self._ready.set()
+        try:
+            async for chunk in self._stream:
+                for line in chunk.splitlines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = json.loads(line[len("data: "):])
+                    if data.get("heartbeat"):
+                        continue
+                    await self._answer(data)
+        finally:
+            await self._stream.aclose()
+
+    async def _answer(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = None
+        for i, recorded in enumerate(self.recorded):
+            if recorded["request"].get("type") == request.get("type"):
+                result = dict(self.recorded.pop(i)["result"])
+                break
+        if result is None:
+            self.unmatched += 1
+            result = {"request_type": request.get("type"), "success": False,
+                      "error": "No recorded result for this operation"}
+        # Point the recorded result at this run's request
+        if request.get("type") == "delete":
+            result["block_id"] = request.get("block_id")
+        else:
+            result["request_id"] = request.get("request_id")
+        self.answered += 1
+        await self.chat.request_result(_JSONRequest(result))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def replay(path, repeat=1, model_latency="recorded", frontend_latency=0.0):
+    """Replay a recording through the real chat handler and return per-turn latencies."""
+    import chat
+
+    turns = load_session(path)
+    if not turns:
+        raise SystemExit(f"No turns recorded in {path}")
+
+    chat.stored_api_key = "replay"
+    handler = chat.create_gradio_interface().fn
+    frontend = FakeFrontend(chat, latency=frontend_latency)
+    frontend.start()
+
+    latencies = []
+    model_calls = 0
+    models = Counter()
+
+    async def run_turns():
+        nonlocal model_calls
+        for _ in range(repeat):
+            for turn in turns:
+                chat.client = FakeModelClient(turn["model_calls"], api_key="replay", latency=model_latency)
+                frontend.load(turn["operations"])
+                turn_start = time.perf_counter()
+                async for _ in handler(turn["message"], turn["history"]):
+                    pass
+                latencies.append(time.perf_counter() - turn_start)
+                model_calls += len(turn["model_calls"])
+                models.update(chat.client.requested_models)
+
+    started = time.perf_counter()
+    try:
+        asyncio.run(run_turns())
+    finally:
+        frontend.stop()
+    total = time.perf_counter() - started
+
+    return {
+        "turns": len(latencies),
+        "model_calls": model_calls,
+        "models": dict(models),
+        "operations": frontend.answered,
+        "unmatched_operations": frontend.unmatched,
+        "total_s": total,
+        "turns_per_s": len(latencies) / total if total else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "max_s": max(latencies),
+        "mean_s": statistics.mean(latencies),
+    }
+
+
+def _text_response(text):
+    return {"output": [{"type": "message", "content": [{"type": "output_text", "text": text}]}]}
+
+
+def _tool_response(name, arguments):
+    return {"output": [{"type": "function_call", "name": name, "arguments": json.dumps(arguments),
+                        "call_id": f"call_{name}"}]}
+
+
+# Scripted turns for --check-routing: message, model responses, browser results, the tier expected
+# for each model call, and latencies (seconds per tier on eligible calls) to seed the router with
+ROUTING_CASES = [
+    {
+        "name": "simple request and acknowledgement go to the fast tier",
+        "message": "delete the print block",
+        "responses": [_tool_response("delete_block", {"id": "print_block"}), _text_response("Deleted it.")],
+        "results": [{"request_type": "delete", "success": True}],
+        "expected": ["fast", "fast"],
+    },
+    {
+        "name": "building a tool and reacting to block commands use the strong tier",
+        "message": "make a tool that reverses the input text and returns it",
+        "responses": [_tool_response("create_block", {"command": 'text_reverse(inputs(TEXT: text(inputs(TEXT: "hi"))))'}),
+                      _text_response("Done.")],
+        "results": [{"request_type": "create", "success": True, "block_id": "reverse_block"}],
+        "expected": ["strong", "strong"],
+    },
+    {
+        "name": "a validation error escalates the rest of the turn",
+        "message": "remove the loop",
+        "responses": [_tool_response("create_block", {"command": "no_such_block(inputs())"}),
+                      _text_response("Sorry, fixed.")],
+        "results": [],
+        "expected": ["fast", "strong"],
+    },
+    {
+        "name": "the fast tier is skipped while it is slower on the same kind of call",
+        "message": "delete the print block",
+        "responses": [_tool_response("delete_block", {"id": "print_block"}), _text_response("Deleted it.")],
+        "results": [{"request_type": "delete", "success": True}],
+        "latency": {"fast": 2.0, "strong": 1.0},
+        "expected": ["strong", "strong"],
+    },
+]
+
+
+def check_routing():
+    """Run ROUTING_CASES through the real chat handler and return the cases whose tiers differ."""
+    import chat
+    from routing import ModelRouter
+
+    chat.stored_api_key = "replay"
+    handler = chat.create_gradio_interface().fn
+    frontend = FakeFrontend(chat)
+    frontend.start()
+    tiers = {"strong": "replay-strong", "fast": "replay-fast"}
+    names = {model: tier for tier, model in tiers.items()}
+    failures = []
+
+    async def run_cases():
+        for case in ROUTING_CASES:
+            # A fresh router per case, so earlier cases' latencies don't decide this one
+            chat.model_router = ModelRouter(policy="auto", strong=tiers["strong"], fast=tiers["fast"])
+            for tier, seconds in case.get("latency", {}).items():
+                chat.model_router.observe(tiers[tier], seconds, "simple_tool")
+            chat.client = FakeModelClient([{"response": response} for response in case["responses"]],
+                                          api_key="replay", latency=0)
+            frontend.load([{"request": {"type": result["request_type"]}, "result": result}
+                           for result in case["results"]])
+            async for _ in handler(case["message"], []):
+                pass
+            picked = [names.get(model, model) for model in chat.client.requested_models]
+            status = "ok" if picked == case["expected"] else "FAILED"
+            print(f"[ROUTING CHECK] {status}: {case['name']} (expected {case['expected']}, got {picked})")
+            if picked != case["expected"]:
+                failures.append(case["name"])
+
+    router = chat.model_router
+    try:
+        asyncio.run(run_cases())
+    finally:
+        chat.model_router = router
+        frontend.stop()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded chat session offline and report latency.")
+    parser.add_argument("recording", nargs="?", help="JSON lines file written with CHAT_RECORD_FILE")
+    parser.add_argument("--repeat", type=int, default=1, help="How many times to replay the whole session")
+    parser.add_argument("--model-latency", default="0",
+                        help="'recorded' to sleep for the recorded model latency, or a fixed number of seconds")
+    parser.add_argument("--frontend-latency", type=float, default=0.0,
+                        help="Seconds the fake frontend waits before answering each operation")
+    parser.add_argument("--check-routing", action="store_true",
+                        help="Check the model tier picked for scripted turns instead of replaying a recording")
+    args = parser.parse_args()
+
+    if args.check_routing:
+        failures = check_routing()
+        print(f"\n[ROUTING CHECK] {len(ROUTING_CASES) - len(failures)}/{len(ROUTING_CASES)} cases passed")
+        raise SystemExit(1 if failures else 0)
+    if not args.recording:
+        parser.error("a recording is required unless --check-routing is given")
+
+    report = replay(args.recording, args.repeat, args.model_latency, args.frontend_latency)
+    print("\n[REPLAY REPORT]")
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Retries, backoff, hedging and circuit breaking for calls to external services.
+
+Model calls (OpenAI) and Hugging Face Hub calls go through call(). A failed
+attempt is retried only if the error is transient: a connection error or
+timeout, a 408/425/429/5xx status, or a model stream that failed with a server
+or rate-limit error. Retries wait with jittered exponential backoff, or for as
+long as the provider's Retry-After / Retry-After-Ms header asks.
+
+Each service has a circuit breaker: after a run of failed calls it opens and
+calls fail immediately with CircuitOpenError for a cool-down period, instead of
+every turn waiting through its retries; one trial call then decides whether it
+closes again.
+
+With hedging enabled, an attempt that is still running after the service's
+recent p95 latency gets a duplicate, and whichever finishes first wins. This
+trims tail latency at the cost of occasional duplicate work, so it is opt-in.
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+# Latency samples kept per service for the hedging threshold, and how many are needed before hedging
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# Error codes of failed Responses API streams that are worth another attempt
+RETRYABLE_STREAM_CODES = {"server_error", "rate_limit_exceeded", "internal_error", "overloaded"}
+_RETRYABLE_NAMES = {
+    "APIConnectionError", "APITimeoutError", "ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeout",
+    "ChunkedEncodingError", "ConnectError", "ReadError", "RemoteProtocolError", "TimeoutException",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, service, retry_in):
+        super().__init__(f"{service} is failing repeatedly; not calling it for another {retry_in:.0f}s")
+        self.service = service
+        self.retry_in = retry_in
+
+
+class StreamError(RuntimeError):
+    """A model stream that ended with a failure event; code is the provider's error code, if any."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def status_of(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error):
+    """True for errors that another attempt of the same call can fix."""
+    if isinstance(error, StreamError):
+        return error.code in RETRYABLE_STREAM_CODES
+    status = status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)) or any(
+        cls.__name__ in _RETRYABLE_NAMES for cls in type(error).__mro__)
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, from Retry-After-Ms / Retry-After, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            when = email.utils.parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, error=None):
+    """Delay before retry number attempt (1-based): full-jitter exponential, or what the provider asked."""
+    requested = retry_after(error) if error is not None else None
+    if requested is not None:
+        return min(requested, RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """closed -> open after consecutive failures -> half open after reset_timeout -> closed on success."""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False  # A half-open trial call is in flight
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if calls should not go through right now."""
+        with self._lock:
+            if self.state == "open":
+                waited = time.monotonic() - self.opened_at
+                if waited < self.reset_timeout:
+                    raise CircuitOpenError(self.name, self.reset_timeout - waited)
+                self.state = "half_open"
+                self._trial = False
+            if self.state == "half_open":
+                if self._trial:
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"[RESILIENCE] Circuit for {self.name} closed")
+            self.state, self.failures, self._trial = "closed", 0, False
+        metrics.CIRCUIT_OPEN.set(0, service=self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"[RESILIENCE] Circuit for {self.name} opened after {self.failures} failures")
+                self.state, self.opened_at = "open", time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            metrics.CIRCUIT_OPEN.set(1, service=self.name)
+
+
+class Service:
+    """Retry policy, circuit breaker and latency history of one external service."""
+
+    def __init__(self, name, attempts=RETRY_ATTEMPTS, hedge=False):
+        self.name = name
+        self.attempts = attempts
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(name)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def p95(self):
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    async def call(self, make_call, hedge=None):
+        """
+        Run make_call() (a function returning a new awaitable per attempt) with retries.
+
+        Args:
+            make_call: Called once per attempt, and once more for a hedged duplicate
+            hedge: Override the service's hedging setting for this call
+
+        Returns:
+            The result of the first successful attempt. Raises the last error when
+            attempts run out or the error is not transient, and CircuitOpenError while
+            the circuit is open.
+        """
+        hedge = self.hedge if hedge is None else hedge
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            started = time.monotonic()
+            try:
+                result = await (self._hedged(make_call) if hedge else make_call())
+            except Exception as e:
+                if not is_retryable(e):
+                    # The service answered; the request itself was wrong
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.attempts:
+                    metrics.RETRIES_EXHAUSTED.inc(service=self.name)
+                    raise
+                delay = backoff(attempt, e)
+                metrics.RETRIES.inc(service=self.name)
+                print(f"[RESILIENCE] {self.name} attempt {attempt} failed ({type(e).__name__}: {e}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self._observe(time.monotonic() - started)
+            self.breaker.record_success()
+            return result
+
+    async def _hedged(self, make_call):
+        threshold = self.p95()
+        first = asyncio.ensure_future(make_call())
+        pending = {first}
+        # Cancel whatever is still running when a call wins, fails, or the caller is cancelled
+        try:
+            if threshold is None:
+                return await first
+            done, pending = await asyncio.wait(pending, timeout=threshold)
+            if done:
+                return first.result()
+
+            metrics.HEDGED_CALLS.inc(service=self.name)
+            second = asyncio.ensure_future(make_call())
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Both can finish in the same batch; a success wins over a failure either way
+                failures = [task for task in done if task.exception() is not None]
+                for task in done:
+                    if task not in failures:
+                        if task is second:
+                            metrics.HEDGE_WINS.inc(service=self.name)
+                        return task.result()
+                failed = failures[-1]
+            # Every attempt failed; report the last one
+            raise failed.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def call_sync(service, fn, *args, **kwargs):
+    """service.call() for a blocking function, run in a worker thread per attempt."""
+    return service.call(lambda: asyncio.to_thread(fn, *args, **kwargs))
+
+
+openai_service = Service("openai", hedge=os.getenv("HEDGE_MODEL_CALLS", "0") == "1")
+hub_service = Service("huggingface_hub")
@@ -0,0 +1,255 @@
+"""
+Exact-match cache of chat turns, replayed without calling the model.
+
+Demo users and students send the same requests ("make a tool that reverses
+text") against the same starting workspace again and again. When
+CHAT_RESPONSE_CACHE=1, a turn that finished cleanly is stored as its plan: the
+model output of every iteration (text and tool calls) and the tool result each
+call produced. A later turn with the same key replays that plan through the
+normal validation and execution path, so the turn costs only the browser round
+trips.
+
+The key is the normalized message, the workspace and variables with their ids
+replaced by their order of appearance, the history, and the model routing
+setup. Ids differ between browser sessions, so replay maps the recorded ids to
+the current ones: positionally for the starting workspace, and from the tool
+results for blocks created during the turn ("created block: b3" recorded,
+"created block: b9" now). If a tool result differs in any other way the plan no
+longer applies; the turn continues with the live model from that point, and the
+plan is evicted so the next identical request records a fresh one.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import metrics
+from workspace import parse_blocks, parse_variables
+
+RESPONSE_CACHE_ENABLED = os.getenv("CHAT_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("CHAT_RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("CHAT_RESPONSE_CACHE_TTL", "86400"))
+
+# Tools with effects outside the workspace, or results that depend on more than it; turns using them are not cached
+UNCACHEABLE_TOOLS = {"deploy_to_huggingface", "preview_mcp_server"}
+# Most tokens a tool result may differ in from the recorded one and still count as the same result
+MAX_CHANGED_TOKENS = 3
+
+_FAILURE_PREFIXES = ("[ERROR]", "[TOOL] Failed", "[MCP ERROR]", "[DEPLOY ERROR]", "[PREVIEW ERROR]", "Timeout")
+_EDGE_PUNCTUATION = "`'\".,:;()"
+# What a block or variable id can look like in a tool result: a short alias (see aliases.py) or a Blockly uid
+_ID_RE = re.compile(r"[bv]\d+$|(?=.*[A-Za-z])[!#$%()*+,\-./:;=?@\[\]^_`{|}~A-Za-z0-9]{20}$")
+
+
+def normalize_message(message):
+    return " ".join((message or "").lower().split()).rstrip(".!?")
+
+
+def workspace_ids(code, var_string):
+    """Block and variable ids in order of appearance (variables first, as they are listed)."""
+    ids = list(parse_variables(var_string or ""))
+    ids.extend(block_id for block_id, _, _ in parse_blocks(code or "") if block_id not in ids)
+    return ids
+
+
+def canonical(text, ids):
+    """text with every id replaced by its position, so equal workspaces compare equal across sessions."""
+    if not text or not ids:
+        return text or ""
+    positions = {block_id: f"#{index}" for index, block_id in enumerate(ids)}
+    return _id_pattern(ids).sub(lambda m: positions[m.group(0)], text)
+
+
+def cache_key(message, code, var_string, history_text, model_setup):
+    ids = workspace_ids(code, var_string)
+    digest = hashlib.sha256()
+    for part in (normalize_message(message), canonical(code, ids), canonical(var_string, ids),
+                 canonical(history_text, ids), model_setup):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest(), ids
+
+
+def _id_pattern(ids):
+    escaped = "|".join(map(re.escape, sorted(ids, key=len, reverse=True)))
+    return re.compile(r"(?<![A-Za-z0-9_])(?:" + escaped + r")(?![A-Za-z0-9_])")
+
+
+def is_failure(result):
+    return str(result).startswith(_FAILURE_PREFIXES)
+
+
+class PlanStep:
+    """One iteration: the model's output items and the result of each of its tool calls."""
+
+    __slots__ = ("text", "tool_calls", "tool_results")
+
+    def __init__(self, text, tool_calls):
+        self.text = text
+        self.tool_calls = tool_calls  # [(name, arguments JSON, call id)]
+        self.tool_results = []
+
+
+class CachedPlan:
+    __slots__ = ("steps", "ids", "created_at", "expires_at", "hits")
+
+    def __init__(self, steps, ids, ttl=RESPONSE_CACHE_TTL):
+        self.steps = steps
+        self.ids = ids  # Workspace ids of the recorded turn, in order of appearance
+        self.created_at = time.monotonic()
+        self.expires_at = self.created_at + ttl
+        self.hits = 0
+
+
+class PlanRecorder:
+    """Collects the plan of a live turn, to be stored if the turn finishes cleanly."""
+
+    def __init__(self, key, ids):
+        self.key = key
+        self.ids = ids
+        self.steps = []
+        self.cacheable = True
+
+    def model_response(self, response):
+        text = ""
+        tool_calls = []
+        for item in response.output:
+            if item.type == "message":
+                for content in item.content:
+                    if content.type == "output_text":
+                        text = content.text
+            elif item.type == "function_call":
+                tool_calls.append((item.name, item.arguments, item.call_id))
+            else:
+                # Hosted tool calls and other items can't be replayed
+                self.cacheable = False
+        self.steps.append(PlanStep(text, tool_calls))
+
+    def tool_result(self, name, result):
+        if name in UNCACHEABLE_TOOLS or name.startswith(("user_tool_", "preview_tool_")) or is_failure(result):
+            self.cacheable = False
+        if self.steps:
+            self.steps[-1].tool_results.append(str(result))
+
+    def plan(self):
+        return CachedPlan(self.steps, self.ids) if self.cacheable and self.steps else None
+
+
+class PlanReplay:
+    """Serves a cached plan as model responses, following the ids of the current workspace."""
+
+    def __init__(self, plan, ids, key=None):
+        self.plan = plan
+        self.key = key
+        self.step = 0
+        self.diverged = False
+        # Recorded id -> current id, starting with the workspace the turn started from
+        self.id_map = {old: new for old, new in zip(plan.ids, ids) if old != new}
+
+    @property
+    def active(self):
+        return not self.diverged and self.step < len(self.plan.steps)
+
+    def next_response(self):
+        """The next iteration's output, shaped like a Responses API result."""
+        step = self.plan.steps[self.step]
+        self.step += 1
+        output = []
+        if step.text:
+            output.append(SimpleNamespace(type="message", content=[SimpleNamespace(type="output_text", text=self._map(step.text))]))
+        for name, arguments, call_id in step.tool_calls:
+            output.append(SimpleNamespace(type="function_call", name=name, arguments=self._map(arguments), call_id=call_id))
+        return SimpleNamespace(output=output, usage=None)
+
+    def tool_result(self, index, result):
+        """Compare a tool result with the recorded one, learning new ids. Returns False once the plan diverged."""
+        if self.diverged:
+            return False
+        recorded = self.plan.steps[self.step - 1].tool_results
+        if index >= len(recorded) or not self._same_result(recorded[index], str(result)):
+            self.diverged = True
+            metrics.RESPONSE_CACHE_DIVERGED.inc()
+            print(f"[RESPONSE CACHE] Tool result differs from the cached plan; continuing with the model")
+        return not self.diverged
+
+    def _same_result(self, recorded, actual):
+        if is_failure(actual):
+            return False
+        recorded_tokens = self._map(recorded).split()
+        actual_tokens = actual.split()
+        if len(recorded_tokens) != len(actual_tokens):
+            return False
+        changed = {}
+        for old, new in zip(recorded_tokens, actual_tokens):
+            if old != new:
+                changed[old.strip(_EDGE_PUNCTUATION)] = new.strip(_EDGE_PUNCTUATION)
+        if len(changed) > MAX_CHANGED_TOKENS:
+            return False
+        # Reverse the mapping already applied to the recorded text, so the map stays recorded id -> current id
+        reverse = {new: old for old, new in self.id_map.items()}
+        learned = {}
+        for old, new in changed.items():
+            recorded_id = reverse.get(old, old)
+            # Only ids may differ ("created block: b3" vs "b9"); any other change ("3 blocks" vs "4") is a divergence
+            if not _ID_RE.match(new) or not (recorded_id in self.plan.ids or recorded_id in self.id_map
+                                             or _ID_RE.match(recorded_id)):
+                return False
+            learned[recorded_id] = new
+        self.id_map.update(learned)
+        return True
+
+    def _map(self, text):
+        if not self.id_map or not text:
+            return text
+        return _id_pattern(self.id_map).sub(lambda m: self.id_map[m.group(0)], text)
+
+
+class ResponseCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, enabled=RESPONSE_CACHE_ENABLED):
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self._plans = OrderedDict()  # key -> CachedPlan, least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None and plan.expires_at <= now:
+                del self._plans[key]
+                plan = None
+            if plan is None:
+                metrics.RESPONSE_CACHE_MISSES.inc()
+                return None
+            self._plans.move_to_end(key)
+            plan.hits += 1
+        metrics.RESPONSE_CACHE_HITS.inc()
+        return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        metrics.RESPONSE_CACHE_STORES.inc()
+
+    def evict(self, key, plan=None):
+        """Drop key, or only if it still holds plan, so a plan stored since is kept."""
+        with self._lock:
+            if key in self._plans and (plan is None or self._plans[key] is plan):
+                del self._plans[key]
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def __len__(self):
+        return len(self._plans)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,179 @@
+"""
+Relevance-ranked retrieval of block documentation for the system prompt.
+
+Instead of pasting all of blocks.txt into every model call, the block families
+(the `# Category` sections of blocks.txt) are indexed with BM25 together with the
+example projects in examples.txt. For each chat turn only the families relevant to
+the user's message and to the blocks already in the workspace are included, plus a
+guaranteed core set, within a token budget.
+
+Everything runs locally; there are no network calls.
+"""
+
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+from catalog import INPUT_REFERENCE_PREFIX
+from tokens import estimate_tokens
+
+# Block families that are always included
+CORE_CATEGORIES = ("MCP Block inputs", "Variables")
+
+# Token budget for the block documentation section (0 disables retrieval and sends all of blocks.txt)
+DEFAULT_TOKEN_BUDGET = int(os.getenv("BLOCK_DOCS_TOKEN_BUDGET", "700"))
+
+Selection = namedtuple("Selection", ["text", "categories", "omitted", "tokens"])
+Document = namedtuple("Document", ["name", "terms", "categories"])
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a an and are as at be by can do for from get how i in into is it make me my of on or please so that the
+them then this to tool use want we what when with you your value inputs
+""".split())
+_WORKSPACE_BLOCK_RE = re.compile(r"(\w+)\(inputs\(")
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+
+def _stem(word):
+    for suffix in ("ing", "ed", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix) and not word.endswith("ss"):
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Lowercase words, with snake_case names also kept whole (text_join -> text, join, text_join)."""
+    text = text.lower()
+    terms = [_stem(word) for word in _WORD_RE.findall(text) if word not in _STOPWORDS]
+    terms.extend(name for name in re.findall(r"[a-z]+(?:_[a-z0-9]+)+", text))
+    return terms
+
+
+class BlockDocsIndex:
+    def __init__(self, catalog, examples_text="", core_categories=CORE_CATEGORIES):
+        self.catalog = catalog
+        self.core_categories = tuple(c for c in core_categories if c in catalog.categories)
+
+        # Rendered text and token cost of each block family
+        self.sections = {}
+        self.section_tokens = {}
+        documents = []
+        for category, specs in catalog.categories.items():
+            body = "\n".join(spec.line for spec in specs)
+            self.sections[category] = f"# {category}\n{body}"
+            self.section_tokens[category] = estimate_tokens(self.sections[category])
+            documents.append(Document(category, tokenize(category + "\n" + body), (category,)))
+
+        # Example projects point at the block families they use
+        for name, text in _split_sections(examples_text):
+            used = re.search(r"^Blocks:\s*(.+)$", text, re.MULTILINE)
+            categories = []
+            if used:
+                for block_name in (b.strip() for b in used.group(1).split(",")):
+                    category = self.category_of(block_name)
+                    if category and category not in categories:
+                        categories.append(category)
+            description = text[:used.start()] if used else text
+            documents.append(Document(f"Example: {name}", tokenize(name + "\n" + description), tuple(categories)))
+
+        self.documents = documents
+        self.term_counts = [Counter(doc.terms) for doc in documents]
+        self.avg_length = sum(len(doc.terms) for doc in documents) / max(len(documents), 1)
+        doc_freq = Counter()
+        for counts in self.term_counts:
+            doc_freq.update(counts.keys())
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def category_of(self, block_name):
+        spec = self.catalog.blocks.get(block_name)
+        if spec:
+            return spec.category
+        if block_name.startswith(INPUT_REFERENCE_PREFIX):
+            spec = self.catalog.blocks.get(INPUT_REFERENCE_PREFIX + "NAME")
+            return spec.category if spec else None
+        return None
+
+    def score(self, query):
+        """BM25 score of every block family for the query, with example matches credited to their families."""
+        terms = tokenize(query)
+        scores = Counter()
+        for doc, counts in zip(self.documents, self.term_counts):
+            length_norm = K1 * (1 - B + B * len(doc.terms) / self.avg_length)
+            doc_score = 0.0
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    doc_score += self.idf[term] * tf * (K1 + 1) / (tf + length_norm)
+            if doc_score:
+                for category in doc.categories:
+                    scores[category] += doc_score
+        return scores
+
+    def select(self, message, workspace="", budget=DEFAULT_TOKEN_BUDGET):
+        """
+        Choose the block documentation to send for this turn.
+
+        Args:
+            message: The user's message
+            workspace: The workspace DSL, used to always include families of blocks already placed
+            budget: Token budget for the documentation. Core and in-workspace families are always
+                included; other families are added by relevance while they fit. <= 0 sends everything.
+
+        Returns:
+            Selection(text, categories, omitted, tokens)
+        """
+        all_categories = list(self.sections)
+        if budget <= 0:
+            text = "\n\n".join(self.sections[c] for c in all_categories)
+            return Selection(text, all_categories, [], sum(self.section_tokens.values()))
+
+        required = list(self.core_categories)
+        for block_name in _WORKSPACE_BLOCK_RE.findall(workspace or ""):
+            category = self.category_of(block_name)
+            if category and category not in required:
+                required.append(category)
+
+        chosen = set(required)
+        # Reserve room for the list of left-out blocks; it only gets shorter as families are added
+        used_tokens = sum(self.section_tokens[c] for c in chosen) + estimate_tokens(
+            self._other_blocks_note([c for c in all_categories if c not in chosen]))
+        for category, score in self.score(message).most_common():
+            if category in chosen or score <= 0:
+                continue
+            cost = self.section_tokens[category]
+            if used_tokens + cost <= budget:
+                chosen.add(category)
+                used_tokens += cost
+
+        categories = [c for c in all_categories if c in chosen]
+        omitted = [c for c in all_categories if c not in chosen]
+        text = "\n\n".join(self.sections[c] for c in categories) + self._other_blocks_note(omitted)
+        return Selection(text, categories, omitted, estimate_tokens(text))
+
+    def _other_blocks_note(self, omitted):
+        """Names of the blocks in the omitted families, so the model still knows they exist."""
+        if not omitted:
+            return ""
+        names = ", ".join(spec.name for c in omitted for spec in self.catalog.categories[c])
+        return (
+            "\n\n# Other blocks\n"
+            f"These blocks also exist but their details were left out because they do not look relevant: {names}"
+        )
+
+
+def _split_sections(text):
+    """Split `# Name` headed sections into (name, body) pairs."""
+    sections = []
+    for chunk in re.split(r"^#\s*", text or "", flags=re.MULTILINE):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        name, _, body = chunk.partition("\n")
+        sections.append((name.strip(), body.strip()))
+    return sections
@@ -0,0 +1,153 @@
+"""
+Per-iteration model routing for the chat agent loop.
+
+Most iterations of a turn do not need the strong model: the acknowledgement after
+a delete, a variable or a workspace search, or a short request like "delete the
+print block". ModelRouter sends those to a fast model and keeps the strong one
+for planning and writing block commands.
+
+Policy (CHAT_MODEL_ROUTING):
+    auto    route by complexity as below (default)
+    strong  always the strong model, like before routing existed
+    fast    always the fast model
+
+In auto mode an iteration uses the fast model when it only has to react to a
+simple tool result, or when it is the first iteration of a short message that
+matches a simple intent. A validation error from a block command escalates the
+rest of the turn to the strong model, and the fast tier is skipped while its
+observed latency is not actually lower than the strong model's.
+
+The latencies compared come only from iterations eligible for the fast tier,
+since the strong model's other calls plan and write long commands and would
+always look slower. Whichever tier is not preferred still gets every
+FAST_PROBE_EVERY-th eligible call, so both stay measured on the same work.
+"""
+
+import os
+import re
+import threading
+
+import metrics
+
+STRONG_MODEL = os.getenv("CHAT_STRONG_MODEL", "gpt-4o")
+FAST_MODEL = os.getenv("CHAT_FAST_MODEL", "gpt-4o-mini")
+ROUTING_POLICY = os.getenv("CHAT_MODEL_ROUTING", "auto")
+
+# First-iteration messages up to this long can go to the fast model if they match a simple intent
+FAST_MESSAGE_CHARS = int(os.getenv("CHAT_FAST_MESSAGE_CHARS", "80"))
+# Weight of the newest sample in the per-model latency average
+LATENCY_ALPHA = 0.2
+# Skip the fast tier while its average latency is above this fraction of the strong model's
+FAST_LATENCY_RATIO = float(os.getenv("CHAT_FAST_LATENCY_RATIO", "0.9"))
+# Send every Nth eligible call to the tier that is not preferred, to keep measuring it
+FAST_PROBE_EVERY = 20
+
+# Tools whose results only need acknowledging; the model rarely has to plan after them
+SIMPLE_TOOLS = {
+    "delete_block", "create_variable", "find_blocks", "preview_mcp_server", "deploy_to_huggingface",
+}
+
+# Result labels of tool calls the model got wrong, which need the strong model to fix
+VALIDATION_FAILURES = {
+    "Command Format Error", "Invalid Block Error", "Invalid Placement Error", "Output Block Warning",
+}
+
+# Route reasons of iterations eligible for the fast tier, whichever tier served them
+ELIGIBLE_ROUTES = {"simple_message", "simple_tool", "fast_slower", "latency_probe"}
+
+_SIMPLE_MESSAGE_RE = re.compile(
+    r"^\s*(delete|remove|undo|rename|deploy|preview|run|test|find|where|which|what|show|list|"
+    r"thanks|thank you|ok|okay|yes|no|sure|great|stop)\b",
+    re.IGNORECASE,
+)
+
+
+class TurnRouting:
+    """Routing state of one chat turn: the last tool results and whether the turn escalated."""
+
+    def __init__(self, message):
+        self.message = message or ""
+        self.iteration = 0
+        self.tool_names = []  # Tools called since the last model call
+        self.escalated = False
+        self.downgraded = False  # Over the session budget: fast model only (see accounting.py)
+
+    def advance(self):
+        """Count an iteration whose output did not come from a model call (a cached plan step)."""
+        self.iteration += 1
+        self.tool_names = []
+
+    def tool_called(self, name, label, result):
+        self.tool_names.append(name)
+        if not self.escalated and (label in VALIDATION_FAILURES or str(result).startswith("[ERROR]")):
+            self.escalated = True
+            metrics.MODEL_ESCALATIONS.inc()
+
+
+class ModelRouter:
+    def __init__(self, policy=ROUTING_POLICY, strong=STRONG_MODEL, fast=FAST_MODEL):
+        self.policy = policy
+        self.strong = strong
+        self.fast = fast
+        self._latency = {}  # model -> moving average seconds per eligible call
+        self._since_probe = 0  # Eligible calls since the other tier was last probed
+        self._lock = threading.Lock()
+
+    def start_turn(self, message):
+        return TurnRouting(message)
+
+    def choose(self, turn):
+        """Pick the model for the next iteration of turn. Returns (model, reason)."""
+        turn.iteration += 1
+        model, reason = self._choose(turn)
+        turn.tool_names = []
+        metrics.MODEL_ROUTED.inc(model=model, reason=reason)
+        return model, reason
+
+    def _choose(self, turn):
+        if self.policy == "strong" or self.strong == self.fast:
+            return self.strong, "policy"
+        if self.policy == "fast":
+            return self.fast, "policy"
+        if turn.downgraded:
+            return self.fast, "budget"
+        if turn.escalated:
+            return self.strong, "escalated"
+        if turn.iteration <= 1:
+            simple = len(turn.message) <= FAST_MESSAGE_CHARS and _SIMPLE_MESSAGE_RE.match(turn.message)
+            if not simple:
+                return self.strong, "complex_message"
+        elif not turn.tool_names or not all(name in SIMPLE_TOOLS for name in turn.tool_names):
+            return self.strong, "complex_tool"
+        return self._eligible(turn)
+
+    def _eligible(self, turn):
+        """Tier for an iteration the fast model could serve, by their latency on such iterations."""
+        with self._lock:
+            fast, strong = self._latency.get(self.fast), self._latency.get(self.strong)
+            if fast is None:
+                return self.fast, "simple_message" if turn.iteration <= 1 else "simple_tool"
+            prefer_fast = strong is None or fast <= strong * FAST_LATENCY_RATIO
+            self._since_probe += 1
+            if self._since_probe >= FAST_PROBE_EVERY:
+                self._since_probe = 0
+                return (self.strong if prefer_fast else self.fast), "latency_probe"
+        if prefer_fast:
+            return self.fast, "simple_message" if turn.iteration <= 1 else "simple_tool"
+        return self.strong, "fast_slower"
+
+    def observe(self, model, seconds, reason=None):
+        """Record the latency of a model call; only calls on ELIGIBLE_ROUTES take part in the comparison."""
+        if reason not in ELIGIBLE_ROUTES:
+            return
+        with self._lock:
+            previous = self._latency.get(model)
+            self._latency[model] = seconds if previous is None else (
+                LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * previous)
+
+    def latency(self, model):
+        with self._lock:
+            return self._latency.get(model)
+
+
+model_router = ModelRouter()
@@ -672,6 +672,9 @@ function parseAndCreateBlock(spec, shouldPosition = false, placementType = null,
   return newBlock;
 }
 
+// Numeric literals: JSON and Python forms (sign, leading or trailing dot, exponent, digit underscores)
+const NUMBER_LITERAL = /^[+-]?(\d+(_\d+)*(\.(\d+(_\d+)*)?)?|\.\d+(_\d+)*)([eE][+-]?\d+(_\d+)*)?$/;
+
 // Helper function to parse inputs(key: value, key2: value2, ...)
 function parseInputs(inputStr) {
   const result = {};
@@ -718,9 +721,9 @@ function parseInputs(inputStr) {
       if (currentValue.match(/^\w+\s*\(inputs\(/)) {
         // This is a nested block
         result[currentKey] = currentValue;
-      } else if (currentValue.match(/^-?\d+(\.\d+)?$/)) {
-        // This is a number
-        result[currentKey] = parseFloat(currentValue);
+      } else if (currentValue.match(NUMBER_LITERAL)) {
+        // This is a number (same forms as the server's DSL parser: 1, -2.5, .5, 1e5, 1_000)
+        result[currentKey] = parseFloat(currentValue.replace(/_/g, ''));
       } else if (currentValue === 'true' || currentValue === 'false') {
         // This is a boolean
         result[currentKey] = currentValue === 'true';
@@ -758,9 +761,9 @@ function parseInputs(inputStr) {
       if (currentValue.match(/^\w+\s*\(inputs\(/)) {
         // This is a nested block
         result[currentKey] = currentValue;
-      } else if (currentValue.match(/^-?\d+(\.\d+)?$/)) {
-        // This is a number
-        result[currentKey] = parseFloat(currentValue);
+      } else if (currentValue.match(NUMBER_LITERAL)) {
+        // This is a number (same forms as the server's DSL parser: 1, -2.5, .5, 1e5, 1_000)
+        result[currentKey] = parseFloat(currentValue.replace(/_/g, ''));
       } else if (currentValue === 'true' || currentValue === 'false') {
         // This is a boolean
         result[currentKey] = currentValue === 'true';
@@ -774,378 +777,412 @@ function parseInputs(inputStr) {
   return result;
 }
 
-// Set up unified SSE connection for all workspace operations
-const setupUnifiedStream = () => {
-  const eventSource = new EventSource('/unified_stream');
-  const processedRequests = new Set(); // Track processed requests
+// Id of the last operation event applied ("<server epoch>-<sequence>"), kept across reconnects
+// so the server resumes the stream right after it and nothing sent during a drop is lost
+let lastEventId = '';
 
-  eventSource.onmessage = (event) => {
-    try {
-      const data = JSON.parse(event.data);
-
-      // Skip heartbeat messages
-      if (data.heartbeat) return;
-
-      // Determine request key based on type
-      let requestKey;
-      if (data.type === 'delete') {
-        requestKey = `delete_${data.block_id}`;
-      } else if (data.type === 'create') {
-        requestKey = `create_${data.request_id}`;
-      } else if (data.type === 'variable') {
-        requestKey = `variable_${data.request_id}`;
-      } else if (data.type === 'edit_mcp') {
-        requestKey = `edit_mcp_${data.request_id}`;
-      } else if (data.type === 'replace') {
-        requestKey = `replace_${data.request_id}`;
-      }
+const parseEventId = (id) => {
+  const separator = id.lastIndexOf('-');
+  return { epoch: id.slice(0, separator), sequence: Number(id.slice(separator + 1)) };
+};
 
-      // Skip if we've already processed this request
-      if (requestKey && processedRequests.has(requestKey)) {
-        console.log('[SSE] Skipping duplicate request:', requestKey);
-        return;
-      }
-      if (requestKey) {
-        processedRequests.add(requestKey);
-        // Clear after 10 seconds to allow retries if needed
-        setTimeout(() => processedRequests.delete(requestKey), 10000);
+// Optional WebSocket carrying operations, results and workspace updates on one connection.
+// While it is not open, operations come over SSE and everything else is POSTed.
+let workspaceSocket = null;
+
+// Send a message over the WebSocket if it is open. Returns false when the caller should use HTTP.
+const sendOverSocket = (kind, data) => {
+  if (!workspaceSocket || workspaceSocket.readyState !== WebSocket.OPEN) return false;
+  workspaceSocket.send(JSON.stringify({ kind, data }));
+  return true;
+};
+
+// Send an operation result to the backend
+const sendResult = (result) => {
+  if (sendOverSocket('result', result)) return Promise.resolve();
+  return fetch('/request_result', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(result)
+  });
+};
+
+// Apply one workspace operation from the server (received over the WebSocket or SSE) and send its result back
+const handleOperation = (data, eventId) => {
+  try {
+    // Skip heartbeat messages
+    if (data.heartbeat) return;
+
+    // Skip events already applied (the same server process sent them before a reconnect)
+    if (eventId) {
+      if (lastEventId) {
+        const current = parseEventId(eventId);
+        const previous = parseEventId(lastEventId);
+        if (current.epoch === previous.epoch && current.sequence <= previous.sequence) {
+          console.log('[SSE] Skipping already applied event:', eventId);
+          return;
+        }
       }
+      lastEventId = eventId;
+    }
 
-      // Handle edit MCP requests
-      if (data.type === 'edit_mcp' && data.request_id) {
-        console.log('[SSE] Received edit MCP request:', data);
+    // Handle edit MCP requests
+    if (data.type === 'edit_mcp' && data.request_id) {
+      console.log('[SSE] Received edit MCP request:', data);
 
-        let success = false;
-        let error = null;
+      let success = false;
+      let error = null;
 
-        try {
-          // Find the create_mcp block
-          const mcpBlocks = ws.getBlocksByType('create_mcp');
-          const mcpBlock = mcpBlocks[0];
+      try {
+        // Find the create_mcp block
+        const mcpBlocks = ws.getBlocksByType('create_mcp');
+        const mcpBlock = mcpBlocks[0];
 
-          if (!mcpBlock) {
-            throw new Error('No create_mcp block found in workspace');
-          }
+        if (!mcpBlock) {
+          throw new Error('No create_mcp block found in workspace');
+        }
 
-          // Disable events to prevent infinite loops
-          Blockly.Events.disable();
+        // Disable events to prevent infinite loops
+        Blockly.Events.disable();
 
-          try {
-            // Create a container block for the mutator
-            const containerBlock = ws.newBlock('container');
-            containerBlock.initSvg();
-
-            // Build inputs if provided
-            if (data.inputs && Array.isArray(data.inputs)) {
-              let connection = containerBlock.getInput('STACK').connection;
-              for (let idx = 0; idx < data.inputs.length; idx++) {
-                const input = data.inputs[idx];
-                const itemBlock = ws.newBlock('container_input');
-                itemBlock.initSvg();
-                itemBlock.setFieldValue(input.type || 'string', 'TYPE');
-                itemBlock.setFieldValue(input.name || '', 'NAME');
-                connection.connect(itemBlock.previousConnection);
-                connection = itemBlock.nextConnection;
-              }
+        try {
+          // Create a container block for the mutator
+          const containerBlock = ws.newBlock('container');
+          containerBlock.initSvg();
+
+          // Build inputs if provided
+          if (data.inputs && Array.isArray(data.inputs)) {
+            let connection = containerBlock.getInput('STACK').connection;
+            for (let idx = 0; idx < data.inputs.length; idx++) {
+              const input = data.inputs[idx];
+              const itemBlock = ws.newBlock('container_input');
+              itemBlock.initSvg();
+              itemBlock.setFieldValue(input.type || 'string', 'TYPE');
+              itemBlock.setFieldValue(input.name || '', 'NAME');
+              connection.connect(itemBlock.previousConnection);
+              connection = itemBlock.nextConnection;
             }
+          }
 
-            // Build outputs if provided
-            if (data.outputs && Array.isArray(data.outputs)) {
-              let connection2 = containerBlock.getInput('STACK2').connection;
-              for (let idx = 0; idx < data.outputs.length; idx++) {
-                const output = data.outputs[idx];
-                const itemBlock = ws.newBlock('container_output');
-                itemBlock.initSvg();
-                itemBlock.setFieldValue(output.type || 'string', 'TYPE');
-                itemBlock.setFieldValue(output.name || 'output', 'NAME');
-                connection2.connect(itemBlock.previousConnection);
-                connection2 = itemBlock.nextConnection;
-              }
+          // Build outputs if provided
+          if (data.outputs && Array.isArray(data.outputs)) {
+            let connection2 = containerBlock.getInput('STACK2').connection;
+            for (let idx = 0; idx < data.outputs.length; idx++) {
+              const output = data.outputs[idx];
+              const itemBlock = ws.newBlock('container_output');
+              itemBlock.initSvg();
+              itemBlock.setFieldValue(output.type || 'string', 'TYPE');
+              itemBlock.setFieldValue(output.name || 'output', 'NAME');
+              connection2.connect(itemBlock.previousConnection);
+              connection2 = itemBlock.nextConnection;
             }
+          }
 
-            // Apply changes using the compose method
-            mcpBlock.compose(containerBlock);
+          // Apply changes using the compose method
+          mcpBlock.compose(containerBlock);
 
-            // Clean up
-            containerBlock.dispose();
-            success = true;
-            console.log('[SSE] Successfully edited MCP block');
-          } finally {
-            Blockly.Events.enable();
-          }
-        } catch (e) {
-          error = e.toString();
-          console.error('[SSE] Error editing MCP block:', e);
+          // Clean up
+          containerBlock.dispose();
+          success = true;
+          console.log('[SSE] Successfully edited MCP block');
+        } finally {
+          Blockly.Events.enable();
         }
-
-        // Send result back to backend immediately
-        console.log('[SSE] Sending edit MCP result:', { request_id: data.request_id, success, error });
-        fetch('/request_result', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            request_type: 'edit_mcp',
-            request_id: data.request_id,
-            success: success,
-            error: error
-          })
-        }).then(response => {
-          console.log('[SSE] Edit MCP result sent successfully');
-        }).catch(err => {
-          console.error('[SSE] Error sending edit MCP result:', err);
-        });
+      } catch (e) {
+        error = e.toString();
+        console.error('[SSE] Error editing MCP block:', e);
       }
-      // Handle replace block requests
-      else if (data.type === 'replace' && data.block_id && data.block_spec && data.request_id) {
-        console.log('[SSE] Received replace request for block:', data.block_id, data.block_spec);
 
-        let success = false;
-        let error = null;
-        let blockId = null;
+      // Send result back to backend immediately
+      console.log('[SSE] Sending edit MCP result:', { request_id: data.request_id, success, error });
+      sendResult({
+        request_type: 'edit_mcp',
+        request_id: data.request_id,
+        success: success,
+        error: error
+      }).then(() => {
+        console.log('[SSE] Edit MCP result sent successfully');
+      }).catch(err => {
+        console.error('[SSE] Error sending edit MCP result:', err);
+      });
+    }
+    // Handle replace block requests
+    else if (data.type === 'replace' && data.block_id && data.block_spec && data.request_id) {
+      console.log('[SSE] Received replace request for block:', data.block_id, data.block_spec);
 
-        try {
-          // Get the block to be replaced
-          const blockToReplace = ws.getBlockById(data.block_id);
+      let success = false;
+      let error = null;
+      let blockId = null;
 
-          if (!blockToReplace) {
-            throw new Error(`Block ${data.block_id} not found`);
-          }
+      try {
+        // Get the block to be replaced
+        const blockToReplace = ws.getBlockById(data.block_id);
 
-          // Store connection info before creating new block
-          const parentBlock = blockToReplace.getParent();
-          const previousBlock = blockToReplace.getPreviousBlock();
-          const nextBlock = blockToReplace.getNextBlock();
-          let parentConnection = null;
-          let inputName = null;
-
-          // Check if this block is connected to a parent's input
-          if (blockToReplace.outputConnection && blockToReplace.outputConnection.targetConnection) {
-            parentConnection = blockToReplace.outputConnection.targetConnection;
-          } else if (blockToReplace.previousConnection && blockToReplace.previousConnection.targetConnection) {
-            parentConnection = blockToReplace.previousConnection.targetConnection;
-          }
+        if (!blockToReplace) {
+          throw new Error(`Block ${data.block_id} not found`);
+        }
 
-          // If the block is in an input socket, get that info
-          if (parentBlock) {
-            const inputs = parentBlock.inputList;
-            for (const input of inputs) {
-              if (input.connection && input.connection.targetBlock() === blockToReplace) {
-                inputName = input.name;
-                break;
-              }
+        // Store connection info before creating new block
+        const parentBlock = blockToReplace.getParent();
+        const previousBlock = blockToReplace.getPreviousBlock();
+        const nextBlock = blockToReplace.getNextBlock();
+        let parentConnection = null;
+        let inputName = null;
+
+        // Check if this block is connected to a parent's input
+        if (blockToReplace.outputConnection && blockToReplace.outputConnection.targetConnection) {
+          parentConnection = blockToReplace.outputConnection.targetConnection;
+        } else if (blockToReplace.previousConnection && blockToReplace.previousConnection.targetConnection) {
+          parentConnection = blockToReplace.previousConnection.targetConnection;
+        }
+
+        // If the block is in an input socket, get that info
+        if (parentBlock) {
+          const inputs = parentBlock.inputList;
+          for (const input of inputs) {
+            if (input.connection && input.connection.targetBlock() === blockToReplace) {
+              inputName = input.name;
+              break;
             }
           }
+        }
 
-          // Preserve only statement/next blocks (the body), not input field values
-          const statementBlocks = {};
-          const oldInputList = blockToReplace.inputList;
-          
-          for (const input of oldInputList) {
-            // Only preserve STATEMENT type inputs (like BODY, SUBSTACK, etc) - these are the internal structure
-            // Skip VALUE inputs and other types that might contain data values
-            if (input.type === Blockly.NEXT_STATEMENT && input.connection && input.connection.targetBlock()) {
-              const childBlock = input.connection.targetBlock();
-              statementBlocks[input.name] = {
-                block: childBlock,
-                connection: input.connection
-              };
-              console.log('[SSE] Found statement input to preserve:', input.name);
-            }
+        // Preserve only statement/next blocks (the body), not input field values
+        const statementBlocks = {};
+        const oldInputList = blockToReplace.inputList;
+        
+        for (const input of oldInputList) {
+          // Only preserve STATEMENT type inputs (like BODY, SUBSTACK, etc) - these are the internal structure
+          // Skip VALUE inputs and other types that might contain data values
+          if (input.type === Blockly.NEXT_STATEMENT && input.connection && input.connection.targetBlock()) {
+            const childBlock = input.connection.targetBlock();
+            statementBlocks[input.name] = {
+              block: childBlock,
+              connection: input.connection
+            };
+            console.log('[SSE] Found statement input to preserve:', input.name);
           }
+        }
 
-          // Create the new block using the shared function (no positioning, no placement type for replace)
-          const newBlock = parseAndCreateBlock(data.block_spec, false, null, null);
+        // Create the new block using the shared function (no positioning, no placement type for replace)
+        const newBlock = parseAndCreateBlock(data.block_spec, false, null, null);
 
-          if (!newBlock) {
-            throw new Error('Failed to create replacement block');
-          }
+        if (!newBlock) {
+          throw new Error('Failed to create replacement block');
+        }
 
-          // Reattach the new block to the parent connection
-          if (parentConnection) {
-            if (newBlock.outputConnection) {
-              parentConnection.connect(newBlock.outputConnection);
-            } else if (newBlock.previousConnection) {
-              parentConnection.connect(newBlock.previousConnection);
-            }
+        // Reattach the new block to the parent connection
+        if (parentConnection) {
+          if (newBlock.outputConnection) {
+            parentConnection.connect(newBlock.outputConnection);
+          } else if (newBlock.previousConnection) {
+            parentConnection.connect(newBlock.previousConnection);
           }
+        }
 
-          // Reattach next block if it was connected
-          if (nextBlock && newBlock.nextConnection) {
-            newBlock.nextConnection.connect(nextBlock.previousConnection);
-          }
+        // Reattach next block if it was connected
+        if (nextBlock && newBlock.nextConnection) {
+          newBlock.nextConnection.connect(nextBlock.previousConnection);
+        }
 
-          // Transfer only statement blocks (body/internal structure) to matching inputs on new block
-          console.log('[SSE] Transferring', Object.keys(statementBlocks).length, 'statement blocks to new block');
-          for (const [oldInputName, blockInfo] of Object.entries(statementBlocks)) {
-            const newInput = newBlock.getInput(oldInputName);
-            if (newInput && newInput.connection && newInput.type === Blockly.NEXT_STATEMENT) {
-              console.log('[SSE] Transferring statement input:', oldInputName);
-              // Disconnect from old parent
-              blockInfo.block.unplug(false); // false = don't dispose children
-              // Connect to new parent
-              if (newInput.connection.targetBlock()) {
-                // Input already has something connected, skip
-                console.log('[SSE] Input', oldInputName, 'already has children, skipping');
-              } else {
-                newInput.connection.connect(blockInfo.block.previousConnection);
-              }
+        // Transfer only statement blocks (body/internal structure) to matching inputs on new block
+        console.log('[SSE] Transferring', Object.keys(statementBlocks).length, 'statement blocks to new block');
+        for (const [oldInputName, blockInfo] of Object.entries(statementBlocks)) {
+          const newInput = newBlock.getInput(oldInputName);
+          if (newInput && newInput.connection && newInput.type === Blockly.NEXT_STATEMENT) {
+            console.log('[SSE] Transferring statement input:', oldInputName);
+            // Disconnect from old parent
+            blockInfo.block.unplug(false); // false = don't dispose children
+            // Connect to new parent
+            if (newInput.connection.targetBlock()) {
+              // Input already has something connected, skip
+              console.log('[SSE] Input', oldInputName, 'already has children, skipping');
             } else {
-              console.log('[SSE] New block does not have matching STATEMENT input:', oldInputName);
-              // Disconnect the child block from the old parent but leave it orphaned
-              // (it will appear as a separate block in the workspace)
-              blockInfo.block.unplug(false);
+              newInput.connection.connect(blockInfo.block.previousConnection);
             }
+          } else {
+            console.log('[SSE] New block does not have matching STATEMENT input:', oldInputName);
+            // Disconnect the child block from the old parent but leave it orphaned
+            // (it will appear as a separate block in the workspace)
+            blockInfo.block.unplug(false);
           }
+        }
 
-          // Dispose only the old block itself, not its children (dispose(false))
-          blockToReplace.dispose(false);
-
-          // Render the workspace
-          ws.render();
+        // Dispose only the old block itself, not its children (dispose(false))
+        blockToReplace.dispose(false);
 
-          success = true;
-          blockId = newBlock.id;
-          console.log('[SSE] Successfully replaced block:', data.block_id, 'with:', newBlock.id);
-        } catch (e) {
-          error = e.toString();
-          console.error('[SSE] Error replacing block:', e);
-        }
+        // Render the workspace
+        ws.render();
 
-        // Send result back to backend
-        console.log('[SSE] Sending replace block result:', { request_id: data.request_id, success, error, block_id: blockId });
-        fetch('/request_result', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            request_type: 'replace',
-            request_id: data.request_id,
-            success: success,
-            error: error,
-            block_id: blockId
-          })
-        }).then(response => {
-          console.log('[SSE] Replace block result sent successfully');
-        }).catch(err => {
-          console.error('[SSE] Error sending replace block result:', err);
-        });
+        success = true;
+        blockId = newBlock.id;
+        console.log('[SSE] Successfully replaced block:', data.block_id, 'with:', newBlock.id);
+      } catch (e) {
+        error = e.toString();
+        console.error('[SSE] Error replacing block:', e);
       }
-      // Handle deletion requests
-      else if (data.type === 'delete' && data.block_id) {
-        console.log('[SSE] Received deletion request for block:', data.block_id);
-
-        // Try to delete the block
-        const block = ws.getBlockById(data.block_id);
-        let success = false;
-        let error = null;
-
-        if (block) {
-          console.log('[SSE] Found block to delete:', block.type, block.id);
-          // Check if it's the main create_mcp block (which shouldn't be deleted)
-          if (block.type === 'create_mcp' && !block.isDeletable()) {
-            error = 'Cannot delete the main create_mcp block';
-            console.log('[SSE] Block is protected create_mcp');
-          } else {
-            try {
-              block.dispose(true);
-              success = true;
-              console.log('[SSE] Successfully deleted block:', data.block_id);
-            } catch (e) {
-              error = e.toString();
-              console.error('[SSE] Error deleting block:', e);
-            }
-          }
+
+      // Send result back to backend
+      console.log('[SSE] Sending replace block result:', { request_id: data.request_id, success, error, block_id: blockId });
+      sendResult({
+        request_type: 'replace',
+        request_id: data.request_id,
+        success: success,
+        error: error,
+        block_id: blockId
+      }).then(() => {
+        console.log('[SSE] Replace block result sent successfully');
+      }).catch(err => {
+        console.error('[SSE] Error sending replace block result:', err);
+      });
+    }
+    // Handle deletion requests
+    else if (data.type === 'delete' && data.block_id) {
+      console.log('[SSE] Received deletion request for block:', data.block_id);
+
+      // Try to delete the block
+      const block = ws.getBlockById(data.block_id);
+      let success = false;
+      let error = null;
+
+      if (block) {
+        console.log('[SSE] Found block to delete:', block.type, block.id);
+        // Check if it's the main create_mcp block (which shouldn't be deleted)
+        if (block.type === 'create_mcp' && !block.isDeletable()) {
+          error = 'Cannot delete the main create_mcp block';
+          console.log('[SSE] Block is protected create_mcp');
         } else {
-          error = 'Block not found';
-          console.log('[SSE] Block not found:', data.block_id);
+          try {
+            block.dispose(true);
+            success = true;
+            console.log('[SSE] Successfully deleted block:', data.block_id);
+          } catch (e) {
+            error = e.toString();
+            console.error('[SSE] Error deleting block:', e);
+          }
         }
-
-        // Send result back to backend immediately
-        console.log('[SSE] Sending deletion result:', { block_id: data.block_id, success, error });
-        fetch('/request_result', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            request_type: 'delete',
-            block_id: data.block_id,
-            success: success,
-            error: error
-          })
-        }).then(response => {
-          console.log('[SSE] Deletion result sent successfully');
-        }).catch(err => {
-          console.error('[SSE] Error sending deletion result:', err);
-        });
+      } else {
+        error = 'Block not found';
+        console.log('[SSE] Block not found:', data.block_id);
       }
-      // Handle creation requests
-      else if (data.type === 'create' && data.block_spec && data.request_id) {
-        console.log('[SSE] Received creation request:', data.request_id, data.block_spec);
 
-        let success = false;
-        let error = null;
-        let blockId = null;
+      // Send result back to backend immediately
+      console.log('[SSE] Sending deletion result:', { block_id: data.block_id, success, error });
+      sendResult({
+        request_type: 'delete',
+        block_id: data.block_id,
+        success: success,
+        error: error
+      }).then(() => {
+        console.log('[SSE] Deletion result sent successfully');
+      }).catch(err => {
+        console.error('[SSE] Error sending deletion result:', err);
+      });
+    }
+    // Handle creation requests
+    else if (data.type === 'create' && data.block_spec && data.request_id) {
+      console.log('[SSE] Received creation request:', data.request_id, data.block_spec);
 
-        try {
-          // Create the block and all its nested children
-          const newBlock = parseAndCreateBlock(data.block_spec, true, data.placement_type, data.blockID);
-
-          if (newBlock) {
-            blockId = newBlock.id;
-            success = true; // Block was created successfully
-
-            // Handle placement based on placement_type
-            if (data.placement_type === 'input') {
-              // Place into MCP block's output slot
-              // For type: 'input', find the first MCP block and use input_name for the slot
-              const mcpBlock = ws.getBlocksByType('create_mcp')[0];
-              if (mcpBlock) {
-                let inputSlot = data.input_name;
-
-                // If slot name is not in R format, look it up by output name
-                if (inputSlot && !inputSlot.match(/^R\d+$/)) {
-                  const outputNames = mcpBlock.outputNames_ || [];
-                  const outputIndex = outputNames.indexOf(inputSlot);
-                  if (outputIndex >= 0) {
-                    inputSlot = 'R' + outputIndex;
-                  }
+      let success = false;
+      let error = null;
+      let blockId = null;
+
+      try {
+        // Create the block and all its nested children
+        const newBlock = parseAndCreateBlock(data.block_spec, true, data.placement_type, data.blockID);
+
+        if (newBlock) {
+          blockId = newBlock.id;
+          success = true; // Block was created successfully
+
+          // Handle placement based on placement_type
+          if (data.placement_type === 'input') {
+            // Place into MCP block's output slot
+            // For type: 'input', find the first MCP block and use input_name for the slot
+            const mcpBlock = ws.getBlocksByType('create_mcp')[0];
+            if (mcpBlock) {
+              let inputSlot = data.input_name;
+
+              // If slot name is not in R format, look it up by output name
+              if (inputSlot && !inputSlot.match(/^R\d+$/)) {
+                const outputNames = mcpBlock.outputNames_ || [];
+                const outputIndex = outputNames.indexOf(inputSlot);
+                if (outputIndex >= 0) {
+                  inputSlot = 'R' + outputIndex;
                 }
+              }
 
-                const input = mcpBlock.getInput(inputSlot);
-                if (input && input.connection) {
-                  console.log('[SSE CREATE] Placing block into MCP output slot:', inputSlot);
-                  // Disconnect any existing block
-                  const existingBlock = input.connection.targetBlock();
-                  if (existingBlock) {
-                    existingBlock.unplug();
-                  }
-                  // Connect the new block
-                  if (newBlock.outputConnection) {
-                    input.connection.connect(newBlock.outputConnection);
-                    console.log('[SSE CREATE] Successfully placed block into slot:', inputSlot);
-                  } else {
-                    error = `Block has no output connection to connect to MCP slot ${inputSlot}`;
-                    console.error('[SSE CREATE]', error);
-                  }
+              const input = mcpBlock.getInput(inputSlot);
+              if (input && input.connection) {
+                console.log('[SSE CREATE] Placing block into MCP output slot:', inputSlot);
+                // Disconnect any existing block
+                const existingBlock = input.connection.targetBlock();
+                if (existingBlock) {
+                  existingBlock.unplug();
+                }
+                // Connect the new block
+                if (newBlock.outputConnection) {
+                  input.connection.connect(newBlock.outputConnection);
+                  console.log('[SSE CREATE] Successfully placed block into slot:', inputSlot);
                 } else {
-                  // Try to get all available inputs on the MCP block for debugging
-                  const availableInputs = mcpBlock.inputList.map(inp => inp.name).join(', ');
-                  error = `Output slot '${inputSlot}' not found. Available inputs: ${availableInputs}`;
+                  error = `Block has no output connection to connect to MCP slot ${inputSlot}`;
                   console.error('[SSE CREATE]', error);
                 }
               } else {
-                error = `No MCP block found in workspace`;
+                // Try to get all available inputs on the MCP block for debugging
+                const availableInputs = mcpBlock.inputList.map(inp => inp.name).join(', ');
+                error = `Output slot '${inputSlot}' not found. Available inputs: ${availableInputs}`;
                 console.error('[SSE CREATE]', error);
               }
+            } else {
+              error = `No MCP block found in workspace`;
+              console.error('[SSE CREATE]', error);
             }
-            // If placement_type is 'under', attach the new block under the parent
-            else if (data.placement_type === 'under') {
-              const parentBlock = ws.getBlockById(data.blockID);
-              if (parentBlock) {
-                console.log('[SSE CREATE] Attaching to parent block:', data.blockID);
-
-                // If input_name is specified, try to connect to that specific input first
-                let connected = false;
-                if (data.input_name) {
-                  const input = parentBlock.getInput(data.input_name);
+          }
+          // If placement_type is 'under', attach the new block under the parent
+          else if (data.placement_type === 'under') {
+            const parentBlock = ws.getBlockById(data.blockID);
+            if (parentBlock) {
+              console.log('[SSE CREATE] Attaching to parent block:', data.blockID);
+
+              // If input_name is specified, try to connect to that specific input first
+              let connected = false;
+              if (data.input_name) {
+                const input = parentBlock.getInput(data.input_name);
+                if (input && input.type === Blockly.NEXT_STATEMENT) {
+                  // Check if something is already connected
+                  if (input.connection && !input.connection.targetBlock()) {
+                    // Connect directly
+                    if (newBlock.previousConnection) {
+                      input.connection.connect(newBlock.previousConnection);
+                      connected = true;
+                      console.log('[SSE CREATE] Connected to specified input:', data.input_name);
+                    }
+                  } else if (input.connection && input.connection.targetBlock()) {
+                    // Find the last block in the stack
+                    let lastBlock = input.connection.targetBlock();
+                    while (lastBlock.nextConnection && lastBlock.nextConnection.targetBlock()) {
+                      lastBlock = lastBlock.nextConnection.targetBlock();
+                    }
+                    // Connect to the end of the stack
+                    if (lastBlock.nextConnection && newBlock.previousConnection) {
+                      lastBlock.nextConnection.connect(newBlock.previousConnection);
+                      connected = true;
+                      console.log('[SSE CREATE] Connected to end of stack in specified input:', data.input_name);
+                    }
+                  }
+                } else {
+                  error = `Specified input '${data.input_name}' not found or is not a statement input`;
+                  console.warn('[SSE CREATE]', error);
+                }
+              }
+
+              // If not connected via specified input_name, try common statement inputs
+              if (!connected) {
+                const statementInputs = ['BODY', 'DO', 'THEN', 'ELSE', 'STACK'];
+
+                for (const inputName of statementInputs) {
+                  const input = parentBlock.getInput(inputName);
                   if (input && input.type === Blockly.NEXT_STATEMENT) {
                     // Check if something is already connected
                     if (input.connection && !input.connection.targetBlock()) {
@@ -1153,7 +1190,8 @@ const setupUnifiedStream = () => {
                       if (newBlock.previousConnection) {
                         input.connection.connect(newBlock.previousConnection);
                         connected = true;
-                        console.log('[SSE CREATE] Connected to specified input:', data.input_name);
+                        console.log('[SSE CREATE] Connected to input:', inputName);
+                        break;
                       }
                     } else if (input.connection && input.connection.targetBlock()) {
                       // Find the last block in the stack
@@ -1165,163 +1203,135 @@ const setupUnifiedStream = () => {
                       if (lastBlock.nextConnection && newBlock.previousConnection) {
                         lastBlock.nextConnection.connect(newBlock.previousConnection);
                         connected = true;
-                        console.log('[SSE CREATE] Connected to end of stack in specified input:', data.input_name);
-                      }
-                    }
-                  } else {
-                    error = `Specified input '${data.input_name}' not found or is not a statement input`;
-                    console.warn('[SSE CREATE]', error);
-                  }
-                }
-
-                // If not connected via specified input_name, try common statement inputs
-                if (!connected) {
-                  const statementInputs = ['BODY', 'DO', 'THEN', 'ELSE', 'STACK'];
-
-                  for (const inputName of statementInputs) {
-                    const input = parentBlock.getInput(inputName);
-                    if (input && input.type === Blockly.NEXT_STATEMENT) {
-                      // Check if something is already connected
-                      if (input.connection && !input.connection.targetBlock()) {
-                        // Connect directly
-                        if (newBlock.previousConnection) {
-                          input.connection.connect(newBlock.previousConnection);
-                          connected = true;
-                          console.log('[SSE CREATE] Connected to input:', inputName);
-                          break;
-                        }
-                      } else if (input.connection && input.connection.targetBlock()) {
-                        // Find the last block in the stack
-                        let lastBlock = input.connection.targetBlock();
-                        while (lastBlock.nextConnection && lastBlock.nextConnection.targetBlock()) {
-                          lastBlock = lastBlock.nextConnection.targetBlock();
-                        }
-                        // Connect to the end of the stack
-                        if (lastBlock.nextConnection && newBlock.previousConnection) {
-                          lastBlock.nextConnection.connect(newBlock.previousConnection);
-                          connected = true;
-                          console.log('[SSE CREATE] Connected to end of stack in input:', inputName);
-                          break;
-                        }
+                        console.log('[SSE CREATE] Connected to end of stack in input:', inputName);
+                        break;
                       }
                     }
                   }
                 }
+              }
 
-                // If not connected to statement input, try value inputs
-                if (!connected) {
-                  // Try all inputs
-                  const inputs = parentBlock.inputList;
-                  for (const input of inputs) {
-                    if (input.type === Blockly.INPUT_VALUE && input.connection && !input.connection.targetBlock()) {
-                      if (newBlock.outputConnection) {
-                        input.connection.connect(newBlock.outputConnection);
-                        connected = true;
-                        console.log('[SSE CREATE] Connected to value input:', input.name);
-                        break;
-                      }
+              // If not connected to statement input, try value inputs
+              if (!connected) {
+                // Try all inputs
+                const inputs = parentBlock.inputList;
+                for (const input of inputs) {
+                  if (input.type === Blockly.INPUT_VALUE && input.connection && !input.connection.targetBlock()) {
+                    if (newBlock.outputConnection) {
+                      input.connection.connect(newBlock.outputConnection);
+                      connected = true;
+                      console.log('[SSE CREATE] Connected to value input:', input.name);
+                      break;
                     }
                   }
                 }
+              }
 
-                if (!connected) {
-                  error = `Could not find suitable connection point on parent block`;
-                  console.warn('[SSE CREATE]', error);
-                }
-              } else {
-                error = `Parent block not found: ${data.blockID}`;
+              if (!connected) {
+                error = `Could not find suitable connection point on parent block`;
                 console.warn('[SSE CREATE]', error);
               }
+            } else {
+              error = `Parent block not found: ${data.blockID}`;
+              console.warn('[SSE CREATE]', error);
             }
-
-            if (success) {
-              console.log('[SSE CREATE] Successfully created block with children:', blockId, newBlock.type);
-            }
-          } else {
-            throw new Error(`Failed to create block from specification`);
           }
 
-        } catch (e) {
-          error = e.toString();
-          console.error('[SSE CREATE] Error creating block:', e);
+          if (success) {
+            console.log('[SSE CREATE] Successfully created block with children:', blockId, newBlock.type);
+          }
+        } else {
+          throw new Error(`Failed to create block from specification`);
         }
 
-        // Send result back to backend immediately
-        console.log('[SSE CREATE] Sending creation result:', {
-          request_id: data.request_id,
-          success,
-          error,
-          block_id: blockId
-        });
-
-        fetch('/request_result', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            request_type: 'create',
-            request_id: data.request_id,
-            success: success,
-            error: error,
-            block_id: blockId
-          })
-        }).then(response => {
-          console.log('[SSE CREATE] Creation result sent successfully');
-        }).catch(err => {
-          console.error('[SSE CREATE] Error sending creation result:', err);
-        });
+      } catch (e) {
+        error = e.toString();
+        console.error('[SSE CREATE] Error creating block:', e);
       }
-      // Handle variable creation requests
-      else if (data.type === 'variable' && data.variable_name && data.request_id) {
-        console.log('[SSE] Received variable creation request:', data.request_id, data.variable_name);
 
-        let success = false;
-        let error = null;
-        let variableId = null;
+      // Send result back to backend immediately
+      console.log('[SSE CREATE] Sending creation result:', {
+        request_id: data.request_id,
+        success,
+        error,
+        block_id: blockId
+      });
 
-        try {
-          // Create the variable using Blockly's variable map
-          const variableName = data.variable_name;
+      sendResult({
+        request_type: 'create',
+        request_id: data.request_id,
+        success: success,
+        error: error,
+        block_id: blockId
+      }).then(() => {
+        console.log('[SSE CREATE] Creation result sent successfully');
+      }).catch(err => {
+        console.error('[SSE CREATE] Error sending creation result:', err);
+      });
+    }
+    // Handle variable creation requests
+    else if (data.type === 'variable' && data.variable_name && data.request_id) {
+      console.log('[SSE] Received variable creation request:', data.request_id, data.variable_name);
 
-          // Use the workspace's variable map to create a new variable
-          const variableModel = ws.getVariableMap().createVariable(variableName);
+      let success = false;
+      let error = null;
+      let variableId = null;
 
-          if (variableModel) {
-            variableId = variableModel.getId();
-            success = true;
-            console.log('[SSE] Successfully created variable:', variableName, 'with ID:', variableId);
-          } else {
-            throw new Error('Failed to create variable model');
-          }
+      try {
+        // Create the variable using Blockly's variable map
+        const variableName = data.variable_name;
+
+        // Use the workspace's variable map to create a new variable
+        const variableModel = ws.getVariableMap().createVariable(variableName);
 
-        } catch (e) {
-          error = e.toString();
-          console.error('[SSE] Error creating variable:', e);
+        if (variableModel) {
+          variableId = variableModel.getId();
+          success = true;
+          console.log('[SSE] Successfully created variable:', variableName, 'with ID:', variableId);
+        } else {
+          throw new Error('Failed to create variable model');
         }
 
-        // Send result back to backend immediately
-        console.log('[SSE] Sending variable creation result:', {
-          request_id: data.request_id,
-          success,
-          error,
-          variable_id: variableId
-        });
-
-        fetch('/request_result', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            request_type: 'variable',
-            request_id: data.request_id,
-            success: success,
-            error: error,
-            variable_id: variableId
-          })
-        }).then(response => {
-          console.log('[SSE] Variable creation result sent successfully');
-        }).catch(err => {
-          console.error('[SSE] Error sending variable creation result:', err);
-        });
+      } catch (e) {
+        error = e.toString();
+        console.error('[SSE] Error creating variable:', e);
       }
+
+      // Send result back to backend immediately
+      console.log('[SSE] Sending variable creation result:', {
+        request_id: data.request_id,
+        success,
+        error,
+        variable_id: variableId
+      });
+
+      sendResult({
+        request_type: 'variable',
+        request_id: data.request_id,
+        success: success,
+        error: error,
+        variable_id: variableId
+      }).then(() => {
+        console.log('[SSE] Variable creation result sent successfully');
+      }).catch(err => {
+        console.error('[SSE] Error sending variable creation result:', err);
+      });
+    }
+  } catch (err) {
+    console.error('[SSE] Error processing operation:', err);
+  }
+};
+
+// Set up unified SSE connection for all workspace operations (fallback when the WebSocket is unavailable)
+const setupUnifiedStream = () => {
+  const url = lastEventId
+    ? `/unified_stream?last_event_id=${encodeURIComponent(lastEventId)}`
+    : '/unified_stream';
+  const eventSource = new EventSource(url);
+
+  eventSource.onmessage = (event) => {
+    try {
+      handleOperation(JSON.parse(event.data), event.lastEventId);
     } catch (err) {
       console.error('[SSE] Error processing message:', err);
     }
@@ -1329,7 +1339,9 @@ const setupUnifiedStream = () => {
 
   eventSource.onerror = (error) => {
     console.error('[SSE] Connection error:', error);
-    // Reconnect after 5 seconds
+    // While CONNECTING the browser reconnects by itself and sends Last-Event-ID.
+    // Only a closed EventSource needs replacing, resuming from lastEventId.
+    if (eventSource.readyState !== EventSource.CLOSED) return;
     setTimeout(() => {
       console.log('[SSE] Attempting to reconnect...');
       setupUnifiedStream();
@@ -1341,8 +1353,47 @@ const setupUnifiedStream = () => {
   };
 };
 
-// Start the unified SSE connection
-setupUnifiedStream();
+// Connect the workspace WebSocket; if it cannot be opened at all, fall back to SSE
+const setupWorkspaceSocket = () => {
+  const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+  const query = lastEventId ? `?last_event_id=${encodeURIComponent(lastEventId)}` : '';
+  const socket = new WebSocket(`${protocol}://${window.location.host}/ws${query}`);
+  let opened = false;
+
+  socket.onopen = () => {
+    opened = true;
+    workspaceSocket = socket;
+    console.log('[WS] Connected to workspace socket');
+  };
+
+  socket.onmessage = (event) => {
+    try {
+      const message = JSON.parse(event.data);
+      if (message.kind === 'operation') {
+        handleOperation(message.data, message.id);
+      }
+    } catch (err) {
+      console.error('[WS] Error processing message:', err);
+    }
+  };
+
+  socket.onclose = () => {
+    if (workspaceSocket === socket) workspaceSocket = null;
+    if (!opened) {
+      console.log('[WS] WebSocket unavailable, falling back to SSE');
+      setupUnifiedStream();
+      return;
+    }
+    // Reconnect after 1 second, resuming after the last applied operation
+    setTimeout(() => {
+      console.log('[WS] Attempting to reconnect...');
+      setupWorkspaceSocket();
+    }, 1000);
+  };
+};
+
+// Start the workspace connection
+setupWorkspaceSocket();
 
 // Observe any size change to the blockly container
 const observer = new ResizeObserver(() => {
@@ -1505,6 +1556,7 @@ demo.launch(mcp_server=True)
     codeEl.textContent = code;
   }
 
+  if (sendOverSocket("update_code", { code })) return;
   fetch("/update_code", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
@@ -1558,6 +1610,10 @@ const processChatUpdateQueue = () => {
 
 // Send chat update with retry logic
 const sendChatUpdate = async (chatCode, retryCount = 0) => {
+  if (sendOverSocket("update_chat", { code: chatCode, varString: globalVarString })) {
+    chatBackendAvailable = true;
+    return;
+  }
   try {
     const response = await fetch("/update_chat", {
       method: "POST",
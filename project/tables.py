@@ -0,0 +1,142 @@
+"""
+File-backed inputs and outputs for the Testing tab.
+
+Large list inputs can be uploaded as CSV/JSON/Parquet files and are read straight
+into DataFrames, instead of being pasted into a Textbox and parsed from one big
+string. Large list results are shown as paginated previews and written to a
+file for download, instead of being rendered with str() into a Textbox.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+TABLE_FILE_TYPES = [".csv", ".tsv", ".json", ".jsonl", ".parquet"]
+
+# Results with more rows than this (or text longer than LARGE_TEXT_CHARS) get a preview and a download
+LARGE_RESULT_ROWS = int(os.getenv("TEST_LARGE_RESULT_ROWS", "200"))
+LARGE_TEXT_CHARS = int(os.getenv("TEST_LARGE_TEXT_CHARS", "100000"))
+PAGE_SIZE = 50
+
+# Downloadable result files, shared by all sessions; each is kept this many seconds
+RESULTS_DIR = os.path.join(tempfile.gettempdir(), "mcp-blockly-results")
+RESULT_FILE_TTL = float(os.getenv("TEST_RESULT_FILE_TTL", "3600"))
+
+
+def load_table(path):
+    """Read an uploaded CSV/TSV/JSON/JSONL/Parquet file into a DataFrame."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return pd.read_csv(path)
+    if extension == ".tsv":
+        return pd.read_csv(path, sep="\t")
+    if extension == ".jsonl":
+        return pd.read_json(path, lines=True)
+    if extension == ".json":
+        return pd.read_json(path)
+    if extension == ".parquet":
+        try:
+            return pd.read_parquet(path)
+        except ImportError as e:
+            raise ValueError("Parquet uploads need pyarrow or fastparquet installed") from e
+    raise ValueError(f"Unsupported file type '{extension}', use one of {', '.join(TABLE_FILE_TYPES)}")
+
+
+class TableInput:
+    """An uploaded table, loaded on first use and identified by a hash of the file contents."""
+
+    def __init__(self, path):
+        self.path = path
+        self._frame = None
+        self._digest = None
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            sha = hashlib.sha1()
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+            self._digest = sha.hexdigest()
+        return self._digest
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            self._frame = load_table(self.path)
+        return self._frame
+
+    def as_list(self):
+        """Values for list parameters other than the first: one column gives a flat list, more give rows."""
+        if len(self.frame.columns) == 1:
+            return self.frame.iloc[:, 0].tolist()
+        return self.frame.values.tolist()
+
+    def __repr__(self):
+        # Used in the test result cache key, so it must identify the contents
+        return f"TableInput(sha1={self.digest})"
+
+
+def to_frame(result):
+    """Tabular view of a list/tuple/DataFrame result."""
+    if isinstance(result, pd.DataFrame):
+        return result
+    rows = list(result)
+    if rows and all(isinstance(row, dict) for row in rows):
+        return pd.DataFrame(rows)
+    if rows and all(isinstance(row, (list, tuple)) for row in rows):
+        return pd.DataFrame(rows)
+    return pd.DataFrame({"value": rows})
+
+
+def is_large(result):
+    if isinstance(result, str):
+        return len(result) > LARGE_TEXT_CHARS
+    if isinstance(result, (list, tuple, pd.DataFrame)):
+        return len(result) > LARGE_RESULT_ROWS
+    return False
+
+
+def page_of(frame, page, page_size=PAGE_SIZE):
+    """Return (rows on the page, clamped page number, page count)."""
+    pages = max(1, (len(frame) + page_size - 1) // page_size)
+    page = min(max(page, 0), pages - 1)
+    return frame.iloc[page * page_size:(page + 1) * page_size], page, pages
+
+
+def _prune_result_files():
+    """Delete result files older than RESULT_FILE_TTL, so one session's results never remove another's fresh download."""
+    cutoff = time.time() - RESULT_FILE_TTL
+    for name in os.listdir(RESULTS_DIR):
+        path = os.path.join(RESULTS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            # Another prune running at the same time removed it first
+            pass
+
+
+def write_result_file(result):
+    """Write a large result to a file for download and return its path."""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    if isinstance(result, str):
+        suffix = ".txt"
+    elif isinstance(result, (list, tuple, pd.DataFrame)):
+        suffix = ".csv"
+    else:
+        suffix = ".json"
+    fd, path = tempfile.mkstemp(prefix="result-", suffix=suffix, dir=RESULTS_DIR)
+    with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+        if suffix == ".txt":
+            f.write(result)
+        elif suffix == ".csv":
+            to_frame(result).to_csv(f, index=False)
+        else:
+            json.dump(result, f, default=str)
+    _prune_result_files()
+    return path
@@ -1,10 +1,22 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import gradio as gr
+import asyncio
 import os
 import ast
-import inspect
+import copy
+import hashlib
 import pandas as pd
+import time
+import threading
+from collections import OrderedDict
+import metrics
+import purity
+from coercion import build_converters, coerce_args
+import tables
+from tables import TableInput
+from cancellation import CancelToken, Cancelled, run_cancellable
+from preview import preview_server
 
 app = FastAPI()
 
@@ -17,18 +29,49 @@ app.add_middleware(
 )
 
 latest_blockly_code = ""
+latest_code_version = ""  # Hash of latest_blockly_code, changes whenever the code does
 stored_api_key = ""  # Store the OpenAI API key in memory
 stored_hf_key = ""  # Store the Hugging Face API key in memory
 
+# Memoized results of pure tools, keyed by (code version, typed args)
+TEST_RESULT_CACHE_SIZE = int(os.getenv("TEST_RESULT_CACHE_SIZE", "256"))
+result_cache = OrderedDict()
+result_cache_lock = threading.Lock()  # Test runs of several sessions can use the cache at once
+purity_by_version = {}  # code version -> purity.Purity
+
+# Cancel token of the test run in progress per browser session (Gradio session hash -> token);
+# Stop, closing the tab or a new run in the same session cancels it
+active_runs = {}
+active_run_lock = threading.Lock()
+
 
 # Gets REAL Python code, not the LLM DSL
 @app.post("/update_code")
 async def update_code(request: Request):
-    global latest_blockly_code
     data = await request.json()
+    return apply_code_update(data)
+
+def apply_code_update(data):
+    global latest_blockly_code, latest_code_version
     latest_blockly_code = data.get("code", "")
+    latest_code_version = hashlib.sha1(latest_blockly_code.encode("utf-8")).hexdigest()
+    # Hot reload a running local MCP preview
+    preview_server.code_changed(latest_blockly_code, latest_code_version)
     return {"ok": True}
 
+# Local MCP preview of the generated app (see preview.py); starting waits until it serves requests
+@app.post("/start_preview")
+async def start_preview():
+    return await asyncio.to_thread(preview_server.start, latest_blockly_code, latest_code_version)
+
+@app.post("/stop_preview")
+async def stop_preview():
+    return await asyncio.to_thread(preview_server.stop)
+
+@app.get("/preview_status")
+async def preview_status():
+    return preview_server.info()
+
 # Sends the latest code to chat.py so that the agent will be able to use the MCP
 @app.get("/get_latest_code")
 async def get_latest_code():
@@ -79,19 +122,54 @@ async def set_api_key_endpoint(request: Request):
         return {"success": False, "error": str(e)}
 
 
-def execute_blockly_logic(user_inputs):
-    global latest_blockly_code, stored_api_key
-    if not latest_blockly_code.strip():
-        return "No Blockly code available"
+def execute_blockly_logic(user_inputs, session_id=None):
+    """
+    Run the workspace tool with the given inputs.
 
-    # Ensure API key is set in environment before executing
-    if stored_api_key:
-        os.environ["OPENAI_API_KEY"] = stored_api_key
+    Args:
+        user_inputs: The input values, in the order of the tool's inputs
+        session_id: Gradio session hash of the tab running the test, so only its own runs supersede it
 
-    result = ""
+    Returns:
+        (result, cache_status) where cache_status says whether the result came from the cache
+    """
+    token = CancelToken("test_run")
+    with active_run_lock:
+        previous = active_runs.get(session_id)
+        active_runs[session_id] = token
+    if previous is not None:
+        previous.cancel("superseded by a new run")
 
-    # More comprehensive filtering of Gradio-related code
-    lines = latest_blockly_code.split('\n')
+    start_time = time.perf_counter()
+    try:
+        return _execute_blockly_logic(user_inputs, token)
+    finally:
+        metrics.EXECUTION_SECONDS.observe(time.perf_counter() - start_time)
+        with active_run_lock:
+            if active_runs.get(session_id) is token:
+                del active_runs[session_id]
+
+
+def cancel_test_run(reason="stopped by user", session_id=None):
+    with active_run_lock:
+        token = active_runs.get(session_id)
+    if token is not None and token.cancel(reason):
+        print(f"[EXECUTION] Test run cancelled ({reason})")
+
+
+def code_purity(code, version):
+    """Purity of the code, analyzed once per code version."""
+    result = purity_by_version.get(version)
+    if result is None:
+        result = purity.analyze(code)
+        purity_by_version.clear()  # Only the latest version is ever asked for again
+        purity_by_version[version] = result
+    return result
+
+
+def filter_gradio_code(code):
+    """Strip the Gradio import and interface/launch lines so the tool code can run in-process."""
+    lines = code.split('\n')
     filtered_lines = []
     skip_mode = False
     in_demo_block = False
@@ -121,7 +199,67 @@ def execute_blockly_logic(user_inputs):
         if not skip_mode:
             filtered_lines.append(line)
     
-    code_to_run = '\n'.join(filtered_lines)
+    return '\n'.join(filtered_lines)
+
+
+class PreparedCode:
+    """The filtered, compiled tool code and its argument converters for one code version."""
+
+    def __init__(self, version, code):
+        self.version = version
+        self.code = compile(filter_gradio_code(code), "<blockly>", "exec")
+        self.converters = None  # Built from create_mcp's signature on the first run
+
+
+_prepared = None
+
+
+def prepare_code(code, version):
+    """Compile the code once per code version."""
+    global _prepared
+    prepared = _prepared
+    if prepared is None or prepared.version != version:
+        prepared = _prepared = PreparedCode(version, code)
+    return prepared
+
+
+def _cache_key(version, typed_args):
+    # Types are part of the key so 1 and 1.0 or "1" and 1 stay separate
+    return version, repr(tuple((type(arg).__name__, arg) for arg in typed_args))
+
+
+# Helpers the generated code defines for calls that can take long (see src/index.js)
+CANCELLABLE_HELPERS = ("llm_call", "call_api")
+
+
+def guard_helpers(env, token):
+    """Make the generated helpers check token, so an abandoned run stops at its next model or API call."""
+    for name in CANCELLABLE_HELPERS:
+        helper = env.get(name)
+        if not callable(helper):
+            continue
+
+        def checked(*args, _helper=helper, **kwargs):
+            token.raise_if_cancelled()
+            result = _helper(*args, **kwargs)
+            token.raise_if_cancelled()
+            return result
+
+        env[name] = checked
+
+
+def _execute_blockly_logic(user_inputs, token):
+    global latest_blockly_code, stored_api_key
+    if not latest_blockly_code.strip():
+        return "No Blockly code available", ""
+    code_version = latest_code_version
+
+    # Ensure API key is set in environment before executing
+    if stored_api_key:
+        os.environ["OPENAI_API_KEY"] = stored_api_key
+
+    result = ""
+    cache_status = ""
 
     def capture_result(msg):
         nonlocal result
@@ -134,80 +272,70 @@ def execute_blockly_logic(user_inputs):
     }
 
     try:
+        prepared = prepare_code(latest_blockly_code, code_version)
         # Import any required modules in the execution environment
         exec("import os", env)
-        exec(code_to_run, env)
+        exec(prepared.code, env)
+        guard_helpers(env, token)
         if "create_mcp" in env:
-            sig = inspect.signature(env["create_mcp"])
-            params = list(sig.parameters.values())
-
-            typed_args = []
-            for i, arg in enumerate(user_inputs):
-                if i >= len(params):
-                    break
-                if arg is None or arg == "":
-                    typed_args.append(None)
-                    continue
-
-                anno = params[i].annotation
-                try:
-                    if anno == int:
-                        typed_args.append(int(arg))
-                    elif anno == float:
-                        typed_args.append(float(arg))
-                    elif anno == bool:
-                        # Handle boolean conversion from string (checkbox in Gradio sends True/False)
-                        if isinstance(arg, bool):
-                            typed_args.append(arg)
-                        else:
-                            typed_args.append(str(arg).lower() in ("true", "1"))
-                    elif anno == list:
-                        try:
-                            # Convert string like '["a", "b", "c"]' into an actual list
-                            typed_args.append(ast.literal_eval(arg))
-                        except Exception:
-                            # If parsing fails, wrap it as a single-item list
-                            typed_args.append([arg])
-                    elif anno == str or anno == inspect._empty:
-                        typed_args.append(str(arg))
-                    else:
-                        # Handle remaining type cases
-                        typed_args.append(arg)
-                except ValueError:
-                    # If type conversion fails, try to coerce intelligently
-                    if anno == float:
-                        try:
-                            typed_args.append(float(arg))
-                        except Exception:
-                            typed_args.append(arg)
-                    elif anno == int:
-                        try:
-                            typed_args.append(int(float(arg)))  # Allow "3.5" to become 3
-                        except Exception:
-                            typed_args.append(arg)
-                    else:
-                        typed_args.append(arg)
-                except Exception:
-                    # If conversion fails, pass the raw input
-                    typed_args.append(arg)
+            if prepared.converters is None:
+                prepared.converters = build_converters(env["create_mcp"])
+            typed_args = coerce_args(prepared.converters, user_inputs)
+
+            tool_purity = code_purity(latest_blockly_code, code_version)
+            cache_key = _cache_key(code_version, typed_args) if tool_purity.pure else None
+            hit = False
+            if cache_key is not None:
+                with result_cache_lock:
+                    hit = cache_key in result_cache
+                    if hit:
+                        result_cache.move_to_end(cache_key)
+                        cached = result_cache[cache_key]
+            if hit:
+                metrics.TEST_CACHE_HITS.inc()
+                return copy.deepcopy(cached), "Result served from cache (pure tool, same inputs)"
+
+            # Uploaded tables are only read now, after a cache hit had the chance to skip it
+            for i, arg in enumerate(typed_args):
+                if isinstance(arg, TableInput):
+                    typed_args[i] = arg.frame if i == 0 else arg.as_list()
 
             if len(typed_args) > 0 and isinstance(typed_args[0], list):
                 typed_args[0] = pd.DataFrame(typed_args[0])
 
-            result = env["create_mcp"](*typed_args)
+            # Runs on a worker thread so Stop returns right away; the run itself stops at its next helper call
+            result = run_cancellable(lambda: env["create_mcp"](*typed_args), token)
+
+            if cache_key is not None:
+                metrics.TEST_CACHE_MISSES.inc()
+                stored = copy.deepcopy(result)
+                with result_cache_lock:
+                    result_cache[cache_key] = stored
+                    result_cache.move_to_end(cache_key)
+                    while len(result_cache) > TEST_RESULT_CACHE_SIZE:
+                        result_cache.popitem(last=False)
+                cache_status = "Executed; result cached for these inputs (pure tool)"
+            else:
+                cache_status = "Executed; not cached because the tool " + ", ".join(tool_purity.reasons)
         elif "process_input" in env:
-            env["process_input"](user_inputs)
+            run_cancellable(lambda: env["process_input"](user_inputs), token)
+    except Cancelled as e:
+        metrics.EXECUTIONS_CANCELLED.inc()
+        result = "Run cancelled"
+        cache_status = f"Stopped ({e.reason}); nothing was cached"
     except Exception as e:
+        metrics.EXECUTION_ERRORS.inc()
         print("[EXECUTION ERROR]", e)
         result = f"Error: {str(e)}"
 
-    return result if result is not None and result != "" else "No output generated"
+    return (result if result is not None and result != "" else "No output generated"), cache_status
 
 
 def build_interface():
     with gr.Blocks(title="Test MCP Server") as demo:
         # Create a fixed number of potential input fields (max 10)
         input_fields = []
+        file_fields = []
         input_labels = []
         input_group_items = []
         
@@ -217,6 +345,10 @@ def build_interface():
                 txt = gr.Textbox(label=f"Input {i+1}", visible=False)
                 input_fields.append(txt)
                 input_group_items.append(txt)
+                # List inputs can also be uploaded as a table file instead of typed in
+                upload = gr.File(label=f"Input {i+1} file", file_types=tables.TABLE_FILE_TYPES,
+                                 type="filepath", visible=False)
+                file_fields.append(upload)
 
         output_fields = []
         
@@ -224,11 +356,25 @@ def build_interface():
             for i in range(10):
                 out = gr.Textbox(label=f"Output {i+1}", visible=False, interactive=False)
                 output_fields.append(out)
+
+        # Large results: a page at a time, plus the full result as a file
+        result_state = gr.State(None)
+        page_state = gr.State(0)
+        with gr.Accordion("Large result", open=True, visible=False) as large_result_group:
+            preview = gr.Dataframe(label="Preview", interactive=False)
+            with gr.Row():
+                prev_btn = gr.Button("Previous page")
+                page_info = gr.Markdown("")
+                next_btn = gr.Button("Next page")
+            download = gr.File(label="Download full result", interactive=False)
         
         with gr.Row():
             submit_btn = gr.Button("Test")
+            stop_btn = gr.Button("Stop")
             refresh_btn = gr.Button("Refresh")
 
+        cache_status = gr.Markdown("")
+
         def refresh_inputs():
             global latest_blockly_code
             import re
@@ -310,26 +456,63 @@ def build_interface():
 
             # Update visibility + clear input fields
             updates = []
+            file_updates = []
             for i, field in enumerate(input_fields):
                 if i < len(params):
                     param = params[i]
                     note = ""
                     if param["type"] == "list":
-                        note = "- (use like: [\"a\", \"b\", ...])"
+                        note = "- (use like: [\"a\", \"b\", ...] or upload a file)"
 
                     updates.append(gr.update(
                         visible=True,
                         label=f"{param['name']} ({param['type']}) {note}",
                         value=""
                     ))
+                    file_updates.append(gr.update(
+                        visible=param["type"] == "list",
+                        label=f"{param['name']} file (CSV, JSON or Parquet)",
+                        value=None
+                    ))
                 else:
                     updates.append(gr.update(visible=False, value=""))
-
-            return updates + output_updates
-
-        def process_input(*args):
-            result = execute_blockly_logic(args)
-
+                    file_updates.append(gr.update(visible=False, value=None))
+
+            return updates + file_updates + output_updates + [gr.update(visible=False), None, 0]
+
+        def show_page(result, page):
+            frame = tables.to_frame(result)
+            rows, page, pages = tables.page_of(frame, page)
+            return rows, f"Page {page + 1} of {pages} ({len(frame)} rows)", page
+
+        def change_page(result, page, step):
+            if result is None:
+                return gr.update(), "", 0
+            return show_page(result, page + step)
+
+        # The request comes first: Gradio only injects it into positional parameters
+        def process_input(request: gr.Request, *args):
+            texts, files = args[:len(input_fields)], args[len(input_fields):]
+            user_inputs = [TableInput(path) if path else text for text, path in zip(texts, files)]
+            result, status = execute_blockly_logic(user_inputs, getattr(request, "session_hash", None))
+
+            # Big list results are paged and offered as a file instead of rendered into a Textbox
+            large = (
+                isinstance(result, pd.DataFrame)
+                or (isinstance(result, (list, tuple)) and first_output_is_list() and tables.is_large(result))
+            )
+            if large:
+                rows, info, page = show_page(result, 0)
+                summary = f"{len(result)} rows, shown below (download for the full result)"
+                return ([summary] + [""] * 9 + [status, gr.update(visible=True), rows, info,
+                                                tables.write_result_file(result), result, page])
+            if isinstance(result, str) and tables.is_large(result):
+                summary = result[:2000] + f"\n... ({len(result)} characters, download for the full result)"
+                return ([summary] + [""] * 9 + [status, gr.update(visible=True), None, "",
+                                                tables.write_result_file(result), None, 0])
+            return format_outputs(result) + [status, gr.update(visible=False), None, "", None, None, 0]
+
+        def output_types():
             # Get output types to determine how to format the result
             import re
             out_types_match = re.search(r'out_types\s*=\s*(\[.*?\])', latest_blockly_code, re.DOTALL)
@@ -349,11 +532,17 @@ def build_interface():
                     ]
                 except Exception:
                     out_types = []
+            return out_types
+
+        def first_output_is_list():
+            out_types = output_types()
+            return bool(out_types) and out_types[0] in ("list", "any")
 
+        def format_outputs(result):
             # If result is a tuple or list
             if isinstance(result, (tuple, list)):
                 # Check if the first output type is "list" or "any" - if so, convert to string representation
-                if out_types and out_types[0] in ("list", "any"):
+                if first_output_is_list():
                     return [str(result)] + [""] * 9
                 else:
                     # Multiple outputs - each item is a separate output
@@ -365,14 +554,38 @@ def build_interface():
         # When refresh is clicked, update input field visibility and labels
         refresh_btn.click(
             refresh_inputs,
-            outputs=input_fields + output_fields,
+            outputs=input_fields + file_fields + output_fields + [large_result_group, result_state, page_state],
             queue=False
         )
         
         submit_btn.click(
             process_input,
-            inputs=input_fields,
-            outputs=output_fields,
+            inputs=input_fields + file_fields,
+            outputs=output_fields + [cache_status, large_result_group, preview, page_info, download,
+                                     result_state, page_state],
+            queue=False
+        )
+
+        def stop_run(request: gr.Request):
+            cancel_test_run("stopped by user", request.session_hash)
+
+        def close_run(request: gr.Request):
+            cancel_test_run("tab closed", request.session_hash)
+
+        stop_btn.click(stop_run, None, None, queue=False)
+        demo.unload(close_run)
+
+        prev_btn.click(
+            lambda result, page: change_page(result, page, -1),
+            inputs=[result_state, page_state],
+            outputs=[preview, page_info, page_state],
+            queue=False
+        )
+
+        next_btn.click(
+            lambda result, page: change_page(result, page, 1),
+            inputs=[result_state, page_state],
+            outputs=[preview, page_info, page_state],
             queue=False
         )
 
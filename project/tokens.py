@@ -0,0 +1,23 @@
+"""
+Local token counting for prompt budgeting.
+
+Uses tiktoken when it is installed; otherwise falls back to a character based
+estimate (~4 characters per token for English text and code).
+"""
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Return the (approximate) number of model tokens in text."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
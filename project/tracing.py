@@ -0,0 +1,207 @@
+"""
+Structured per-turn tracing for the chat agent loop.
+
+Each chat turn is a trace made of nested spans (turn -> iteration -> model call /
+tool call -> queue wait / browser result). Finished traces are kept in a bounded
+in-memory ring buffer, can be exported as JSON, and are optionally appended to a
+local file in the OTLP/JSON format (one export request per line) when
+TRACE_OTLP_FILE is set.
+
+Spans are passed explicitly as parents because the chat handler is an async
+generator, and a context variable set before one of its yields is not reliably
+there after it. The one exception is the tool call span: chat.py makes it
+current with set_current() around each tool call, which does not yield, so
+wait_for_result can attach the queue wait and browser round trip spans to it.
+"""
+
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_OTLP_FILE = os.getenv("TRACE_OTLP_FILE", "")
+
+SERVICE_NAME = "mcp-blockly-chat"
+
+_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+_traces_lock = threading.Lock()
+_file_lock = threading.Lock()
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent=None, start_ns=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns = None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.status = "ok"
+        self.status_message = ""
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def duration(self):
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+        return self
+
+    def error(self, message):
+        self.status = "error"
+        self.status_message = str(message)
+
+    def end(self, end_ns=None):
+        if self.end_ns is None:
+            self.end_ns = end_ns if end_ns is not None else time.time_ns()
+
+    def child(self, name, **attributes):
+        return Span(name, self.trace_id, parent=self, **attributes)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Open a child span for the duration of the with-block."""
+        child = self.child(name, **attributes)
+        try:
+            yield child
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                child.error(e)
+            raise
+        finally:
+            child.end()
+
+    def record(self, name, start, end, **attributes):
+        """Add an already finished child span from two time.time() timestamps."""
+        child = Span(name, self.trace_id, parent=self, start_ns=int(start * 1e9), **attributes)
+        child.end(int(end * 1e9))
+        return child
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def total(self, name):
+        """Total duration of descendant spans with the given name."""
+        return sum(span.duration for span in self.walk() if span.name == name and span is not self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent.span_id if self.parent else None,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_s": round(self.duration, 6),
+            "status": self.status,
+            "status_message": self.status_message,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+def start_trace(name, **attributes):
+    """Start the root span of a new trace. Call finish_trace() with it when done."""
+    return Span(name, secrets.token_hex(16), **attributes)
+
+
+def finish_trace(root):
+    """End the root span, store the trace in the ring buffer and export it if configured."""
+    root.end()
+    for span in root.walk():
+        span.end(root.end_ns)
+    with _traces_lock:
+        _traces.append(root)
+    if TRACE_OTLP_FILE:
+        try:
+            line = json.dumps(to_otlp([root]))
+            with _file_lock, open(TRACE_OTLP_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            print(f"[TRACE WARN] Could not write OTLP file: {e}")
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_current(span):
+    """Make span current until reset_current(token), which must run before the handler yields again."""
+    return _current_span.set(span)
+
+
+def reset_current(token):
+    _current_span.reset(token)
+
+
+def recent_traces(limit=None):
+    with _traces_lock:
+        traces = list(_traces)
+    if limit:
+        traces = traces[-limit:]
+    return traces
+
+
+def export_json(limit=None):
+    return [trace.to_dict() for trace in recent_traces(limit)]
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp(traces):
+    """Convert traces to an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for root in traces:
+        for span in root.walk():
+            spans.append({
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent.span_id if span.parent else "",
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                "attributes": _otlp_attributes(span.attributes),
+                "status": {"code": 2, "message": span.status_message} if span.status == "error" else {"code": 1},
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]
+    }
+
+
+def summarize(root):
+    """One line summary of a finished turn for the console."""
+    iterations = sum(1 for span in root.children if span.name == "iteration")
+    return (
+        f"{root.name} {root.trace_id[:8]}: {iterations} iterations in {root.duration:.2f}s "
+        f"(model {root.total('model_call'):.2f}s, tools {root.total('tool_call'):.2f}s, "
+        f"queue {root.total('queue_wait'):.2f}s, browser {root.total('browser_result'):.2f}s)"
+    )
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import gradio as gr
@@ -35,13 +35,34 @@ async def set_api_key_chat_route(request: Request):
     return await chat.set_api_key_chat(request)
 
 @app.get("/unified_stream")
-async def unified_stream_route():
-    return await chat.unified_stream()
+async def unified_stream_route(request: Request, last_event_id: str = None):
+    return await chat.unified_stream(request, last_event_id)
+
+# One WebSocket for operations, results, chat and code updates; also takes update_code for test.py
+@app.websocket("/ws")
+async def workspace_socket_route(websocket: WebSocket, last_event_id: str = None):
+    await chat.serve_workspace_socket(websocket, last_event_id, {"update_code": test.apply_code_update})
 
 @app.post("/request_result")
 async def request_result_route(request: Request):
     return await chat.request_result(request)
 
+@app.get("/metrics")
+async def metrics_route():
+    return await chat.metrics_endpoint()
+
+@app.get("/traces")
+async def traces_route(limit: int = 20, format: str = "json"):
+    return await chat.traces_endpoint(limit, format)
+
+@app.get("/usage")
+async def usage_route(session: str = None, limit: int = 50):
+    return await chat.usage_endpoint(session, limit)
+
+@app.get("/dead_letters")
+async def dead_letters_route():
+    return await chat.dead_letters_endpoint()
+
 
 # === test.py API endpoints ===
 @app.post("/update_code")
@@ -52,6 +73,18 @@ async def update_code_route(request: Request):
 async def get_latest_code_route():
     return await test.get_latest_code()
 
+@app.post("/start_preview")
+async def start_preview_route():
+    return await test.start_preview()
+
+@app.post("/stop_preview")
+async def stop_preview_route():
+    return await test.stop_preview()
+
+@app.get("/preview_status")
+async def preview_status_route():
+    return await test.preview_status()
+
 @app.get("/get_api_key")
 async def get_api_key_route():
     return await test.get_api_key_endpoint()
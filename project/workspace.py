@@ -0,0 +1,244 @@
+"""
+Server-side mirror of the Blockly workspace.
+
+The browser sends the workspace as chat DSL text on every change: one
+`↿ id ↾ block(inputs(...))` command per block, statement bodies indented under
+the block that contains them, and the variables as `↿ id ↾ name` lines.
+WorkspaceMirror parses that into blocks indexed by id, type, parent and
+variable, and is updated directly as the agent's operations succeed, so it stays
+current between two snapshots from the browser.
+
+It answers find_blocks queries for the model (instead of sending the whole
+workspace with every call) and lets the tools reject operations on block ids
+that do not exist without a round trip to the browser.
+"""
+
+import re
+import threading
+from collections import Counter, defaultdict
+
+_MARKER_RE = re.compile(r"↿\s*(\S+?)\s*↾\s*")
+_TYPE_RE = re.compile(r"\s*([A-Za-z_]\w*)\s*\(")
+
+# Parent id used in queries for top-level blocks
+ROOT = "root"
+
+
+class MirrorBlock:
+    __slots__ = ("id", "type", "command", "parent", "children", "variables", "from_operation")
+
+    def __init__(self, block_id, command, parent=None, from_operation=False):
+        self.id = block_id
+        self.command = command
+        match = _TYPE_RE.match(command)
+        self.type = match.group(1) if match else "unknown"
+        self.parent = parent
+        self.children = []
+        self.variables = set()  # ids of the variables the command mentions
+        self.from_operation = from_operation  # Added by a tool call rather than read from a snapshot
+
+    def describe(self):
+        parent = self.parent or ROOT
+        return f"↿ {self.id} ↾ {self.command}  [parent: {parent}, children: {len(self.children)}]"
+
+
+def parse_blocks(code):
+    """
+    Split chat DSL text into (block id, command, indent) in document order.
+
+    Blocks chained after another one can end up on the same line, so every marker
+    starts a block and a marker in the middle of a line gets the line's indent.
+    """
+    blocks = []
+    for line in code.splitlines():
+        markers = list(_MARKER_RE.finditer(line))
+        if not markers:
+            continue  # "Else:" labels and other layout lines
+        indent = len(line) - len(line.lstrip())
+        for index, marker in enumerate(markers):
+            end = markers[index + 1].start() if index + 1 < len(markers) else len(line)
+            blocks.append((marker.group(1), line[marker.end():end].strip(), indent))
+    return blocks
+
+
+def parse_variables(var_string):
+    """Variable id -> name from the browser's `↿ id ↾ name` lines."""
+    variables = {}
+    for line in var_string.splitlines():
+        marker = _MARKER_RE.search(line)
+        if marker:
+            variables[marker.group(1)] = line[marker.end():].strip()
+    return variables
+
+
+class WorkspaceMirror:
+    def __init__(self):
+        self.code = None
+        self.var_string = None
+        self.blocks = {}  # id -> MirrorBlock
+        self.variables = {}  # variable id -> name
+        self._by_type = defaultdict(set)
+        self.version = 0  # Incremented on every change
+        self._lock = threading.Lock()
+
+    @property
+    def synced(self):
+        """True once the browser has sent a snapshot, so missing ids really are missing."""
+        return self.code is not None
+
+    def load(self, code, var_string=""):
+        """Rebuild the mirror from a browser snapshot. Unchanged snapshots are skipped."""
+        with self._lock:
+            if code == self.code and var_string == self.var_string:
+                return
+            previous = self.blocks
+            self.version += 1
+            self.code = code
+            self.var_string = var_string
+            self.variables = parse_variables(var_string or "")
+            self.blocks = {}
+            self._by_type = defaultdict(set)
+
+            stack = []  # (indent, block id) of the blocks enclosing the current line
+            for block_id, command, indent in parse_blocks(code or ""):
+                while stack and stack[-1][0] >= indent:
+                    stack.pop()
+                self._add_locked(MirrorBlock(block_id, command, stack[-1][1] if stack else None))
+                stack.append((indent, block_id))
+
+            # Value blocks plugged into an input have no id in the DSL. Keep the ones the agent
+            # created while their parent still exists, so they can still be replaced or deleted.
+            for block in previous.values():
+                if block.from_operation and block.id not in self.blocks and block.parent in self.blocks:
+                    self._add_locked(MirrorBlock(block.id, block.command, block.parent, from_operation=True))
+
+    def ids(self):
+        """(variable ids, block ids), each in workspace order."""
+        with self._lock:
+            return list(self.variables), list(self.blocks)
+
+    def has_variable_name(self, name):
+        with self._lock:
+            return name in self.variables.values()
+
+    def exists(self, block_id):
+        with self._lock:
+            return block_id in self.blocks
+
+    def add_block(self, block_id, command, parent=None):
+        """Record a block created by a successful create operation."""
+        with self._lock:
+            self.version += 1
+            if block_id in self.blocks:
+                self._remove_locked(block_id)
+            self._add_locked(MirrorBlock(block_id, command, parent if parent in self.blocks else None,
+                                         from_operation=True))
+
+    def remove_block(self, block_id):
+        """Record a successful delete; the block's children go with it, like in Blockly."""
+        with self._lock:
+            self.version += 1
+            self._remove_locked(block_id)
+
+    def replace_block(self, old_id, new_id, command):
+        """Record a successful replace: the new block takes the old one's place and children."""
+        with self._lock:
+            self.version += 1
+            old = self.blocks.get(old_id)
+            if old is None:
+                self._add_locked(MirrorBlock(new_id, command, from_operation=True))
+                return
+            children = list(old.children)
+            self._detach_locked(old)
+            block = MirrorBlock(new_id, command, old.parent, from_operation=True)
+            self._add_locked(block)
+            for child_id in children:
+                child = self.blocks.get(child_id)
+                if child is not None:
+                    child.parent = new_id
+                    block.children.append(child_id)
+
+    def add_variable(self, variable_id, name):
+        with self._lock:
+            self.version += 1
+            self.variables[variable_id] = name
+
+    def find(self, block_type=None, parent_id=None, text=None, variable=None, limit=20):
+        """
+        Blocks matching every given filter, in workspace order.
+
+        Args:
+            block_type: Exact block type
+            parent_id: Id of the enclosing block, or "root" for top-level blocks
+            text: Case-insensitive substring of the block's command
+            variable: Variable name or id the block uses
+            limit: Maximum number of blocks returned
+
+        Returns:
+            (matching blocks up to limit, total number of matches)
+        """
+        with self._lock:
+            if block_type is not None:
+                candidates = [self.blocks[i] for i in self.blocks if i in self._by_type.get(block_type, ())]
+            else:
+                candidates = list(self.blocks.values())
+            if parent_id is not None:
+                wanted = None if parent_id == ROOT else parent_id
+                candidates = [b for b in candidates if b.parent == wanted]
+            if text:
+                needle = text.lower()
+                candidates = [b for b in candidates if needle in b.command.lower()]
+            if variable:
+                ids = {i for i, name in self.variables.items() if variable in (i, name)}
+                candidates = [b for b in candidates if b.variables & ids]
+            return candidates[:limit], len(candidates)
+
+    def get(self, block_id):
+        with self._lock:
+            return self.blocks.get(block_id)
+
+    def children_of(self, block_id):
+        with self._lock:
+            block = self.blocks.get(block_id)
+            return [self.blocks[i] for i in block.children if i in self.blocks] if block else []
+
+    def summary(self, top_level_limit=20):
+        """Short overview for the model: counts by type, the top-level blocks and the variables."""
+        with self._lock:
+            types = Counter(block.type for block in self.blocks.values())
+            top_level = [block for block in self.blocks.values() if block.parent is None]
+            variables = dict(self.variables)
+        lines = [f"{len(self.blocks)} blocks. Types: " + ", ".join(f"{name} x{count}" for name, count in types.most_common())]
+        lines.append("Top-level blocks:")
+        lines.extend(block.describe() for block in top_level[:top_level_limit])
+        if len(top_level) > top_level_limit:
+            lines.append(f"... and {len(top_level) - top_level_limit} more")
+        if variables:
+            lines.append("Variables: " + ", ".join(f"{name} ({variable_id})" for variable_id, name in variables.items()))
+        return "\n".join(lines)
+
+    def _add_locked(self, block):
+        block.variables = {
+            variable_id for variable_id, name in self.variables.items()
+            if variable_id in block.command or f'"{name}"' in block.command
+        }
+        self.blocks[block.id] = block
+        self._by_type[block.type].add(block.id)
+        parent = self.blocks.get(block.parent) if block.parent else None
+        if parent is not None and block.id not in parent.children:
+            parent.children.append(block.id)
+
+    def _detach_locked(self, block):
+        self.blocks.pop(block.id, None)
+        self._by_type[block.type].discard(block.id)
+        parent = self.blocks.get(block.parent) if block.parent else None
+        if parent is not None and block.id in parent.children:
+            parent.children.remove(block.id)
+
+    def _remove_locked(self, block_id):
+        block = self.blocks.get(block_id)
+        if block is None:
+            return
+        for child_id in list(block.children):
+            self._remove_locked(child_id)
+        self._detach_locked(block)